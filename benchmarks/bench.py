@@ -0,0 +1,238 @@
+"""End-to-end download benchmark against the local mock server
+
+Drives `download_stories` (or `download_stories_async`) against a
+`MockInstagram` server and reports throughput, p50 and p99 per-item download
+latency and peak RSS. Run from the repository root:
+
+    python benchmarks/bench.py --users 200 --latency 0.02 --json bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_server import MockInstagram  # noqa: E402
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of `values`."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if platform.system() == "Darwin" else usage * 1024
+
+
+def timed(fetch, latencies: list):
+    """Wrap a download callable to record its duration in `latencies`."""
+    if asyncio.iscoroutinefunction(fetch):
+
+        async def run(url, dest):
+            start = time.perf_counter()
+            try:
+                return await fetch(url, dest)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+    else:
+
+        def run(url, dest):
+            start = time.perf_counter()
+            try:
+                return fetch(url, dest)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+    return run
+
+
+def run_once(server: MockInstagram, options, directory: str) -> dict:
+    """Download every story of the mock tray into an empty `directory`."""
+    from instagram.index import DownloadIndex
+    from instagram.main import download_stories
+    from instagram.main import download_stories_async
+    from instagram.selection import Selection
+
+    config = {
+        "username": "bench",
+        "id": "1",
+        "media_directory": os.path.join(directory, "media"),
+        "json_backup": os.path.join(directory, "json"),
+        "download": True,
+        "headers": {"cookie": "sessionid=bench"},
+        "api_url": server.api_url,
+    }
+    index = DownloadIndex(os.path.join(directory, "index.sqlite3"))
+    latencies = []
+
+    start = time.perf_counter()
+    try:
+        if options.backend == "async":
+            from instagram.aio import AsyncDownloader
+
+            class Timed(AsyncDownloader):
+                def submit(self, fetch, url, dest):
+                    return super().submit(timed(fetch, latencies), url, dest)
+
+            downloader = Timed(options.workers, options.per_host)
+            stats = asyncio.run(
+                download_stories_async(
+                    config, Selection(), options, downloader=downloader, index=index
+                )
+            )
+        else:
+            from instagram.downloader import Downloader
+
+            class Timed(Downloader):
+                def submit(self, fetch, url, dest):
+                    return super().submit(timed(fetch, latencies), url, dest)
+
+            downloader = Timed(options.workers, options.per_host)
+            try:
+                stats = download_stories(
+                    config, Selection(), options, downloader=downloader, index=index
+                )
+            finally:
+                downloader.close()
+    finally:
+        index.close()
+    elapsed = time.perf_counter() - start
+
+    size = 0
+    for dirpath, _, filenames in os.walk(config["media_directory"]):
+        size += sum(os.path.getsize(os.path.join(dirpath, a)) for a in filenames)
+    return {
+        "seconds": round(elapsed, 3),
+        "items": stats["downloaded"],
+        "failed": stats["failed"],
+        "retries": stats["retries"],
+        "corrupt": stats["corrupt"],
+        "bytes": size,
+        "items_per_second": round(stats["downloaded"] / elapsed, 2),
+        "bytes_per_second": round(size / elapsed, 1),
+        "p50": round(percentile(latencies, 0.50), 4),
+        "p99": round(percentile(latencies, 0.99), 4),
+        "mean": round(statistics.mean(latencies), 4) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100, help="Reels in the tray")
+    parser.add_argument("--items", type=int, default=3, help="Stories per reel")
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds")
+    parser.add_argument(
+        "--bandwidth", type=int, default=0, help="Bytes/s per response, 0 unlimited"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--image-size", type=int, default=150000)
+    parser.add_argument("--video-size", type=int, default=1500000)
+    parser.add_argument("--backend", choices=["sync", "async"], default="sync")
+    parser.add_argument("-w", "--workers", type=int, default=8)
+    parser.add_argument("--per-host", type=int, default=8)
+    parser.add_argument("--chunk-size", type=int, default=8)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--stream-json", action="store_true")
+    parser.add_argument("--verify", action="store_true")
+    parser.add_argument("--verify-workers", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs")
+    parser.add_argument("--json", type=str, help="Write the results to this file")
+    args = parser.parse_args()
+
+    # Keep cookies and logs of the benchmark out of the real home directory
+    home = tempfile.mkdtemp(prefix="instagram-story-bench-")
+    os.environ["HOME"] = home
+    from instagram.version import __version__
+
+    options = argparse.Namespace(
+        workers=args.workers,
+        per_host=args.per_host,
+        chunk_size=args.chunk_size,
+        prefetch=args.prefetch,
+        api_rate=1000.0,
+        cdn_rate=100000.0,
+        retries=4,
+        backend=args.backend,
+        pool_size=max(args.workers, args.per_host),
+        stream_json=args.stream_json,
+        verify=args.verify,
+        verify_workers=args.verify_workers,
+        metrics=None,
+        prometheus=None,
+    )
+    server = MockInstagram(
+        users=args.users,
+        items=args.items,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        image_size=args.image_size,
+        video_size=args.video_size,
+    ).start()
+
+    runs = []
+    try:
+        for n in range(args.repeat):
+            directory = os.path.join(home, "run-{}".format(n))
+            runs.append(run_once(server, options, directory))
+            shutil.rmtree(directory)
+            print(
+                "run {n}: {items} items, {mb:.1f} MB in {seconds:.2f} s, "
+                "{items_per_second:.1f} items/s, {mbs:.1f} MB/s, "
+                "p50 {p50:.3f} s, p99 {p99:.3f} s".format(
+                    n=n,
+                    mb=runs[-1]["bytes"] / 1e6,
+                    mbs=runs[-1]["bytes_per_second"] / 1e6,
+                    **runs[-1]
+                ),
+                file=sys.stderr,
+            )
+    finally:
+        server.shutdown()
+        shutil.rmtree(home, ignore_errors=True)
+
+    best = max(runs, key=lambda a: a["items_per_second"])
+    result = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "parameters": vars(args),
+        "runs": runs,
+        "best": best,
+        "median_items_per_second": statistics.median(
+            a["items_per_second"] for a in runs
+        ),
+        "peak_rss": peak_rss(),
+        "server": dict(server.counters),
+    }
+    print(
+        "best of {}: {:.1f} items/s, {:.1f} MB/s, p50 {:.3f} s, p99 {:.3f} s, "
+        "peak RSS {:.1f} MB".format(
+            len(runs),
+            best["items_per_second"],
+            best["bytes_per_second"] / 1e6,
+            best["p50"],
+            best["p99"],
+            result["peak_rss"] / 1e6,
+        )
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
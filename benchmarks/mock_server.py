@@ -0,0 +1,214 @@
+"""Local HTTP server emulating the Instagram private API and media CDN
+
+Serves `feed/reels_tray/` and `feed/reels_media/` below `/api/v1/` and
+synthetic images and videos below `/cdn/`, with configurable latency,
+bandwidth, error rate and tray size. Media requests may resume with a
+`Range` header.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+
+def _box(kind: bytes, payload: bytes) -> bytes:
+    return (8 + len(payload)).to_bytes(4, "big") + kind + payload
+
+
+def synthetic_media(ext: str, size: int, width: int, height: int) -> bytes:
+    """Bytes of `size` forming a well-formed JPEG or MP4 file.
+
+    The file carries `width` and `height` where `check_media` looks for
+    them: in the start of frame segment of the JPEG or the track header of
+    the MP4, whose payload is an `mdat` box of random bytes.
+    """
+    body = bytes(random.Random(size).getrandbits(8) for _ in range(4096))
+    if ext == ".jpg":
+        head = (
+            b"\xff\xd8"
+            + b"\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+        )
+        head += b"\xff\xc0\x00\x11\x08" + height.to_bytes(2, "big")
+        head += width.to_bytes(2, "big") + b"\x03\x01\x22\x00\x02\x11\x01\x03\x11\x01"
+        tail = b"\xff\xd9"
+        fill = max(0, size - len(head) - len(tail))
+        return head + (body * (fill // len(body) + 1))[:fill] + tail
+
+    # Version 0 track header: flags, times, track ID and duration, then
+    # layer, volume and matrix precede the 16.16 fixed point dimensions
+    tkhd = (
+        bytes(76) + (width << 16).to_bytes(4, "big") + (height << 16).to_bytes(4, "big")
+    )
+    head = _box(b"ftyp", b"mp42\x00\x00\x00\x00mp42isom")
+    head += _box(b"moov", _box(b"trak", _box(b"tkhd", tkhd)))
+    fill = max(0, size - len(head) - 8)
+    return head + _box(b"mdat", (body * (fill // len(body) + 1))[:fill])
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.count("requests")
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and server.random.random() < server.error_rate:
+            server.count("errors")
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        url = urlparse(self.path)
+        if url.path.endswith("/feed/reels_tray/"):
+            content = {"tray": [server.reel(a, items=False) for a in server.users]}
+            self.send_body(json.dumps(content).encode(), "application/json")
+        elif url.path.endswith("/feed/reels_media/"):
+            ids = parse_qs(url.query).get("reel_ids", [])
+            content = {"reels": {a: server.reel(int(a)) for a in ids}, "status": "ok"}
+            self.send_body(json.dumps(content).encode(), "application/json")
+        elif url.path.startswith("/cdn/") and url.path[-6:] in server.media:
+            server.count("media")
+            self.send_media(server.media[url.path[-6:]])
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def send_media(self, body: bytes):
+        """Send a media file, honouring `Range: bytes=<start>-`."""
+        value = self.headers.get("Range") or ""
+        if not value.startswith("bytes=") or not value.endswith("-"):
+            self.send_body(body, "application/octet-stream")
+            return
+        start = int(value[len("bytes=") : -1])
+        if start >= len(body):
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */{}".format(len(body)))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        content_range = "bytes {}-{}/{}".format(start, len(body) - 1, len(body))
+        self.send_body(
+            body[start:],
+            "application/octet-stream",
+            status=206,
+            headers={"Content-Range": content_range},
+        )
+
+    def send_body(self, body: bytes, content_type: str, status=200, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not self.server.bandwidth:
+            self.wfile.write(body)
+            return
+        chunk = 65536
+        for i in range(0, len(body), chunk):
+            self.wfile.write(body[i : i + chunk])
+            time.sleep(min(chunk, len(body) - i) / self.server.bandwidth)
+
+
+class MockInstagram(ThreadingHTTPServer):
+    """Mock Instagram server, run it with `start` and `shutdown`."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        users: int = 100,
+        items: int = 3,
+        latency: float = 0.0,
+        bandwidth: int = 0,
+        error_rate: float = 0.0,
+        image_size: int = 150000,
+        video_size: int = 1500000,
+        port: int = 0,
+    ):
+        """Initialize the server.
+
+        Args:
+            users (int): Number of users with a reel in the tray.
+            items (int): Number of stories per reel, every other is a video.
+            latency (float): Seconds to wait before answering a request.
+            bandwidth (int): Bytes per second per response, 0 is unlimited.
+            error_rate (float): Share of requests answered with 503.
+            image_size (int): Size of the full resolution images in bytes.
+            video_size (int): Size of the videos in bytes.
+            port (int): Port to listen on, 0 picks a free one.
+        """
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.users = list(range(1000, 1000 + users))
+        self.items = items
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(0)
+        self.now = int(time.time())
+        self.media = {
+            "_s.jpg": synthetic_media(".jpg", max(1024, image_size // 4), 320, 568),
+            "_l.jpg": synthetic_media(".jpg", image_size, 1080, 1920),
+            "_l.mp4": synthetic_media(".mp4", video_size, 720, 1280),
+        }
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "errors": 0, "media": 0}
+
+    @property
+    def api_url(self) -> str:
+        return "http://127.0.0.1:{}/api/v1/".format(self.server_address[1])
+
+    def count(self, name: str):
+        with self.lock:
+            self.counters[name] += 1
+
+    def item(self, user_id: int, n: int) -> dict:
+        cdn = "http://127.0.0.1:{}/cdn/{}_{}".format(self.server_address[1], user_id, n)
+        item = {
+            "id": "{}{:03d}_{}".format(user_id, n, user_id),
+            "pk": int("{}{:03d}".format(user_id, n)),
+            "taken_at": self.now - 3600 + n,
+            "expiring_at": self.now + 82800 + n,
+            "media_type": 2 if n % 2 else 1,
+            "image_versions2": {
+                "candidates": [
+                    {"width": 1080, "height": 1920, "url": cdn + "_l.jpg"},
+                    {"width": 320, "height": 568, "url": cdn + "_s.jpg"},
+                ]
+            },
+        }
+        if n % 2:
+            item["video_versions"] = [
+                {"type": 101, "width": 720, "height": 1280, "url": cdn + "_l.mp4"}
+            ]
+        return item
+
+    def reel(self, user_id: int, items: bool = True) -> dict:
+        reel = {
+            "id": user_id,
+            "latest_reel_media": self.now - 3600 + self.items - 1,
+            "expiring_at": self.now + 82800 + user_id % 3600,
+            "seen": 0,
+            "media_count": self.items,
+            "prefetch_count": 0,
+            "user": {"pk": user_id, "username": "user{}".format(user_id)},
+        }
+        if items:
+            reel["items"] = [self.item(user_id, n) for n in range(self.items)]
+        return reel
+
+    def start(self) -> "MockInstagram":
+        """Serve requests in a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -0,0 +1,102 @@
+"""Cold-start import time of the command line tool
+
+Runs `python -X importtime -c "import instagram.main"` in fresh interpreters
+and reports the import time of `instagram.main` with a breakdown by top-level
+package and the slowest modules. Run from the repository root:
+
+    python benchmarks/startup.py --budget 100 --json startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module: str) -> list:
+    """Self and cumulative import time in microseconds of every module.
+
+    Returns:
+        list: `(module, self_us, cumulative_us)` in import order.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=ROOT,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:") :].split("|")
+        times.append((name.strip(), int(self_us), int(cumulative)))
+    return times
+
+
+def breakdown(times: list, module: str) -> dict:
+    """Summarise the imports of one run."""
+    packages = Counter()
+    for name, self_us, _ in times:
+        packages[name.split(".")[0]] += self_us
+    total = next(a[2] for a in reversed(times) if a[0] == module)
+    return {
+        "total_ms": total / 1000,
+        "packages_ms": {a: b / 1000 for a, b in packages.most_common()},
+        "slowest_ms": {
+            a[0]: a[1] / 1000 for a in sorted(times, key=lambda a: -a[1])[:15]
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", type=str, default="instagram.main")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs")
+    parser.add_argument("--top", type=int, default=10, help="Packages to show")
+    parser.add_argument(
+        "--budget", type=float, help="Exit with status 1 above this many ms"
+    )
+    parser.add_argument("--json", type=str, help="Write the results to this file")
+    args = parser.parse_args()
+
+    runs = [
+        breakdown(import_times(args.module), args.module) for _ in range(args.repeat)
+    ]
+    # The fastest run has the least noise from the rest of the system
+    best = min(runs, key=lambda a: a["total_ms"])
+    median = statistics.median(a["total_ms"] for a in runs)
+
+    for name, ms in list(best["packages_ms"].items())[: args.top]:
+        print("{:>8.1f} ms  {}".format(ms, name), file=sys.stderr)
+    print(
+        "import {}: best of {} {:.1f} ms, median {:.1f} ms".format(
+            args.module, len(runs), best["total_ms"], median
+        )
+    )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "parameters": vars(args),
+                    "median_ms": median,
+                    "best": best,
+                },
+                f,
+                indent=2,
+            )
+    if args.budget is not None and median > args.budget:
+        print("over budget of {:.1f} ms".format(args.budget), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
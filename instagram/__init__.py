@@ -1,8 +1,16 @@
 #!/usr/bin/env python
-from .instagram import Instagram
 from .main import main
 
 __all__ = [
     "Instagram",
     "main",
 ]
+
+
+def __getattr__(name):
+    # Importing `Instagram` pulls in requests, defer it until it is used
+    if name == "Instagram":
+        from .instagram import Instagram
+
+        return Instagram
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,380 @@
+"""Asyncio backend for the Instagram class
+
+Requires the optional `httpx` dependency, install it with
+`pip install instagram-story[async]`.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from urllib.parse import urlparse
+
+from .constants import CONTENT_TYPE_TRAY
+from .constants import DEFAULT_CONNECT_RETRIES
+from .constants import DEFAULT_PER_HOST
+from .constants import DEFAULT_POOL_SIZE
+from .constants import DEFAULT_WORKERS
+from .constants import ERROR_ASYNC_BACKEND
+from .constants import INDEX_CHECKSUM
+from .constants import PART_SUFFIX
+from .constants import PARTIAL_CONTENT
+from .constants import RANGE_NOT_SATISFIABLE
+from .constants import STREAM_CHUNK_SIZE
+from .constants import TRACE_CONNECT
+from .constants import VERIFY_REQUEUES
+from .constants import WARNING_RETRY
+from .instagram import expected_size
+from .instagram import IncompleteDownloadError
+from .instagram import Instagram
+from .metrics import REGISTRY
+from .paths import open_file
+from .ratelimit import backoff
+from .ratelimit import retry_after
+from .ratelimit import RETRY_STATUS
+from .stream import JsonStream
+from .stream import TrayEntry
+from .transport import TransportStats
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+
+class AsyncDownloader:
+    """Run media downloads as tasks on the event loop.
+
+    Counterpart of `Downloader`: at most `workers` downloads run at the same
+    time and at most `per_host` of them talk to the same CDN host.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST):
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.slots = None
+        self.hosts = {}
+
+    async def _run(self, fetch, url: str, dest: str):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.workers)
+        host = urlparse(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = asyncio.Semaphore(self.per_host)
+        async with self.slots, self.hosts[host]:
+            return await fetch(url, dest)
+
+    def submit(self, fetch, url: str, dest: str):
+        """Queue `url` for download to `dest`.
+
+        Args:
+            fetch: Coroutine function `fetch(url, dest)` downloading a file.
+            url (str): URL of the media file.
+            dest (str): File system destination.
+
+        Returns:
+            asyncio.Task: Resolves once the download has finished.
+        """
+        return asyncio.ensure_future(self._run(fetch, url, dest))
+
+
+class AsyncInstagram(Instagram):
+    """Instagram session running on an asyncio event loop.
+
+    `get_tray`, `get_reel_chunk`, `download_reel` and `close` are coroutines
+    with the same results as their `Instagram` counterparts. All requests of
+    the account share one `httpx.AsyncClient`, which keeps connections alive
+    and can multiplex many streams over HTTP/2.
+    """
+
+    def __init__(
+        self, config, options, downloader=None, index=None, limiter=None, verifier=None
+    ):
+        """Initialize the session.
+
+        Args:
+            config (dict): Account entry from `config.json`.
+            options: Parsed command line options, `http2` enables HTTP/2.
+            downloader (AsyncDownloader): Task pool shared with other accounts.
+            index (MemoryIndex): Index of downloaded posts.
+            limiter (RateLimiter): Rate limiter shared with other accounts.
+            verifier (Verifier): Process pool checking downloaded files.
+        """
+        if httpx is None:
+            raise ImportError(ERROR_ASYNC_BACKEND)
+
+        super().__init__(
+            config,
+            options,
+            downloader=downloader
+            or AsyncDownloader(
+                workers=getattr(options, "workers", DEFAULT_WORKERS),
+                per_host=getattr(options, "per_host", DEFAULT_PER_HOST),
+            ),
+            index=index,
+            limiter=limiter,
+            verifier=verifier,
+        )
+        self.owns_downloader = False
+
+    def _open_session(self, options):
+        """Create the `httpx.AsyncClient` shared by all requests of the account.
+
+        New connections are counted through the `trace` extension of
+        httpcore, requests as they are sent.
+        """
+        pool_size = getattr(options, "pool_size", DEFAULT_POOL_SIZE)
+        keep_alive = 0 if getattr(options, "no_keep_alive", False) else pool_size
+        connect, read = self.timeout
+        self.transport = TransportStats()
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=httpx.Timeout(read, connect=connect),
+            transport=httpx.AsyncHTTPTransport(
+                http2=getattr(options, "http2", False),
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=keep_alive,
+                ),
+                retries=getattr(options, "connect_retries", DEFAULT_CONNECT_RETRIES),
+            ),
+        )
+
+    async def _trace(self, event: str, info: dict):
+        if event == TRACE_CONNECT:
+            self.transport.add(connections=1)
+
+    async def _aget(self, kind: str, url: str, stream: bool = False, headers=None):
+        """GET `url` through the rate limiter, retrying transient failures.
+
+        Args:
+            kind (str): Endpoint class, `api` or `cdn`.
+            url (str): URL to request.
+            stream (bool): Do not read the body, the caller closes the response.
+            headers (dict): Additional request headers.
+
+        Returns:
+            httpx.Response: Successful response.
+        """
+        bucket = self.limiter[kind]
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            await bucket.acquire_async()
+            start = time.perf_counter()
+            try:
+                request = self.client.build_request(
+                    "GET", url, headers=headers, extensions={"trace": self._trace}
+                )
+                self.transport.add(requests=1)
+                response = await self.client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                REGISTRY.inc("http_errors_total", kind=kind, error=type(e).__name__)
+                if last:
+                    raise
+                delay = backoff(attempt)
+            else:
+                REGISTRY.observe(
+                    "http_request_seconds", time.perf_counter() - start, kind=kind
+                )
+                REGISTRY.inc(
+                    "http_responses_total", kind=kind, status=response.status_code
+                )
+                if response.is_success:
+                    bucket.succeeded()
+                    return response
+                await response.aclose()
+                if last or response.status_code not in RETRY_STATUS:
+                    self.log.error(
+                        "Status Code %s Error for %s.", response.status_code, url
+                    )
+                    response.raise_for_status()
+                wait = retry_after(response)
+                if response.status_code == 429:
+                    bucket.throttled(wait)
+                delay = backoff(attempt) if wait is None else wait
+
+            self.count("retries")
+            self.log.warning(WARNING_RETRY, url, delay)
+            await asyncio.sleep(delay)
+
+    async def _api_request_async(self, endpoint):
+        self.log.debug("Making API request %s", endpoint)
+        with REGISTRY.timer("api_request_seconds"):
+            response = await self._aget("api", endpoint)
+            try:
+                return response.json()
+            except ValueError:
+                raise ValueError("Error parsing json response")
+
+    async def _api_stream_async(self, endpoint: str, key: str, writer=None) -> list:
+        """Request `endpoint` and parse the container `key` incrementally.
+
+        See `Instagram._api_stream`, the raw elements are returned as a list.
+        """
+        self.log.debug("Making streaming API request %s", endpoint)
+        stream = JsonStream(key)
+        found = []
+        with REGISTRY.timer("api_request_seconds"):
+            response = await self._aget("api", endpoint, stream=True)
+        try:
+            async for data in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                if writer is not None:
+                    writer.write(data)
+                found += stream.feed(data)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            await response.aclose()
+        if writer is not None:
+            writer.close()
+        return found
+
+    async def get_tray(self) -> dict:
+        """Get reel tray from Instagram API, see `Instagram.get_tray`."""
+        if not self.stream_json:
+            return self._set_tray(await self._api_request_async(self.endpoint_tray))
+
+        writer = self._response_writer(
+            int(time.time()), CONTENT_TYPE_TRAY.format(self.id)
+        )
+        entries = await self._api_stream_async(self.endpoint_tray, "tray", writer)
+        return self._set_tray({"tray": [TrayEntry(json.loads(a)) for _, a in entries]})
+
+    async def get_reel_chunk(self, user_ids: list) -> dict:
+        """Get reels for a list of user_id, see `Instagram.get_reel_chunk`."""
+        reels = self.cached_reels(user_ids)
+        remaining = [a for a in user_ids if a not in reels]
+        if not remaining:
+            return reels
+
+        endpoint = self._reels_endpoint(remaining)
+        if self.stream_json:
+            for user_id, raw in await self._api_stream_async(endpoint, "reels"):
+                reels[user_id] = self._save_reel(user_id, raw)
+            return reels
+
+        response = await self._api_request_async(endpoint)
+        reels.update(response.get("reels"))
+        return reels
+
+    async def _fetch_part(self, url: str, part: str) -> str:
+        digest = hashlib.new(INDEX_CHECKSUM)
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Range": "bytes={}-".format(offset)} if offset else {}
+
+        try:
+            response = await self._aget("cdn", url, stream=True, headers=headers)
+        except httpx.HTTPStatusError as e:
+            if offset and e.response.status_code == RANGE_NOT_SATISFIABLE:
+                # The file changed on the server, start over
+                os.remove(part)
+                return await self._fetch_part(url, part)
+            raise
+
+        try:
+            if offset and response.status_code == PARTIAL_CONTENT:
+                self.log.debug("Resuming %s at %s bytes", part, offset)
+                offset = self._resume_offset(part, digest)
+                mode = "ab"
+            else:
+                offset = 0
+                mode = "wb"
+
+            received = disk = 0
+            start = time.perf_counter()
+            with open_file(part, mode) as handle:
+                async for data in response.aiter_bytes():
+                    written = time.perf_counter()
+                    handle.write(data)
+                    disk += time.perf_counter() - written
+                    digest.update(data)
+                    received += len(data)
+            self._timing(time.perf_counter() - start, disk, received)
+        except httpx.TransportError as e:
+            raise IncompleteDownloadError(
+                "Connection lost after {} bytes of {}: {}".format(received, url, e)
+            ) from e
+        finally:
+            await response.aclose()
+
+        self._check_part(url, part, expected_size(response.headers, offset))
+        return digest.hexdigest()
+
+    async def download_file(self, url: str, dest: str) -> dict:
+        """Download file and save to destination, see `Instagram.download_file`."""
+        with REGISTRY.timer("download_seconds"):
+            return await self._download_file(url, dest)
+
+    async def _download_file(self, url: str, dest: str) -> dict:
+        self.log.debug("saving url %s => %s", url, dest)
+
+        existing = self._existing(dest)
+        if existing is not None:
+            return existing
+
+        part = dest + PART_SUFFIX
+        for attempt in range(self.retries + 1):
+            try:
+                checksum = await self._fetch_part(url, part)
+                break
+            except (httpx.HTTPError, IncompleteDownloadError) as e:
+                resumable = isinstance(e, IncompleteDownloadError)
+                if attempt == self.retries or not resumable:
+                    self.log.info("Error downloading %s: %s", dest, e)
+                    self.count("failed")
+                    return None
+                self.count("retries")
+                await asyncio.sleep(backoff(attempt))
+
+        return self._commit(part, dest, checksum)
+
+    async def download_reel(self, tray, since: int = 0) -> list:
+        """Queue every story from tray as a download task.
+
+        Args:
+            tray: Reel response object from API.
+            since (int): Skip stories taken at or before this timestamp.
+
+        Returns:
+            list: Tasks of the queued downloads.
+        """
+        tasks = []
+        for job in self._reel_jobs(tray, since):
+            task = self.downloader.submit(self.download_file, job.url, job.path)
+            if self.verifier is not None:
+                task = asyncio.ensure_future(self._verified_async(job, task))
+            task.add_done_callback(self._record(job))
+            tasks.append(task)
+        return tasks
+
+    async def _verified_async(self, job, task) -> dict:
+        """Verify a download task, see `Instagram._verified`."""
+        for attempt in range(VERIFY_REQUEUES + 1):
+            entry = await task
+            if entry is None:
+                return None
+            check = self.verifier.submit(entry["path"], job.width, job.height)
+            try:
+                problem = await asyncio.wrap_future(check)
+            except Exception as e:  # pylint: disable=broad-except
+                self.log.warning("Unable to verify %s: %r", entry["path"], e)
+                problem = None
+            if problem is None:
+                return entry
+            if not self._rejected(job, entry, problem, attempt):
+                return None
+            task = self.downloader.submit(self.download_file, job.url, job.path)
+        return None
+
+    def _cookie_jar(self):
+        return self.client.cookies.jar
+
+    async def close(self):
+        """Close the connections to IG."""
+        await self.client.aclose()
+        if self.owns_verifier:
+            self.verifier.close()
+        self.save_cookies()
+        self.stats.update(self.transport.summary())
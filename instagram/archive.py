@@ -0,0 +1,282 @@
+"""Compressed newline-delimited JSON archive of API responses
+
+Records are appended to one segment per day, `<prefix>/<date>.ndjson.gz`.
+Every record is compressed on its own so it can be read back by offset,
+`<prefix>/<date>.ndjson.gz.idx` maps record keys to offset and length in the
+segment.
+"""
+import calendar
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from .constants import ARCHIVE_CODECS
+from .constants import ARCHIVE_INDEX_EXT
+from .constants import ERROR_ZSTD_CODEC
+from .constants import FMT_DATE
+from .constants import FMT_DATETIME
+from .constants import GZIP_WBITS
+from .constants import INFO_ARCHIVE_MIGRATED
+from .constants import MEDIA_TYPE_EXT
+from .metrics import REGISTRY
+from .utils import format_time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+log = logging.getLogger(__name__)
+
+
+class JsonArchive:
+    """Append-only, date-partitioned archive of JSON records.
+
+    Safe to share between threads, several processes may append to the same
+    archive as long as the platform supports `fcntl.flock`.
+    """
+
+    def __init__(self, prefix: str, codec: str = "gzip"):
+        """Initialize the archive.
+
+        Args:
+            prefix (str): Directory holding the segments.
+            codec (str): `gzip` or `zstd`, the latter requires `zstandard`.
+        """
+        if codec not in ARCHIVE_CODECS:
+            raise ValueError("Unknown archive codec {}".format(codec))
+        if codec == "zstd" and zstandard is None:
+            raise ImportError(ERROR_ZSTD_CODEC)
+        self.prefix = prefix
+        self.codec = codec
+        self.ext = ARCHIVE_CODECS[codec]
+        self.lock = threading.Lock()
+        os.makedirs(prefix, exist_ok=True)
+
+    def _compressor(self):
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor().compressobj()
+        import zlib
+
+        return zlib.compressobj(9, zlib.DEFLATED, GZIP_WBITS)
+
+    def _decompress(self, data: bytes) -> bytes:
+        if self.codec == "zstd":
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        import gzip
+
+        return gzip.decompress(data)
+
+    def segment(self, date: str) -> str:
+        """Path of the segment holding records of `date`."""
+        return os.path.join(self.prefix, date + self.ext)
+
+    def _index_path(self, date: str) -> str:
+        return self.segment(date) + ARCHIVE_INDEX_EXT
+
+    def dates(self) -> list:
+        """Dates of all segments, oldest first."""
+        suffix = self.ext + ARCHIVE_INDEX_EXT
+        return sorted(
+            a[: -len(suffix)] for a in os.listdir(self.prefix) if a.endswith(suffix)
+        )
+
+    def write(self, key: str, timestamp: int, content_type: str, content) -> tuple:
+        """Append a record.
+
+        Args:
+            key (str): Key to read the record back with, e.g. a post ID.
+            timestamp (int): Unix timestamp, selects the segment.
+            content_type (str): Kind of record, e.g. `tray_<id>` or `item`.
+            content: JSON serializable data or the raw JSON bytes of it.
+
+        Returns:
+            tuple: Segment path, offset and length of the compressed record.
+        """
+        if not isinstance(content, (bytes, bytearray)):
+            content = json.dumps(content, separators=(",", ":")).encode()
+        writer = self.writer(key, timestamp, content_type)
+        writer.write(content)
+        return writer.close()
+
+    def writer(self, key: str, timestamp: int, content_type: str) -> "RecordWriter":
+        """Start a record whose raw JSON data is written in chunks.
+
+        See `write` for the arguments.
+        """
+        return RecordWriter(self, key, timestamp, content_type)
+
+    def _append(self, key: str, timestamp: int, blob: bytes) -> tuple:
+        """Append a compressed record to its segment and index it."""
+        date = format_time(timestamp, FMT_DATE)
+        segment = self.segment(date)
+        with self.lock, REGISTRY.disk_timer("archive"), open(segment, "ab") as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            offset = handle.seek(0, os.SEEK_END)
+            handle.write(blob)
+            handle.flush()
+            with open(self._index_path(date), "a") as f:
+                f.write("{}\t{}\t{}\n".format(key, offset, len(blob)))
+        return segment, offset, len(blob)
+
+    def read(self, segment: str, offset: int, length: int) -> dict:
+        """Read a single record."""
+        with open(segment, "rb") as f:
+            f.seek(offset)
+            return json.loads(self._decompress(f.read(length)))
+
+    def find(self, key: str, date: str = None) -> dict:
+        """Read back the newest record stored under `key`.
+
+        Args:
+            key (str): Record key, e.g. a post ID.
+            date (str): Only look in the segment of this date (`%Y-%m-%d`).
+
+        Returns:
+            dict: Record with `key`, `type`, `timestamp` and `data` or None.
+        """
+        dates = [date] if date is not None else reversed(self.dates())
+
+        key = str(key)
+        for day in dates:
+            found = None
+            path = self._index_path(day)
+            if not os.path.isfile(path):
+                continue
+            with open(path) as f:
+                for line in f:
+                    entry = line.rstrip("\n").split("\t")
+                    if entry[0] == key:
+                        found = entry
+            if found is not None:
+                return self.read(self.segment(day), int(found[1]), int(found[2]))
+        return None
+
+    def records(self, date: str, prefix: str = None):
+        """Iterate over every record of a segment.
+
+        Args:
+            date (str): Date of the segment (`%Y-%m-%d`).
+            prefix (str or tuple): Only read records whose key starts with
+                `prefix`, or one of several prefixes, the others are not
+                decompressed.
+        """
+        with open(self._index_path(date)) as index, open(self.segment(date), "rb") as f:
+            for line in index:
+                key, offset, length = line.rstrip("\n").split("\t")
+                if prefix is not None and not key.startswith(prefix):
+                    continue
+                f.seek(int(offset))
+                yield json.loads(self._decompress(f.read(int(length))))
+
+
+class RecordWriter:
+    """Record of a `JsonArchive`, compressed while its data is written.
+
+    Only the compressed record is kept in memory until `close` appends it.
+    """
+
+    def __init__(self, archive: JsonArchive, key: str, timestamp: int, content_type):
+        self.archive = archive
+        self.key = key
+        self.timestamp = timestamp
+        self.compressor = archive._compressor()
+        self.blocks = []
+        self.write(
+            b'{"key":%s,"type":%s,"timestamp":%d,"data":'
+            % (
+                json.dumps(str(key)).encode(),
+                json.dumps(content_type).encode(),
+                int(timestamp),
+            )
+        )
+
+    def write(self, data: bytes):
+        """Add a chunk of the raw JSON data."""
+        block = self.compressor.compress(bytes(data))
+        if block:
+            self.blocks.append(block)
+
+    def abort(self):
+        """Drop the record without writing it."""
+        self.blocks = []
+
+    def close(self) -> tuple:
+        """Finish the record and append it to the archive.
+
+        Returns:
+            tuple: Segment path, offset and length of the compressed record.
+        """
+        self.write(b"}\n")
+        self.blocks.append(self.compressor.flush())
+        return self.archive._append(self.key, self.timestamp, b"".join(self.blocks))
+
+
+"""`<datetime>_<content_type>.json` written by `dump_response`"""
+RESPONSE_FILENAME = re.compile(r"^(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})_(.+)\.json$")
+
+
+def _timestamp(utcdatetime: str) -> int:
+    return calendar.timegm(time.strptime(utcdatetime, FMT_DATETIME))
+
+
+def migrate_json_backup(
+    archive: JsonArchive, json_backup: str, media_directory: str = None, remove=False
+) -> int:
+    """Move a `json_backup` tree and media sidecar files into an archive.
+
+    Args:
+        archive (JsonArchive): Archive to write to.
+        json_backup (str): Directory written by `dump_response`.
+        media_directory (str): Directory holding `.json` sidecars of media.
+        remove (bool): Delete every file once it is archived.
+
+    Returns:
+        int: Number of migrated files.
+    """
+    migrated = 0
+    for dirpath, _, filenames in os.walk(json_backup, topdown=False):
+        for filename in sorted(filenames):
+            match = RESPONSE_FILENAME.match(filename)
+            if match is None:
+                continue
+            path = os.path.join(dirpath, filename)
+            timestamp = _timestamp(match.group(1))
+            with open(path, "rb") as f:
+                archive.write(match.group(2), timestamp, match.group(2), f.read())
+            if remove:
+                os.remove(path)
+            migrated += 1
+        if remove and dirpath != json_backup and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+    for dirpath, _, filenames in os.walk(media_directory or []):
+        for filename in sorted(filenames):
+            name, ext = os.path.splitext(filename)
+            if ext != MEDIA_TYPE_EXT[3] or " " not in name:
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, "rb") as f:
+                data = f.read()
+            try:
+                item = json.loads(data)
+                archive.write(item["id"], item["taken_at"], "item", data)
+            except (ValueError, KeyError):
+                log.warning("Skipping invalid sidecar %s", path)
+                continue
+            if remove:
+                os.remove(path)
+            migrated += 1
+
+    log.info(INFO_ARCHIVE_MIGRATED, migrated, json_backup)
+    return migrated
@@ -3,10 +3,19 @@ import os
 """Filenames"""
 CONFIG_DIR = ".instagram-story"
 CONFIG_FILENAME_INCLUDE = "include.txt"
+CONFIG_FILENAME_EXCLUDE = "exclude.txt"
 CONFIG_FILENAME_JSON = "config.json"
+CONFIG_FILENAME_INDEX = "index.sqlite3"
+CONFIG_FILENAME_METRICS = "metrics.json"
+CONFIG_FILENAME_DIGEST = "config.sha256"
+CONFIG_FILENAME_COOKIES = "cookies-{}.json"
 
 CONFIG_PATH_INCLUDE = os.path.join(CONFIG_DIR, CONFIG_FILENAME_INCLUDE)
+CONFIG_PATH_EXCLUDE = os.path.join(CONFIG_DIR, CONFIG_FILENAME_EXCLUDE)
 CONFIG_PATH_JSON = os.path.join(CONFIG_DIR, CONFIG_FILENAME_JSON)
+CONFIG_PATH_INDEX = os.path.join(CONFIG_DIR, CONFIG_FILENAME_INDEX)
+CONFIG_PATH_METRICS = os.path.join(CONFIG_DIR, CONFIG_FILENAME_METRICS)
+CONFIG_PATH_DIGEST = os.path.join(CONFIG_DIR, CONFIG_FILENAME_DIGEST)
 
 """Datetime Format"""
 FMT_DATE = "%Y-%m-%d"
@@ -20,18 +29,193 @@ USER_ASK_USER_ID = "Enter your instagram user id: "
 
 INFO_ALL_DONE = "Shutting down application."
 INFO_DOWNLOADING = "Downloading stories for {} ({}/{})"
+INFO_PROGRESS_MEDIA = "media"
+INFO_PROGRESS_REELS = "reels"
 INFO_FETCHING_FOR = "Fetching stories for user: %s"
 INFO_FINISH_DOWNLOADING = "Finished downloading stories for user: %s"
 INFO_REEL_FOUND = "Found %s stories for user: %s"
 INFO_REEL_FOUND_FOR_USER = "Found %s stories for %s (%s)"
-INFO_USER_INCLUDE = "Found %s users in include.txt"
+INFO_USER_LIST = "Found %s users in %s"
+INFO_INDEX_REBUILT = "Indexed %s media files in %s"
+INFO_INDEX_SIZE = "Download index at {} holds {} media files"
+INFO_DEDUP_REPORT = (
+    "{files} media files, {blobs} unique, {logical} bytes fit in {unique} bytes"
+    " ({potential} bytes potential savings)"
+)
+INFO_DEDUP_STORE = "{blobs} blobs in the store, {size} bytes, {saved} bytes saved"
+INFO_WATCH_NEXT = "Next poll for %s in %.0f seconds"
+WARNING_WATCH_BACKEND = "Watch mode runs %s async accounts with the sync backend"
+INFO_WATCH_STOP = "Received signal %s, stopping after the current poll"
+INFO_ARCHIVE_MIGRATED = "Archived %s JSON files from %s"
+INFO_VERIFY_REPORT = "{checked} media files checked, {corrupt} corrupt"
+INFO_RECONCILE_REPORT = (
+    "{username}: {files} media files in {reels} saved reels, {present} on disk,"
+    " {indexed} indexed elsewhere, {stale} indexed but gone,"
+    " {expired} missing and expired, {missing} missing and live, {requeued} requeued"
+)
+INFO_UNCHANGED = "Skipping %s unchanged reels for %s"
+INFO_REPORT = "Summary:"
+INFO_REPORT_LOG = "Run summary: %s"
+
+ERROR_ACCOUNT = "Downloading stories for %s failed"
+ERROR_PATH_TEMPLATE = "Invalid path template {!r}, it needs {{post_id}} and may use {}"
+ERROR_ZSTD_CODEC = (
+    "The zstd archive codec requires zstandard, install it with "
+    "`pip install instagram-story[zstd]`"
+)
+ERROR_ASYNC_BACKEND = (
+    "The async backend requires httpx, install it with "
+    "`pip install instagram-story[async]`"
+)
 
 WARNING_IGNORED = "Following users were ignored: %s"
+WARNING_RETRY = "Request to %s failed, retrying in %.1fs"
+WARNING_CORRUPT = "Removing corrupt download %s: %s"
 
 """API Endpoints"""
+API_URL = "https://i.instagram.com/api/v1/"
 ENDPOINT_REELS_TRAY = "https://i.instagram.com/api/v1/feed/reels_tray/"
 ENDPOINT_USER_REELS = "https://i.instagram.com/api/v1/feed/reels_media/?reel_ids="
 ENDPOINT_USER_REELS_PREFIX = "https://i.instagram.com/api/v1/feed/reels_media/?{}"
 
+"""Download scheduler"""
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 4
+DEFAULT_CHUNK_SIZE = 8
+DEFAULT_PREFETCH = 2
+
+"""HTTP backends"""
+BACKEND_ASYNC = "async"
+BACKEND_SYNC = "sync"
+BACKENDS = [BACKEND_SYNC, BACKEND_ASYNC]
+
+"""Connection pooling"""
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_RETRIES = 2
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+POOL_HOSTS = 32
+"""httpcore trace event of a newly opened connection"""
+TRACE_CONNECT = "connection.connect_tcp.started"
+
+"""Resumable downloads"""
+PART_SUFFIX = ".part"
+PARTIAL_CONTENT = 206
+RANGE_NOT_SATISFIABLE = 416
+
+"""Rate limiting and retries"""
+DEFAULT_API_RATE = 1.0
+DEFAULT_CDN_RATE = 20.0
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_CAP = 60.0
+
+"""Expiry-aware scheduling: preferred users are served as if their reels
+expired this many seconds earlier"""
+PRIORITY_PREFERRED_BONUS = 3600
+
+"""Metrics"""
+METRICS_PREFIX = "instagram_story_"
+"""Histogram buckets in seconds"""
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+"""Watch mode"""
+DEFAULT_WATCH_MIN = 300.0
+DEFAULT_WATCH_MAX = 3600.0
+
+"""Rendition policies"""
+RENDITION_BEST = "best"
+RENDITION_SMALLEST = "smallest"
+RENDITION_THUMBNAIL = "thumbnail"
+RENDITIONS = [RENDITION_BEST, RENDITION_SMALLEST, RENDITION_THUMBNAIL]
+
+"""JSON archive"""
+ARCHIVE_CODECS = {"gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+ARCHIVE_INDEX_EXT = ".idx"
+"""Content type of saved `reels_media` reels, formatted with the user ID"""
+CONTENT_TYPE_REEL = "user_reel_{}"
+"""Content type of saved reel trays, formatted with the account ID"""
+CONTENT_TYPE_TRAY = "tray_{}"
+"""Bytes read at a time from streamed API responses"""
+STREAM_CHUNK_SIZE = 65536
+"""zlib window bits producing a gzip stream"""
+GZIP_WBITS = 31
+
+"""Media paths, relative to the media directory"""
+DEFAULT_PATH_TEMPLATE = "{user_id}/{year}/{datetime} {post_id}"
+PATH_TIME_FIELDS = ["year", "month", "day", "date", "datetime"]
+PATH_FIELDS = ["user_id", "username", "post_id", "timestamp"] + PATH_TIME_FIELDS
+
+"""Content-addressed store"""
+STORE_LINK_HARDLINK = "hardlink"
+STORE_LINK_REFLINK = "reflink"
+STORE_LINKS = [STORE_LINK_HARDLINK, STORE_LINK_REFLINK]
+"""ioctl request cloning a file on Linux (btrfs, XFS)"""
+FICLONE = 0x40049409
+
+"""Media verification"""
+DEFAULT_VERIFY_WORKERS = 2
+"""Pixels the dimensions of a file may differ from the item JSON"""
+VERIFY_TOLERANCE = 2
+"""Downloads of a story that failed verification before giving up"""
+VERIFY_REQUEUES = 1
+
+"""Download index"""
+INDEX_CHECKSUM = "sha256"
+INDEX_COMMIT_EVERY = 100
+"""Post IDs looked up in one query, below the SQLite variable limit"""
+INDEX_LOOKUP_CHUNK = 500
+"""Files hashed or queued per worker while rebuilding the index"""
+INDEX_REBUILD_WINDOW = 4
+
+"""Counters of `reconcile`"""
+RECONCILE_KEYS = [
+    "reels",
+    "invalid",
+    "files",
+    "present",
+    "indexed",
+    "stale",
+    "expired",
+    "missing",
+    "requeued",
+]
+
+"""Run summary counters, in report order"""
+REPORT_KEYS = [
+    "accounts",
+    "accounts_failed",
+    "users",
+    "ignored",
+    "unchanged",
+    "polls",
+    "polls_failed",
+    "reels",
+    "downloaded",
+    "deduplicated",
+    "exists",
+    "seen",
+    "expired",
+    "skipped",
+    "invalid",
+    "corrupt",
+    "requeued",
+    "retries",
+    "requests",
+    "connections",
+    "reused",
+    "failed",
+]
+
+"""Seconds a story stays available after it was posted"""
+STORY_LIFETIME = 24 * 60 * 60
+
 """Instagram Media Id to Extension mapping"""
 MEDIA_TYPE_EXT = ["", ".jpg", ".mp4", ".json"]
+"""Extension of audio tracks stored apart from their video"""
+AUDIO_EXT = ".m4a"
+"""Appended to the index key of an audio track, its video has the same name"""
+AUDIO_KEY_SUFFIX = "_audio"
+MEDIA_TYPE_CAROUSEL = 8
+"""Namespace of DASH manifests in `video_dash_manifest`"""
+DASH_NAMESPACE = "urn:mpeg:dash:schema:mpd:2011"
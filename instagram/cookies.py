@@ -0,0 +1,147 @@
+"""Cookies set by Instagram, persisted between runs of an account"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+log = logging.getLogger(__name__)
+
+_FIELDS = ("name", "value", "domain", "path", "expires", "secure")
+
+
+def _key(record: dict) -> str:
+    return "{domain}\t{path}\t{name}".format(**record)
+
+
+def cookie_record(cookie) -> dict:
+    """Compact JSON representation of a `http.cookiejar.Cookie`."""
+    record = {a: getattr(cookie, a) for a in _FIELDS}
+    if cookie.has_nonstandard_attr("HttpOnly"):
+        record["httponly"] = True
+    return record
+
+
+def merge_header(header: str, records, host: str) -> str:
+    """Replace cookies of a `cookie` request header by newer ones.
+
+    Args:
+        header (str): `cookie` request header.
+        records ([dict]): Cookie records, see `cookie_record`.
+        host (str): Host the header is sent to, other cookies are skipped.
+
+    Returns:
+        str: Updated `cookie` header.
+    """
+    cookies = {}
+    for pair in header.split(";"):
+        name, _, value = pair.strip().partition("=")
+        if name:
+            cookies[name] = value
+    for record in records:
+        domain = record["domain"].lstrip(".")
+        if not domain or host == domain or host.endswith("." + domain):
+            cookies[record["name"]] = record["value"]
+    return "; ".join("{}={}".format(*a) for a in cookies.items())
+
+
+class CookieStore:
+    """JSON file holding the cookies Instagram set for an account.
+
+    The file is read once when the session starts and written only if the
+    cookies changed, under an exclusive lock and by an atomic rename, so
+    concurrent runs of the same account never see a partial file and do not
+    drop each other's updates. Cookies are tied to the `cookie` header of
+    the account in `config.json` and are discarded when that changes, e.g.
+    after logging in again.
+    """
+
+    def __init__(self, path: str, source: str):
+        """Initialize the store.
+
+        Args:
+            path (str): JSON file of the account.
+            source (str): `cookie` header of the account in `config.json`.
+        """
+        self.path = path
+        self.source = hashlib.sha256(source.encode()).hexdigest()[:16]
+        self.lock = threading.Lock()
+        self.cookies = {}
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+
+    def _read(self) -> dict:
+        """Unexpired cookies in the file, by domain, path and name."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable cookie file %s: %s", self.path, e)
+            return {}
+        if not isinstance(data, dict) or data.get("source") != self.source:
+            return {}
+        now = time.time()
+        return {
+            _key(a): a
+            for a in data.get("cookies", [])
+            if not a.get("expires") or a["expires"] > now
+        }
+
+    def load(self) -> list:
+        """Read the stored cookies.
+
+        Returns:
+            [dict]: Cookie records, see `cookie_record`.
+        """
+        with self.lock:
+            self.cookies = self._read()
+            return list(self.cookies.values())
+
+    def save(self, jar) -> bool:
+        """Store the cookies of `jar` if any of them changed.
+
+        Args:
+            jar (http.cookiejar.CookieJar): Cookies of the session.
+
+        Returns:
+            bool: True if the file was written.
+        """
+        changed = {}
+        for cookie in jar:
+            record = cookie_record(cookie)
+            key = _key(record)
+            if self.cookies.get(key) != record:
+                changed[key] = record
+        if not changed:
+            return False
+
+        with self.lock, self._locked():
+            cookies = self._read()
+            cookies.update(changed)
+            tmp = "{}.{}.{}.tmp".format(self.path, os.getpid(), threading.get_ident())
+            with open(tmp, "w") as f:
+                json.dump(
+                    {"source": self.source, "cookies": list(cookies.values())},
+                    f,
+                    separators=(",", ":"),
+                )
+            os.replace(tmp, self.path)
+            self.cookies = cookies
+        log.debug("Saved %s changed cookies to %s", len(changed), self.path)
+        return True
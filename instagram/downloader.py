@@ -0,0 +1,92 @@
+"""Bounded worker pool for downloading story media"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from urllib.parse import urlparse
+
+from .constants import DEFAULT_PER_HOST
+from .constants import DEFAULT_WORKERS
+
+
+class Downloader:
+    """Schedule media downloads on a bounded thread pool.
+
+    At most `workers` downloads run at the same time and at most `per_host`
+    of them talk to the same CDN host. `submit` blocks once `backlog`
+    downloads are queued so producers cannot run arbitrarily far ahead.
+    """
+
+    def __init__(
+        self, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, backlog=None
+    ):
+        """Initialize the worker pool.
+
+        The pool may be shared by several `Instagram` sessions, each of them
+        passes its own `fetch` callable to `submit`.
+
+        Args:
+            workers (int): Global concurrency limit.
+            per_host (int): Concurrency limit for a single host.
+            backlog (int): Maximum number of queued downloads.
+                Defaults to four times `workers`.
+        """
+        self.log = logging.getLogger(__name__)
+        self.per_host = max(1, per_host)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="download"
+        )
+        self.backlog = threading.BoundedSemaphore(backlog or max(1, workers) * 4)
+        self.pending = set()
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self.hosts[host]
+
+    def _run(self, fetch, url: str, dest: str):
+        with self._host_slot(url):
+            return fetch(url, dest)
+
+    def _done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+        self.backlog.release()
+        if future.exception() is not None:
+            self.log.error("Download failed: %s", future.exception())
+
+    def submit(self, fetch, url: str, dest: str):
+        """Queue `url` for download to `dest`.
+
+        Args:
+            fetch: Callable `fetch(url, dest)` downloading a single file.
+            url (str): URL of the media file.
+            dest (str): File system destination.
+
+        Returns:
+            Future: Resolves once the download has finished.
+        """
+        self.backlog.acquire()
+        future = self.executor.submit(self._run, fetch, url, dest)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def join(self):
+        """Block until every queued download has finished."""
+        while True:
+            with self.lock:
+                pending = list(self.pending)
+            if not pending:
+                return
+            wait(pending)
+
+    def close(self):
+        """Wait for queued downloads and stop the worker threads."""
+        self.join()
+        self.executor.shutdown(wait=True)
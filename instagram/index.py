@@ -0,0 +1,352 @@
+"""Index of downloaded stories"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from .constants import AUDIO_EXT
+from .constants import AUDIO_KEY_SUFFIX
+from .constants import DEFAULT_PATH_TEMPLATE
+from .constants import INDEX_CHECKSUM
+from .constants import INDEX_COMMIT_EVERY
+from .constants import INDEX_LOOKUP_CHUNK
+from .constants import INDEX_REBUILD_WINDOW
+from .constants import INFO_INDEX_REBUILT
+from .constants import MEDIA_TYPE_EXT
+from .paths import PathPlanner
+
+
+log = logging.getLogger(__name__)
+
+
+def file_checksum(path: str) -> str:
+    """Compute the checksum recorded in the index for file at `path`."""
+    digest = hashlib.new(INDEX_CHECKSUM)
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(1048576), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class MemoryIndex:
+    """Thread-safe set of post IDs shared by every account of a run.
+
+    The first account to `claim` a post downloads it, every other account
+    skips it. A claim is released again when the download fails so another
+    account may retry the post.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.claimed = set()
+        self.reels = {}
+
+    def _known(self, post_id: str) -> bool:
+        return False
+
+    def claim(self, post_id: str) -> bool:
+        """Claim `post_id` for download.
+
+        Returns:
+            bool: True if the post was neither claimed nor downloaded before.
+        """
+        with self.lock:
+            if post_id in self.claimed or self._known(post_id):
+                return False
+            self.claimed.add(post_id)
+            return True
+
+    def release(self, post_id: str):
+        """Release a claim after a failed download."""
+        with self.lock:
+            self.claimed.discard(post_id)
+
+    def add(self, post_id: str, path: str, size: int, checksum: str = None):
+        """Record a downloaded post."""
+        pass
+
+    def remove(self, post_id: str):
+        """Forget a downloaded post, e.g. after its file turned out corrupt."""
+        pass
+
+    def known(self, post_ids) -> set:
+        """Return the downloaded posts among `post_ids`."""
+        return set()
+
+    def seen_reels(self, account_id: str) -> dict:
+        """Return the last downloaded `latest_reel_media` of every user.
+
+        Args:
+            account_id (str): Instagram user id of the account.
+
+        Returns:
+            dict: Mapping of user ID to `latest_reel_media` timestamp.
+        """
+        with self.lock:
+            return dict(self.reels.get(account_id, {}))
+
+    def mark_seen(self, account_id: str, user_id: str, latest_reel_media: int):
+        """Record that the reel of `user_id` was downloaded up to a timestamp."""
+        with self.lock:
+            self.reels.setdefault(account_id, {})[user_id] = latest_reel_media
+
+    def close(self):
+        pass
+
+
+class DownloadIndex(MemoryIndex):
+    """SQLite index of downloaded media keyed by post ID.
+
+    A post found in the index is skipped before any network or file system
+    access. The index is shared by all accounts and threads of a run.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS downloads (
+            post_id TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            checksum TEXT,
+            downloaded_at INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS reels (
+            account_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            latest_reel_media INTEGER NOT NULL,
+            PRIMARY KEY (account_id, user_id)
+        );
+    """
+
+    def __init__(self, path: str):
+        """Open or create the index database.
+
+        Args:
+            path (str): Path of the SQLite database file.
+        """
+        super().__init__()
+        self.path = path
+        self.uncommitted = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+        self.db.commit()
+
+    def _known(self, post_id: str) -> bool:
+        row = self.db.execute(
+            "SELECT 1 FROM downloads WHERE post_id = ?", (post_id,)
+        ).fetchone()
+        return row is not None
+
+    def __contains__(self, post_id: str) -> bool:
+        with self.lock:
+            return self._known(post_id)
+
+    def get(self, post_id: str) -> dict:
+        """Return the index entry for `post_id` or None."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT post_id, path, size, checksum, downloaded_at"
+                " FROM downloads WHERE post_id = ?",
+                (post_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("post_id", "path", "size", "checksum", "downloaded_at"), row))
+
+    def add(self, post_id: str, path: str, size: int, checksum: str = None):
+        """Record a downloaded post.
+
+        Args:
+            post_id (str): Instagram post ID.
+            path (str): Path of the media file.
+            size (int): Size of the media file in bytes.
+            checksum (str): Hex digest of the media file, if known.
+        """
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?)",
+                (post_id, path, size, checksum, int(time.time())),
+            )
+            self.claimed.discard(post_id)
+            self.uncommitted += 1
+            if self.uncommitted >= INDEX_COMMIT_EVERY:
+                self.db.commit()
+                self.uncommitted = 0
+
+    def remove(self, post_id: str):
+        """Forget a downloaded post, e.g. after its file turned out corrupt."""
+        with self.lock:
+            self.db.execute("DELETE FROM downloads WHERE post_id = ?", (post_id,))
+            self.db.commit()
+
+    def known(self, post_ids) -> set:
+        """Return the downloaded posts among `post_ids`.
+
+        Posts are looked up `INDEX_LOOKUP_CHUNK` at a time instead of one
+        query per post.
+        """
+        post_ids = list(post_ids)
+        found = set()
+        with self.lock:
+            for start in range(0, len(post_ids), INDEX_LOOKUP_CHUNK):
+                chunk = post_ids[start : start + INDEX_LOOKUP_CHUNK]
+                rows = self.db.execute(
+                    "SELECT post_id FROM downloads WHERE post_id IN ({})".format(
+                        ",".join("?" * len(chunk))
+                    ),
+                    chunk,
+                )
+                found.update(a[0] for a in rows)
+        return found
+
+    def seen_reels(self, account_id: str) -> dict:
+        """Return the last downloaded `latest_reel_media` of every user.
+
+        Args:
+            account_id (str): Instagram user id of the account.
+
+        Returns:
+            dict: Mapping of user ID to `latest_reel_media` timestamp.
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT user_id, latest_reel_media FROM reels WHERE account_id = ?",
+                (account_id,),
+            )
+            return dict(rows.fetchall())
+
+    def mark_seen(self, account_id: str, user_id: str, latest_reel_media: int):
+        """Record that the reel of `user_id` was downloaded up to a timestamp."""
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO reels VALUES (?, ?, ?)",
+                (account_id, user_id, latest_reel_media),
+            )
+            self.db.commit()
+
+    def dedup_stats(self) -> dict:
+        """Space the indexed media would use with and without deduplication.
+
+        Posts with the same checksum could share one blob in a `ContentStore`.
+        The index does not know whether they do, see `ContentStore.usage` for
+        the space actually saved.
+
+        Returns:
+            dict: Number of `files` and unique `blobs`, their `logical` and
+                `unique` size in bytes and the `potential` savings in bytes.
+        """
+        with self.lock:
+            files, logical = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM downloads"
+            ).fetchone()
+            duplicates, duplicate_size = self.db.execute(
+                "SELECT COALESCE(SUM(n - 1), 0), COALESCE(SUM((n - 1) * size), 0)"
+                " FROM (SELECT COUNT(*) AS n, MAX(size) AS size FROM downloads"
+                " WHERE checksum IS NOT NULL GROUP BY checksum)"
+            ).fetchone()
+        return {
+            "files": files,
+            "blobs": files - duplicates,
+            "logical": logical,
+            "unique": logical - duplicate_size,
+            "potential": duplicate_size,
+        }
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+
+    def close(self):
+        """Commit pending entries and close the database."""
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+def media_post_id(path: str, planner: PathPlanner) -> str:
+    """Extract the index key from the path of a media file.
+
+    The post ID is recovered from the path template of the account, see
+    `PathPlanner.post_key`. Audio tracks are keyed apart from the video of
+    the same name, see `media_key`.
+
+    Args:
+        path (str): Media file below the media directory of `planner`.
+        planner (PathPlanner): Media paths of the account.
+
+    Returns:
+        str: Index key or None if `path` is not a media file.
+    """
+    name, ext = os.path.splitext(path)
+    if ext not in MEDIA_TYPE_EXT[1:3] + [AUDIO_EXT]:
+        return None
+    key = planner.post_key(name)
+    if key is None:
+        return None
+    return key + AUDIO_KEY_SUFFIX if ext == AUDIO_EXT else key
+
+
+def rebuild_index(
+    index: DownloadIndex,
+    directory: str,
+    workers: int = 8,
+    template: str = DEFAULT_PATH_TEMPLATE,
+) -> int:
+    """Add every media file below `directory` to the index.
+
+    At most `INDEX_REBUILD_WINDOW` files per worker are queued at a time, so
+    memory stays flat however many files the directory holds.
+
+    Args:
+        index (DownloadIndex): Index to update.
+        directory (str): Media directory of an account.
+        workers (int): Number of files hashed concurrently.
+        template (str): Path template the files were saved with.
+
+    Returns:
+        int: Number of files added.
+    """
+
+    planner = PathPlanner(directory, template)
+
+    def scan():
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                post_id = media_post_id(path, planner)
+                if post_id is not None:
+                    yield post_id, path
+
+    def entry(job):
+        post_id, path = job
+        size = os.path.getsize(path)
+        if size == 0:
+            return None
+        return post_id, path, size, file_checksum(path)
+
+    def record(futures) -> int:
+        results = [a.result() for a in futures]
+        for result in results:
+            if result is not None:
+                index.add(*result)
+        return len(results) - results.count(None)
+
+    added = 0
+    workers = max(1, workers)
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for job in scan():
+            if len(pending) >= workers * INDEX_REBUILD_WINDOW:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                added += record(done)
+            pending.add(executor.submit(entry, job))
+        added += record(wait(pending).done)
+    log.info(INFO_INDEX_REBUILT, added, directory)
+    return added
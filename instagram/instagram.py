@@ -1,32 +1,136 @@
 """Instagram class to handle requests to Instagram"""
+import hashlib
 import json
 import logging
 import os
-import pickle
+import threading
 import time
+from collections import Counter
+from concurrent.futures import Future
+from concurrent.futures import wait
+from urllib.parse import urlparse
 
 import requests
 
+from .archive import JsonArchive
+from .constants import API_URL
+from .constants import CONFIG_DIR
+from .constants import CONFIG_FILENAME_COOKIES
+from .constants import CONTENT_TYPE_REEL
+from .constants import CONTENT_TYPE_TRAY
+from .constants import DEFAULT_API_RATE
+from .constants import DEFAULT_CDN_RATE
+from .constants import DEFAULT_PER_HOST
+from .constants import DEFAULT_RETRIES
+from .constants import DEFAULT_VERIFY_WORKERS
+from .constants import DEFAULT_WORKERS
 from .constants import ENDPOINT_REELS_TRAY
 from .constants import ENDPOINT_USER_REELS
 from .constants import ENDPOINT_USER_REELS_PREFIX
+from .constants import INDEX_CHECKSUM
 from .constants import MEDIA_TYPE_EXT
+from .constants import PART_SUFFIX
+from .constants import PARTIAL_CONTENT
+from .constants import RANGE_NOT_SATISFIABLE
+from .constants import RENDITION_BEST
+from .constants import STORE_LINK_HARDLINK
+from .constants import STREAM_CHUNK_SIZE
+from .constants import VERIFY_REQUEUES
+from .constants import WARNING_CORRUPT
+from .constants import WARNING_RETRY
+from .cookies import CookieStore
+from .cookies import merge_header
+from .downloader import Downloader
+from .index import MemoryIndex
+from .media import extract_media
+from .media import item_expiry
+from .media import Job
+from .media import media_key
+from .metrics import REGISTRY
+from .paths import account_template
+from .paths import open_file
+from .paths import PathPlanner
+from .ratelimit import backoff
+from .ratelimit import RateLimiter
+from .ratelimit import retry_after
+from .ratelimit import RETRY_STATUS
+from .store import ContentStore
+from .stream import JsonStream
+from .stream import ResponseFile
+from .stream import TrayEntry
+from .transport import configure_session
+from .transport import timeouts
 from .utils import dump_text_file
-from .utils import format_time
 from .utils import home_path
+from .utils import response_path
+from .verify import Verifier
+
+
+class IncompleteDownloadError(requests.exceptions.RequestException):
+    """Connection closed before the whole file was received."""
+
+
+def expected_size(headers, offset: int = 0) -> int:
+    """Size of the complete file announced by response headers.
+
+    Args:
+        headers: Response headers.
+        offset (int): Bytes already received before this response.
+
+    Returns:
+        int: Size in bytes or None if the headers do not tell.
+    """
+    if "Content-Encoding" in headers:
+        return None
+    total = headers.get("Content-Range", "").rpartition("/")[2]
+    if total.isdigit():
+        return int(total)
+    length = headers.get("Content-Length", "")
+    if length.isdigit():
+        return offset + int(length)
+    return None
 
 
 class Instagram:
     """Instagram class for handling API requests and downloading files."""
 
-    def __init__(self, config, options):
-        """Initialize class variables."""
+    def __init__(
+        self, config, options, downloader=None, index=None, limiter=None, verifier=None
+    ):
+        """Initialize class variables.
+
+        Args:
+            config (dict): Account entry from `config.json`.
+            options: Parsed command line options.
+            downloader (Downloader): Download pool shared with other accounts.
+                A private pool is created if omitted.
+            index (MemoryIndex): Index of downloaded posts shared with other
+                accounts, e.g. a `DownloadIndex`. A private in-memory index
+                is created if omitted.
+            limiter (RateLimiter): Rate limiter shared with other accounts.
+                A private limiter is created if omitted.
+            verifier (Verifier): Process pool checking downloaded files
+                shared with other accounts. A private pool is created if
+                omitted and `--verify` is set.
+
+        With `--archive` responses and sidecars are appended to a
+        `JsonArchive` in `json_backup` instead of separate `.json` files.
+        With `--store` media is kept once in a `ContentStore` and linked
+        into the media directory. Media paths follow `--path-template` or
+        the `path_template` of the account.
+        """
         self.log = logging.getLogger(__name__)
         self.options = options
         self.directory = config["media_directory"]
+        self.planner = PathPlanner(self.directory, account_template(config, options))
         self.id = config["id"]
         self.cookie = config["headers"]["cookie"]
-        self.cj_path = home_path(".instagram-story", "cookie-{}".format(self.id))
+
+        api_url = config.get("api_url", API_URL)
+        self.api_host = urlparse(api_url).hostname
+        self.endpoint_tray = ENDPOINT_REELS_TRAY.replace(API_URL, api_url, 1)
+        self.endpoint_reel = ENDPOINT_USER_REELS.replace(API_URL, api_url, 1)
+        self.endpoint_reels = ENDPOINT_USER_REELS_PREFIX.replace(API_URL, api_url, 1)
 
         self.headers = {
             "accept": "*/*",
@@ -44,20 +148,129 @@ class Instagram:
             ),
         }
 
+        self.cookie_store = CookieStore(
+            home_path(CONFIG_DIR, CONFIG_FILENAME_COOKIES.format(self.id)),
+            self.cookie,
+        )
+        self.headers["cookie"] = merge_header(
+            self.cookie, self.cookie_store.load(), self.api_host
+        )
+        self.timeout = timeouts(options)
+        self._open_session(options)
+
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+        self.limiter = limiter or RateLimiter(
+            api_rate=getattr(options, "api_rate", DEFAULT_API_RATE),
+            cdn_rate=getattr(options, "cdn_rate", DEFAULT_CDN_RATE),
+        )
+        self.retries = getattr(options, "retries", DEFAULT_RETRIES)
+        self.owns_downloader = downloader is None
+        self.downloader = downloader or Downloader(
+            workers=getattr(options, "workers", DEFAULT_WORKERS),
+            per_host=getattr(options, "per_host", DEFAULT_PER_HOST),
+        )
+        self.index = index if index is not None else MemoryIndex()
+        self.verifying = set()
+        self.owns_verifier = verifier is None and getattr(options, "verify", False)
+        self.verifier = verifier
+        if self.owns_verifier:
+            self.verifier = Verifier(
+                getattr(options, "verify_workers", DEFAULT_VERIFY_WORKERS)
+            )
+        self.reels_tray = {"tray": []}
+        self.tray_index = {}
+
+        self.json_backup = config["json_backup"]
+        self.stream_json = getattr(options, "stream_json", False)
+        codec = getattr(options, "archive", None)
+        self.archive = JsonArchive(self.json_backup, codec) if codec else None
+        self.rendition = getattr(options, "rendition", RENDITION_BEST)
+        self.max_height = getattr(options, "max_height", None)
+        store = getattr(options, "store", None)
+        self.store = (
+            ContentStore(store, getattr(options, "store_link", STORE_LINK_HARDLINK))
+            if store
+            else None
+        )
+
+    def _open_session(self, options):
+        """Create the pooled HTTP session of the account.
+
+        Sets `session` and `transport`, the connection statistics merged
+        into `stats` on `close`, see `configure_session`.
+        """
         self.session = requests.Session()
         self.session.headers = self.headers
-        self.session.headers.update({"cookie": self.cookie})
+        self.transport = configure_session(self.session, options)
+
+    def _cookie_jar(self):
+        """Cookies Instagram set during this session."""
+        return self.session.cookies
+
+    def save_cookies(self):
+        """Store cookies Instagram set if they changed, see `CookieStore`.
+
+        Later requests of the session send the updated cookies.
+        """
+        if self.cookie_store.save(self._cookie_jar()):
+            self.headers["cookie"] = merge_header(
+                self.cookie, self.cookie_store.cookies.values(), self.api_host
+            )
+
+    def _get(self, kind: str, url: str, **kwargs):
+        """GET `url` through the rate limiter, retrying transient failures.
 
-    def _cj_load(self):
-        """Load cookies from file."""
-        if os.path.exists(self.cj_path):
-            with open(self.cj_path, "rb") as f:
-                self.session.cookies.update(pickle.load(f))
+        Connection errors, timeouts, 429 and 5xx responses are retried with
+        jittered exponential backoff, honouring `Retry-After`.
+
+        Args:
+            kind (str): Endpoint class, `api` or `cdn`.
+            url (str): URL to request.
+            kwargs: Passed on to `requests.Session.get`.
+
+        Returns:
+            requests.Response: Successful response.
+        """
+        bucket = self.limiter[kind]
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, **kwargs)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                REGISTRY.inc("http_errors_total", kind=kind, error=type(e).__name__)
+                if last:
+                    raise
+                delay = backoff(attempt)
+            else:
+                REGISTRY.observe(
+                    "http_request_seconds", time.perf_counter() - start, kind=kind
+                )
+                REGISTRY.inc(
+                    "http_responses_total", kind=kind, status=response.status_code
+                )
+                if response.ok:
+                    bucket.succeeded()
+                    return response
+                if last or response.status_code not in RETRY_STATUS:
+                    self.log.error(
+                        "Status Code %s Error for %s.", response.status_code, url
+                    )
+                    response.raise_for_status()
+                wait = retry_after(response)
+                if response.status_code == 429:
+                    bucket.throttled(wait)
+                delay = backoff(attempt) if wait is None else wait
+                response.close()
 
-    def _cj_dump(self):
-        """Save Cookies to file."""
-        with open(self.cj_path, "wb") as f:
-            pickle.dump(self.session.cookies, f)
+            self.count("retries")
+            self.log.warning(WARNING_RETRY, url, delay)
+            time.sleep(delay)
 
     def _api_request(self, endpoint):
         """Get reel tray for logged in user from Instagram API.
@@ -66,31 +279,109 @@ class Instagram:
         """
         self.log.debug("Making API request %s", endpoint)
         try:
-            response = self.session.get(endpoint, timeout=60)
-            if response.status_code != requests.codes.ok:  # pylint: disable=no-member
-                self.log.error(
-                    "Status Code %s Error for %s.", response.status_code, endpoint
-                )
-                response.raise_for_status()
-            return response.json()
+            with REGISTRY.timer("api_request_seconds"):
+                response = self._get("api", endpoint, timeout=self.timeout)
+                return response.json()
         except json.decoder.JSONDecodeError:
             raise ValueError("Error parsing json response")
         except requests.exceptions.ConnectionError:
             raise ConnectionError("Connection closed by server")
 
+    def _response_writer(self, timestamp: int, content_type: str):
+        """Writer saving the raw JSON of a streamed response."""
+        if self.archive is not None:
+            return self.archive.writer(content_type, timestamp, content_type)
+        return ResponseFile(response_path(timestamp, content_type, self.json_backup))
+
+    def _api_stream(self, endpoint: str, key: str, writer=None):
+        """Request `endpoint` and parse the container `key` incrementally.
+
+        Args:
+            endpoint (str): API URL.
+            key (str): Top-level key of the array or object to parse.
+            writer: Receives the raw response body, e.g. `_response_writer`.
+
+        Yields:
+            tuple: Member key and raw JSON bytes of every element.
+        """
+        self.log.debug("Making streaming API request %s", endpoint)
+        stream = JsonStream(key)
+        with REGISTRY.timer("api_request_seconds"):
+            response = self._get("api", endpoint, stream=True, timeout=self.timeout)
+        try:
+            for data in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                if writer is not None:
+                    writer.write(data)
+                yield from stream.feed(data)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            response.close()
+        if writer is not None:
+            writer.close()
+
+    def _save_reel(self, user_id: str, raw: bytes) -> dict:
+        """Parse a streamed reel and save its raw JSON."""
+        reel = json.loads(raw)
+        writer = self._response_writer(
+            int(reel.get("expiring_at")), CONTENT_TYPE_REEL.format(user_id)
+        )
+        writer.write(raw)
+        writer.close()
+        return reel
+
     def get_tray(self) -> dict:
-        """Get reel tray from Instagram API."""
-        self.reels_tray = self._api_request(ENDPOINT_REELS_TRAY)
-        return self.reels_tray
+        """Get reel tray from Instagram API.
 
-    def _reel_cached(self, user_id: str):
-        reel = [
-            a
+        The tray is indexed by user ID in `tray_index`. With `--stream-json`
+        the response is saved as it arrives and the tray only holds compact
+        `TrayEntry` records.
+        """
+        if not self.stream_json:
+            return self._set_tray(self._api_request(self.endpoint_tray))
+
+        writer = self._response_writer(
+            int(time.time()), CONTENT_TYPE_TRAY.format(self.id)
+        )
+        entries = self._api_stream(self.endpoint_tray, "tray", writer)
+        return self._set_tray({"tray": [TrayEntry(json.loads(a)) for _, a in entries]})
+
+    def _set_tray(self, reels_tray: dict) -> dict:
+        self.reels_tray = reels_tray
+        self.tray_index = {
+            str(a["user"]["pk"]): a
             for a in self.reels_tray["tray"]
-            if user_id == str(a["id"]) and a["prefetch_count"] > 0
-        ]
+            if "user" in a and "pk" in a["user"]
+        }
+        return self.reels_tray
+
+    def _reel_cached(self, user_id: str) -> dict:
+        """Return the tray entry of `user_id` if it holds the complete reel."""
+        reel = self.tray_index.get(user_id)
+        if reel is None or not reel.get("prefetch_count") or "items" not in reel:
+            return None
+        if len(reel["items"]) < (reel.get("media_count") or 0):
+            return None
         return reel
 
+    def cached_reels(self, user_ids: list) -> dict:
+        """Look up users whose complete reel was prefetched with the tray.
+
+        Args:
+            user_ids ([str]): List of Instagram User Id
+
+        Returns:
+            dict: Mapping of user ID to reel for every prefetched reel.
+        """
+        reels = {}
+        for user_id in user_ids:
+            reel = self._reel_cached(user_id)
+            if reel is not None:
+                reels[user_id] = reel
+        return reels
+
     def get_reel(self, user_id: str) -> dict:
         """Fetch reel tray from Instagram API.
 
@@ -101,24 +392,40 @@ class Instagram:
             [dict]: User Reel
         """
         cached = self._reel_cached(user_id)
-        if len(cached) > 0:
-            return cached[0]
+        if cached is not None:
+            return cached
 
-        response = self._api_request(ENDPOINT_USER_REELS + user_id)
+        response = self._api_request(self.endpoint_reel + user_id)
         return response.get("reels").get(user_id)
 
-    def get_reel_chunk(self, user_ids: list) -> list:
+    def get_reel_chunk(self, user_ids: list) -> dict:
         """Get reel tray for a list of user_id from Instagram API.
 
+        Reels prefetched with the tray are not requested again.
+
         Args:
             user_ids ([str]): List of Instagram User Id
 
         Returns: Reel Tray
         """
+        reels = self.cached_reels(user_ids)
+        remaining = [a for a in user_ids if a not in reels]
+        if not remaining:
+            return reels
+
+        endpoint = self._reels_endpoint(remaining)
+        if self.stream_json:
+            for user_id, raw in self._api_stream(endpoint, "reels"):
+                reels[user_id] = self._save_reel(user_id, raw)
+            return reels
+
+        response = self._api_request(endpoint)
+        reels.update(response.get("reels"))
+        return reels
+
+    def _reels_endpoint(self, user_ids: list) -> str:
         suffix = "&".join(["reel_ids={}".format(a) for a in user_ids])
-
-        response = self._api_request(ENDPOINT_USER_REELS_PREFIX.format(suffix))
-        return response.get("reels")
+        return self.endpoint_reels.format(suffix)
 
     def user_ids(self) -> list:
         """Extract user IDs from reel tray JSON.
@@ -126,87 +433,188 @@ class Instagram:
         Returns:
             List of user IDs
         """
-        users = []
-        for item in self.reels_tray["tray"]:
-            if "user" in item:
-                if "pk" in item["user"]:
-                    users.append(str(item["user"]["pk"]))
-        return users
-
-    def ignored_users(self, download_ids: list) -> list:
-        """Extract user IDs from reel tray JSON.
+        return list(self.tray_index)
 
-        Args:
-            tray: Reel tray response from IG
+    def tray_latest(self) -> dict:
+        """Extract `latest_reel_media` of every user from reel tray JSON.
 
         Returns:
-            List of user IDs
+            dict: Mapping of user ID to timestamp of the newest story.
         """
-        users = []
-        for item in self.reels_tray["tray"]:
-            if "user" in item:
-                user_id = str(item["user"]["pk"])
-                username = item["user"]["username"]
-                if user_id not in download_ids:
-                    users.append("{} ({})".format(username, user_id))
-        return users
-
-    def dump_filename(self, string):
-        filename = format_time(time.time(), "cache-%Y-%m-%d_%H.log")
-        with open(
-            os.path.join(os.environ["HOME"], ".instagram-story", filename), "a+"
-        ) as archive:
-            archive.write(string + "\n")
-
-    def download_file(self, url: str, dest: str):
-        """Download file and save to destination
+        return {
+            user_id: item.get("latest_reel_media") or 0
+            for user_id, item in self.tray_index.items()
+        }
+
+    def count(self, key: str, n: int = 1):
+        """Increment run statistic `key` by `n`."""
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def _fetch_part(self, url: str, part: str) -> str:
+        """Download `url` into `part`, resuming a previous partial download.
 
         Args:
             url: URL of item to download
-            dest: File system destination to save item to
+            part: Path of the temporary `.part` file
 
         Returns:
-            None
+            str: Checksum of the complete file.
+
+        Raises:
+            IncompleteDownloadError: The connection failed while reading the
+                body or the server sent less than announced.
+            requests.exceptions.RequestException: The request failed, after
+                the retries of `_get`.
         """
-        self.log.debug("saving url %s => %s", url, dest)
+        digest = hashlib.new(INDEX_CHECKSUM)
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Range": "bytes={}-".format(offset)} if offset else {}
 
         try:
-            if os.path.getsize(dest) == 0:
-                self.log.info("Empty file exists. Removing.")
-                os.remove(dest)
-        except FileNotFoundError:
-            pass
-
+            response = self._get(
+                "cdn", url, stream=True, timeout=self.timeout, headers=headers
+            )
+        except requests.exceptions.HTTPError as e:
+            if offset and e.response.status_code == RANGE_NOT_SATISFIABLE:
+                # The file changed on the server, start over
+                os.remove(part)
+                return self._fetch_part(url, part)
+            raise
+
+        if offset and response.status_code == PARTIAL_CONTENT:
+            self.log.debug("Resuming %s at %s bytes", part, offset)
+            offset = self._resume_offset(part, digest)
+            mode = "ab"
+        else:
+            offset = 0
+            mode = "wb"
+
+        received = disk = 0
+        start = time.perf_counter()
         try:
-            dirpath = os.path.dirname(dest)
-            os.makedirs(dirpath, exist_ok=True)
-            with open(dest, "xb") as handle:
-                response = self.session.get(url, stream=True, timeout=160)
-                if (
-                    response.status_code != requests.codes.ok
-                ):  # pylint: disable=no-member
-                    self.log.error("Status Code %s Error.", response.status_code)
-                    response.raise_for_status()
+            with open_file(part, mode) as handle:
                 for data in response.iter_content(chunk_size=4194304):
+                    written = time.perf_counter()
                     handle.write(data)
-                handle.close()
-
-            self.dump_filename(dest)
-        except FileExistsError:
+                    disk += time.perf_counter() - written
+                    digest.update(data)
+                    received += len(data)
+        except (
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ) as e:
+            raise IncompleteDownloadError(
+                "Connection lost after {} bytes of {}: {}".format(received, url, e)
+            ) from e
+        finally:
+            response.close()
+        self._timing(time.perf_counter() - start, disk, received)
+
+        self._check_part(url, part, expected_size(response.headers, offset))
+        return digest.hexdigest()
+
+    def _timing(self, elapsed: float, disk: float, received: int):
+        """Split the time spent reading a response body into network and disk."""
+        REGISTRY.inc("transfer_seconds_total", elapsed - disk)
+        REGISTRY.inc("disk_seconds_total", disk, op="media")
+        REGISTRY.inc("download_bytes_total", received)
+
+    def _resume_offset(self, part: str, digest) -> int:
+        """Feed an existing `.part` file to `digest` and return its size."""
+        with open(part, "rb") as f:
+            for data in iter(lambda: f.read(4194304), b""):
+                digest.update(data)
+        return os.path.getsize(part)
+
+    def _check_part(self, url: str, part: str, expected: int):
+        size = os.path.getsize(part)
+        if size == 0 or (expected is not None and size != expected):
+            raise IncompleteDownloadError(
+                "Received {} of {} bytes for {}".format(size, expected, url)
+            )
+
+    def _existing(self, dest: str) -> dict:
+        """Return the index entry of a complete file at `dest`, if any.
+
+        An empty file at `dest` is removed.
+        """
+        try:
+            size = os.path.getsize(dest)
+        except FileNotFoundError:
+            return None
+        if size > 0:
             self.log.info("File already exists at %s", dest)
-        # This is the correct syntax
-        except requests.exceptions.RequestException:
-            self.log.info("Connection was closed")
+            self.count("exists")
+            return {"path": dest, "size": size, "checksum": None}
+        self.log.info("Empty file exists. Removing.")
+        os.remove(dest)
+        return None
 
-        if os.path.getsize(dest) == 0:
-            self.log.info("Error downloading. Removing %s", dest)
-            os.remove(dest)
+    def _commit(self, part: str, dest: str, checksum: str) -> dict:
+        """Atomically move a complete `.part` file to `dest`.
+
+        With a content store the file is stored under its checksum and
+        `dest` becomes a link to it.
+        """
+        if self.store is None:
+            os.replace(part, dest)
+        elif self.store.commit(part, dest, checksum):
+            self.count("deduplicated")
+        self.count("downloaded")
+        return {"path": dest, "size": os.path.getsize(dest), "checksum": checksum}
+
+    def download_file(self, url: str, dest: str) -> dict:
+        """Download file and save to destination, see `_download_file`."""
+        with REGISTRY.timer("download_seconds"):
+            return self._download_file(url, dest)
+
+    def _download_file(self, url: str, dest: str) -> dict:
+        """Download file and save to destination
+
+        The file is written to `dest.part` first and renamed to `dest` once
+        its size matches `Content-Length`, so a partial file never ends up at
+        `dest`. An existing `.part` file is resumed with a `Range` request.
+        Failed requests are retried by `_get`, a body cut short is resumed
+        up to `--retries` times.
+
+        Args:
+            url: URL of item to download
+            dest: File system destination to save item to
+
+        Returns:
+            dict: Index entry with `path`, `size` and `checksum` of the file,
+                None if the download failed.
+        """
+        self.log.debug("saving url %s => %s", url, dest)
+
+        existing = self._existing(dest)
+        if existing is not None:
+            return existing
+
+        part = dest + PART_SUFFIX
+        for attempt in range(self.retries + 1):
+            try:
+                checksum = self._fetch_part(url, part)
+                break
+            except requests.exceptions.RequestException as e:
+                resumable = isinstance(e, IncompleteDownloadError)
+                if attempt == self.retries or not resumable:
+                    self.log.info("Error downloading %s: %s", dest, e)
+                    self.count("failed")
+                    return None
+                self.count("retries")
+                time.sleep(backoff(attempt))
+
+        return self._commit(part, dest, checksum)
 
     def format_filepath(
         self,
         user_id: int,
         timestamp: int,
         post_id: str,
+        username: str = None,
     ) -> str:
         """Format filepath.
 
@@ -214,55 +622,265 @@ class Instagram:
             user_id: User ID
             timestamp: UTC Unix timestamp
             post_id: Post ID
+            username: Username, looked up in the tray if omitted
 
         Returns:
-            None
+            str: Media path without extension, see `PathPlanner`.
+        """
+        if username is None:
+            entry = self.tray_index.get(str(user_id)) or {}
+            username = (entry.get("user") or {}).get("username")
+        return self.planner.path(
+            {"pk": user_id, "username": username},
+            {"id": post_id, "taken_at": timestamp},
+        )
+
+    def _record(self, job: Job):
+        """Callback recording a finished download in the index.
+
+        Files of multi-media stories are recorded under their own key, a
+        failed download releases the claim on the file. Failures after the
+        story expired are counted as `expired`.
         """
 
-        utcdatetime = format_time(timestamp, time_fmt="%Y-%m-%d_%H-%M-%S")
-        utcyear = format_time(timestamp, time_fmt="%Y")
+        def callback(future):
+            if (
+                future.cancelled()
+                or future.exception() is not None
+                or future.result() is None
+            ):
+                self.index.release(job.key)
+                if time.time() >= job.expiring_at:
+                    self.count("expired")
+            else:
+                self.index.add(job.key, **future.result())
 
-        path_prefix = os.path.join(self.directory, str(user_id), utcyear)
-        filename = "{} {}".format(utcdatetime, post_id)
+        return callback
 
-        return os.path.join(path_prefix, filename)
+    def download_reel(self, tray, since: int = 0) -> list:
+        """Queue every story from tray on the download pool.
 
-    def download_reel(self, tray):
-        """Download story from tray.
+        Sidecar `.json` files are written right away, the media itself is
+        fetched in the background. Call `close` to wait for it.
 
         Args:
             tray: Reel response object from API.
-        """
+            since (int): Skip stories taken at or before this timestamp.
 
-        user_id = tray["user"]["pk"]
-        try:
-            for item in tray["items"]:
-                item["user"] = tray["user"]
+        Returns:
+            list: Futures of the queued downloads.
+        """
+        return self.download_jobs(self._reel_jobs(tray, since))
 
-                post_id = item["id"]
-                timestamp = item["taken_at"]
-                media_type = item["media_type"]
+    def download_jobs(self, jobs: list) -> list:
+        """Queue claimed media files on the download pool.
 
-                if media_type == 2:  # Video
-                    url = item["video_versions"][0]["url"]
-                elif media_type == 1:  # Image
-                    url = item["image_versions2"]["candidates"][0]["url"]
-                else:  # Unknown
-                    url = None
-                    pass
+        Every file is verified with `--verify` and recorded in the index once
+        it is downloaded.
 
-                filepath = self.format_filepath(user_id, timestamp, post_id)
+        Args:
+            jobs ([Job]): Media files to download.
 
-                media_path = filepath + MEDIA_TYPE_EXT[media_type]
-                json_path = filepath + MEDIA_TYPE_EXT[3]
+        Returns:
+            list: Futures of the queued downloads.
+        """
+        futures = []
+        for job in jobs:
+            future = self.downloader.submit(self.download_file, job.url, job.path)
+            if self.verifier is not None:
+                future = self._verified(job, future)
+            future.add_done_callback(self._record(job))
+            futures.append(future)
+        return futures
+
+    def _verified(self, job: Job, future) -> Future:
+        """Chain the verification of a download to its future.
+
+        The file is checked by `verifier` once it is downloaded, the download
+        threads move on to the next file meanwhile. A corrupt file is
+        downloaded again while the story is live, see `_rejected`.
 
-                dump_text_file(json.dumps(item), json_path)
-                self.download_file(url, media_path)
+        Returns:
+            Future: Resolves to the index entry of the verified file, None if
+                the download or the verification failed.
+        """
+        result = Future()
+        attempts = [0]
+
+        def downloaded(future):
+            if future.cancelled():
+                result.cancel()
+                result.set_running_or_notify_cancel()
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            elif future.result() is None:
+                result.set_result(None)
+            else:
+                entry = future.result()
+                check = self.verifier.submit(entry["path"], job.width, job.height)
+                check.add_done_callback(lambda a: checked(a, entry))
+
+        def checked(check, entry):
+            try:
+                problem = check.result()
+            except Exception as e:  # pylint: disable=broad-except
+                self.log.warning("Unable to verify %s: %r", entry["path"], e)
+                problem = None
+            if problem is None:
+                result.set_result(entry)
+            elif self._rejected(job, entry, problem, attempts[0]):
+                attempts[0] += 1
+                try:
+                    retry = self.downloader.submit(
+                        self.download_file, job.url, job.path
+                    )
+                except RuntimeError:
+                    # The download pool was shut down
+                    result.set_result(None)
+                else:
+                    retry.add_done_callback(downloaded)
+            else:
+                result.set_result(None)
+
+        with self.stats_lock:
+            self.verifying.add(result)
+        result.add_done_callback(self._verified_done)
+        future.add_done_callback(downloaded)
+        return result
+
+    def _verified_done(self, future):
+        with self.stats_lock:
+            self.verifying.discard(future)
+
+    def _rejected(self, job: Job, entry: dict, problem: str, attempt: int) -> bool:
+        """Remove a file that failed verification and its blob in the store.
 
-        except KeyError:
+        Returns:
+            bool: True if the story is still live and should be downloaded
+                again, at most `VERIFY_REQUEUES` times.
+        """
+        self.log.warning(WARNING_CORRUPT, entry["path"], problem)
+        self.count("corrupt")
+        try:
+            os.remove(entry["path"])
+        except FileNotFoundError:
             pass
+        if self.store is not None:
+            self.store.remove(entry["checksum"])
+        if attempt >= VERIFY_REQUEUES or time.time() >= job.expiring_at:
+            return False
+        self.count("requeued")
+        return True
+
+    def _reel_jobs(self, tray, since: int = 0) -> list:
+        """Claim the media files of a reel and save their sidecar JSON.
+
+        Every file is claimed under its own index key, see `media_key`, so a
+        story is skipped once all of its files are downloaded and a file that
+        failed is retried on its own. A story that cannot be parsed is logged
+        and skipped, the remaining stories of the reel are still queued.
+
+        Args:
+            tray: Reel response object from API.
+            since (int): Skip stories taken at or before this timestamp.
+
+        Returns:
+            [Job]: Media files to download.
+        """
+        claimed = []
+        now = time.time()
+        user = tray["user"]
+        for item in tray.get("items") or []:
+            try:
+                item["user"] = user
+                if item["taken_at"] <= since:
+                    self.count("seen")
+                    continue
+                if item_expiry(item) <= now:
+                    self.count("expired")
+                    continue
+                post_id = item["id"]
+                media = extract_media(item, self.rendition, self.max_height)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                self._invalid(user, item, e)
+                continue
+            files = [
+                a
+                for a in media
+                if self.index.claim(media_key(post_id, a.suffix, a.ext))
+            ]
+            if media and not files:
+                self.count("skipped")
+                continue
+            claimed.append((item, files))
+
+        jobs = []
+        with REGISTRY.timer("plan_paths_seconds"):
+            paths = self.planner.plan(user, [a for a, _ in claimed])
+        for (item, media), filepath in zip(claimed, paths):
+            try:
+                jobs += self._item_jobs(item, media, filepath)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                self._invalid(user, item, e, media)
+
+        return jobs
+
+    def _invalid(self, user: dict, item: dict, error: Exception, media=()):
+        """Log and count a story that cannot be parsed and release its files."""
+        post_id = item.get("id")
+        self.log.warning("Skipping story %s of %s: %r", post_id, user.get("pk"), error)
+        self.count("invalid")
+        for a in media:
+            self.index.release(media_key(post_id, a.suffix, a.ext))
+
+    def _item_jobs(self, item: dict, media: list, filepath: str) -> list:
+        """Save the sidecar of a story and list its claimed media files.
+
+        The renditions to download are chosen by `--rendition` and recorded
+        in the sidecar, see `extract_media`.
+
+        Args:
+            item (dict): Story from the reel.
+            media ([Media]): Claimed files of the story.
+            filepath (str): Media path without extension, see `PathPlanner`.
+        """
+        post_id = item["id"]
+        timestamp = item["taken_at"]
+
+        if self.archive is not None:
+            self.archive.write(post_id, timestamp, "item", item)
+        else:
+            dump_text_file(json.dumps(item), filepath + MEDIA_TYPE_EXT[3])
+
+        if not media:
+            self.log.info("Story %s has no downloadable media", post_id)
+        expiring_at = item_expiry(item)
+        return [
+            Job(
+                post_id,
+                media_key(post_id, a.suffix, a.ext),
+                a.url,
+                filepath + a.suffix + a.ext,
+                expiring_at,
+                a.width,
+                a.height,
+            )
+            for a in media
+        ]
 
     def close(self):
-        """Close seesion to IG."""
+        """Wait for pending downloads and close seesion to IG.
+
+        Verified downloads are waited for first, they may queue a download
+        again until they finish.
+        """
+        with self.stats_lock:
+            verifying = list(self.verifying)
+        wait(verifying)
+        if self.owns_downloader:
+            self.downloader.close()
+        if self.owns_verifier:
+            self.verifier.close()
         self.session.close()
-        self._cj_dump()
+        self.save_cookies()
+        self.stats.update(self.transport.summary())
@@ -2,38 +2,95 @@ import argparse
 import json
 import logging
 import os
-import re
+import threading
 import time
+from collections import Counter
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
-from tqdm import tqdm
-
+from .constants import ARCHIVE_CODECS
+from .constants import BACKEND_SYNC
+from .constants import BACKENDS
+from .constants import CONFIG_PATH_DIGEST
+from .constants import CONFIG_PATH_EXCLUDE
 from .constants import CONFIG_PATH_INCLUDE
+from .constants import CONFIG_PATH_INDEX
 from .constants import CONFIG_PATH_JSON
+from .constants import CONFIG_PATH_METRICS
+from .constants import CONTENT_TYPE_REEL
+from .constants import CONTENT_TYPE_TRAY
+from .constants import DEFAULT_API_RATE
+from .constants import DEFAULT_CDN_RATE
+from .constants import DEFAULT_CHUNK_SIZE
+from .constants import DEFAULT_CONNECT_TIMEOUT
+from .constants import DEFAULT_PATH_TEMPLATE
+from .constants import DEFAULT_PER_HOST
+from .constants import DEFAULT_POOL_SIZE
+from .constants import DEFAULT_PREFETCH
+from .constants import DEFAULT_READ_TIMEOUT
+from .constants import DEFAULT_RETRIES
+from .constants import DEFAULT_VERIFY_WORKERS
+from .constants import DEFAULT_WATCH_MAX
+from .constants import DEFAULT_WATCH_MIN
+from .constants import DEFAULT_WORKERS
+from .constants import ERROR_ACCOUNT
 from .constants import INFO_ALL_DONE
+from .constants import INFO_DEDUP_REPORT
+from .constants import INFO_DEDUP_STORE
 from .constants import INFO_DOWNLOADING
 from .constants import INFO_FETCHING_FOR
 from .constants import INFO_FINISH_DOWNLOADING
+from .constants import INFO_INDEX_SIZE
+from .constants import INFO_PROGRESS_MEDIA
+from .constants import INFO_PROGRESS_REELS
+from .constants import INFO_RECONCILE_REPORT
 from .constants import INFO_REEL_FOUND
 from .constants import INFO_REEL_FOUND_FOR_USER
-from .constants import INFO_USER_INCLUDE
+from .constants import INFO_REPORT
+from .constants import INFO_REPORT_LOG
+from .constants import INFO_UNCHANGED
+from .constants import INFO_VERIFY_REPORT
+from .constants import INFO_WATCH_NEXT
+from .constants import RENDITION_BEST
+from .constants import RENDITIONS
+from .constants import REPORT_KEYS
+from .constants import STORE_LINK_HARDLINK
+from .constants import STORE_LINKS
 from .constants import WARNING_IGNORED
-from .instagram import Instagram
+from .constants import WARNING_WATCH_BACKEND
+from .downloader import Downloader
+from .metrics import export
+from .paths import account_template
+from .paths import path_template
+from .paths import PathPlanner
+from .pipeline import fetch_reels
+from .pipeline import fetch_reels_async
+from .pipeline import prioritize
+from .selection import Selection
+from .store import ContentStore
 from .utils import ask_user_for_input
+from .utils import config_digest
 from .utils import config_validator
 from .utils import dump_response
 from .utils import filepath_logging
 from .utils import home_path
+from .verify import Verifier
 
 
-logging.basicConfig(
-    filename=filepath_logging(),
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%dT%H:%M:%S",
-)
 log = logging.getLogger(__name__)
 
 
+def setup_logging():
+    """Log to a new file in `~/.instagram-story`."""
+    logging.basicConfig(
+        filename=filepath_logging(),
+        level=logging.DEBUG,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%dT%H:%M:%S",
+    )
+
+
 def init_user_config():
     log.info("Config created at: {}".format(home_path(CONFIG_PATH_JSON)))
     config = [ask_user_for_input()]
@@ -46,34 +103,44 @@ def init_user_config():
     exit()
 
 
-def get_include_list(download_only) -> list:
-    if os.path.isfile(download_only):
-        try:
-            with open(download_only) as f:
-                users = re.findall("^[\d]+", f.read(), re.MULTILINE)
-                log.info(INFO_USER_INCLUDE, len(users))
-                return users
-        except:
-            return []
+def config_validated(content: bytes) -> bool:
+    """Validate a config file unless it passed validation before unchanged.
 
-    return []
+    The checksum of the last valid config is kept in
+    `~/.instagram-story/config.sha256`.
+    """
+    digest = config_digest(content)
+    path = home_path(CONFIG_PATH_DIGEST)
+    try:
+        with open(path) as f:
+            if f.read().strip() == digest:
+                return True
+    except OSError:
+        pass
+
+    if not config_validator(json.loads(content)):
+        return False
+    try:
+        with open(path, "w") as f:
+            f.write(digest)
+    except OSError as e:
+        log.debug("Unable to save config checksum: %s", e)
+    return True
 
 
-def read_config(config_file: str, download_only: str) -> dict:
+def read_config(config_file: str) -> dict:
     if not os.path.isfile(config_file):
         init_user_config()
 
     try:
-        with open(config_file) as f:
-            json_data = json.load(f)
-            if config_validator(json_data):
-                config = {
-                    "user_list": json_data,
-                    "include": get_include_list(download_only),
-                }
-                return config
-            else:
-                raise Exception("json_data validate error")
+        with open(config_file, "rb") as f:
+            content = f.read()
+        json_data = json.loads(content)
+        if config_validated(content):
+            config = {"user_list": json_data}
+            return config
+        else:
+            raise Exception("json_data validate error")
 
     except IOError:
         raise Exception(f"unable to read {config_file}")
@@ -84,77 +151,742 @@ def read_config(config_file: str, download_only: str) -> dict:
         )
 
 
-def download_stories(config: dict, download_ids: list, options: dict):
-    username = config["username"]
-    json_backup = config["json_backup"]
+def reel_latest(reel: dict) -> int:
+    """Timestamp of the newest story in a reel."""
+    if reel.get("latest_reel_media"):
+        return reel["latest_reel_media"]
+    return max((item.get("taken_at", 0) for item in reel.get("items", [])), default=0)
 
-    instagram = Instagram(config, options)
 
-    log.info(INFO_FETCHING_FOR, username)
+def save_response(instagram, config: dict, timestamp: int, content_type: str, content):
+    """Save an API response to the account's archive or `json_backup`.
 
-    reels_tray = instagram.get_tray()
+    With `--stream-json` responses are saved while they are parsed.
+    """
+    if instagram.stream_json:
+        return
+    if instagram.archive is not None:
+        instagram.archive.write(content_type, timestamp, content_type, content)
+    else:
+        dump_response(
+            timestamp=timestamp,
+            content_type=content_type,
+            content=content,
+            prefix=config["json_backup"],
+        )
 
-    dump_response(
-        timestamp=int(time.time()),
-        content_type="tray_{}".format(config["id"]),
-        content=reels_tray,
-        prefix=json_backup,
-    )
 
-    log.info(INFO_REEL_FOUND, len(reels_tray["tray"]), username)
+def select_users(
+    instagram, config: dict, reels_tray: dict, selection: Selection, options
+) -> tuple:
+    """Pick the users whose reels have to be fetched.
 
-    user_ids_with_reel = instagram.user_ids()
+    Saves the tray, applies the include and exclude lists of the account in
+    one pass and skips reels that did not change since the last run. The
+    remaining users are ordered by the expiry of their reels, users on the
+    include list first, see `prioritize`.
 
-    if len(download_ids) > 0:
-        users_to_download = [a for a in user_ids_with_reel if a in download_ids]
-    else:
-        users_to_download = user_ids_with_reel
+    Args:
+        instagram (Instagram): Session the tray was fetched with.
+        config (dict): Account entry from `config.json`.
+        reels_tray (dict): Reel tray response.
+        selection (Selection): Include and exclude lists of users.
+        options: Parsed command line options.
 
-    users_ignored = instagram.ignored_users(download_ids)
+    Returns:
+        tuple: User IDs to fetch and the last seen `latest_reel_media` per user.
+    """
+    username = config["username"]
+
+    save_response(
+        instagram,
+        config,
+        int(time.time()),
+        CONTENT_TYPE_TRAY.format(config["id"]),
+        reels_tray,
+    )
+
+    log.info(INFO_REEL_FOUND, len(reels_tray["tray"]), username)
+
+    rules = selection.rules(config)
+    users_to_download, users_ignored = rules.select(instagram.tray_index)
+    if users_ignored:
+        log.warning(WARNING_IGNORED, ", ".join(users_ignored))
 
     print(
         INFO_DOWNLOADING.format(
-            username, len(users_to_download), len(user_ids_with_reel)
+            username, len(users_to_download), len(instagram.tray_index)
         )
     )
 
-    def chunks(lst, n):
-        """Yield successive n-sized chunks from lst."""
-        for i in range(0, len(lst), n):
-            yield lst[i : i + n]
-
-    with tqdm(total=len(users_to_download)) as pbar:
-        for user_ids in chunks(users_to_download, 8):
-            reels_chunk = instagram.get_reel_chunk(user_ids)
-            for user_id in user_ids:
-                if user_id in reels_chunk:
-                    reel = reels_chunk.get(user_id)
-
-                    name = reel["user"]["username"]
-                    count = reel["media_count"] or len(reel["items"])
-                    pbar.set_description("+{} {} ({})".format(count, name, user_id))
-                    log.info(INFO_REEL_FOUND_FOR_USER, count, name, user_id)
-
-                    dump_response(
-                        timestamp=int(reel.get("expiring_at")),
-                        content_type="user_reel_{}".format(user_id),
-                        content=reel,
-                        prefix=json_backup,
-                    )
+    if getattr(options, "full", False):
+        seen = {}
+    else:
+        seen = instagram.index.seen_reels(config["id"])
+    tray_latest = instagram.tray_latest()
+    users_changed = prioritize(
+        [a for a in users_to_download if tray_latest.get(a, 0) > seen.get(a, -1)],
+        instagram.tray_index,
+        preferred=rules.include,
+    )
+    log.info(INFO_UNCHANGED, len(users_to_download) - len(users_changed), username)
+
+    instagram.stats["users"] += len(users_to_download)
+    instagram.stats["unchanged"] += len(users_to_download) - len(users_changed)
+    instagram.stats["ignored"] += len(users_ignored)
+    return users_changed, seen
+
+
+def save_reel(instagram, config: dict, user_id: str, reel: dict, media_bar):
+    """Log and save a fetched reel before its media is queued."""
+    name = reel["user"]["username"]
+    count = reel["media_count"] or len(reel["items"])
+    media_bar.set_description("+{} {} ({})".format(count, name, user_id))
+    log.info(INFO_REEL_FOUND_FOR_USER, count, name, user_id)
+
+    save_response(
+        instagram,
+        config,
+        int(reel.get("expiring_at")),
+        CONTENT_TYPE_REEL.format(user_id),
+        reel,
+    )
+
 
-                    instagram.download_reel(reel)
+def track_downloads(queued: list, media_bar):
+    """Advance `media_bar` as the `queued` downloads finish."""
 
-                    time.sleep(1)
-                    pbar.update(1)
-        pbar.set_description("")
-        pbar.update(0)
+    def on_downloaded(_):
+        media_bar.update(1)
+
+    media_bar.total += len(queued)
+    media_bar.refresh()
+    for future in queued:
+        future.add_done_callback(on_downloaded)
+
+
+def mark_seen(instagram, config: dict, reel_futures: dict):
+    """Remember reels whose downloads all succeeded for the next run.
+
+    Args:
+        instagram (Instagram): Session the reels were downloaded with.
+        config (dict): Account entry from `config.json`.
+        reel_futures (dict): User ID to `latest_reel_media` and futures.
+    """
+    for user_id, (latest, queued) in reel_futures.items():
+        if all(
+            not a.cancelled() and a.exception() is None and a.result() is not None
+            for a in queued
+        ):
+            instagram.index.mark_seen(config["id"], user_id, latest)
+
+
+def progress_bars(total: int, slot: int) -> tuple:
+    """Progress bars for fetched reels and downloaded media of an account."""
+    from tqdm import tqdm
+
+    reels_bar = tqdm(total=total, desc=INFO_PROGRESS_REELS, position=2 * slot)
+    media_bar = tqdm(total=0, desc=INFO_PROGRESS_MEDIA, position=2 * slot + 1)
+    return reels_bar, media_bar
+
+
+def sync_account(
+    instagram, config: dict, selection: Selection, options, slot: int = 0, stop=None
+) -> list:
+    """Download the new stories of an account once.
+
+    Args:
+        instagram (Instagram): Logged in session of the account.
+        config (dict): Account entry from `config.json`.
+        selection (Selection): Include and exclude lists of users.
+        options: Parsed command line options.
+        slot (int): Position of the account's progress bars.
+        stop (threading.Event): Stop queueing reels once set.
+
+    Returns:
+        list: User IDs whose reels changed since the last run.
+    """
+    reels_tray = instagram.get_tray()
+    users_changed, seen = select_users(
+        instagram, config, reels_tray, selection, options
+    )
+
+    futures = []
+    reel_futures = {}
+    reels_bar, media_bar = progress_bars(len(users_changed), slot)
+    with reels_bar, media_bar:
+        for user_id, reel in fetch_reels(
+            instagram,
+            users_changed,
+            chunk_size=getattr(options, "chunk_size", DEFAULT_CHUNK_SIZE),
+            prefetch=getattr(options, "prefetch", DEFAULT_PREFETCH),
+            on_fetched=reels_bar.update,
+        ):
+            save_reel(instagram, config, user_id, reel, media_bar)
+            queued = instagram.download_reel(reel, since=seen.get(user_id, 0))
+            reel_futures[user_id] = (reel_latest(reel), queued)
+            track_downloads(queued, media_bar)
+            futures.extend(queued)
+            instagram.count("reels")
+            if stop is not None and stop.is_set():
+                break
+
+        wait(futures)
+        media_bar.set_description(INFO_PROGRESS_MEDIA)
         # else:
         #     ctypes.windll.user32.MessageBoxW(0, "Error Downloading", "instagram-story", 1)
 
-    instagram.close()
+    mark_seen(instagram, config, reel_futures)
+    return users_changed
+
+
+def download_stories(
+    config: dict,
+    selection: Selection,
+    options: dict,
+    downloader=None,
+    index=None,
+    limiter=None,
+    verifier=None,
+    slot: int = 0,
+) -> Counter:
+    """Download stories for a single account.
+
+    Args:
+        config (dict): Account entry from `config.json`.
+        selection (Selection): Include and exclude lists of users.
+        options: Parsed command line options.
+        downloader (Downloader): Download pool shared between accounts.
+        index (DownloadIndex): Index of downloaded posts shared between
+            accounts.
+        limiter (RateLimiter): Rate limiter shared between accounts.
+        verifier (Verifier): Process pool checking downloaded files.
+        slot (int): Position of the account's progress bars.
+
+    Returns:
+        Counter: Statistics of the run.
+    """
+    from .instagram import Instagram
+
+    username = config["username"]
+
+    instagram = Instagram(
+        config,
+        options,
+        downloader=downloader,
+        index=index,
+        limiter=limiter,
+        verifier=verifier,
+    )
+
+    log.info(INFO_FETCHING_FOR, username)
+
+    try:
+        sync_account(instagram, config, selection, options, slot=slot)
+    finally:
+        instagram.close()
 
-    log.warning(WARNING_IGNORED, ", ".join(users_ignored))
     log.info(INFO_FINISH_DOWNLOADING, username)
+    return instagram.stats
+
+
+def watch_stories(
+    config: dict,
+    selection: Selection,
+    options,
+    stop,
+    downloader=None,
+    index=None,
+    limiter=None,
+    verifier=None,
+    slot: int = 0,
+) -> Counter:
+    """Download stories for a single account until `stop` is set.
+
+    The session stays open between polls of the reel tray. The delay to the
+    next poll adapts to the account's activity and to reels that still have
+    pending stories, see `PollSchedule`.
+
+    Args:
+        config (dict): Account entry from `config.json`.
+        selection (Selection): Include and exclude lists of users.
+        options: Parsed command line options.
+        stop (threading.Event): Set to shut down after the current poll.
+        downloader (Downloader): Download pool shared between accounts.
+        index (DownloadIndex): Index of downloaded posts shared between
+            accounts.
+        limiter (RateLimiter): Rate limiter shared between accounts.
+        verifier (Verifier): Process pool checking downloaded files.
+        slot (int): Position of the account's progress bars.
+
+    Returns:
+        Counter: Statistics of all polls.
+    """
+    from .instagram import Instagram
+    from .watch import PollSchedule
+
+    username = config["username"]
+
+    instagram = Instagram(
+        config,
+        options,
+        downloader=downloader,
+        index=index,
+        limiter=limiter,
+        verifier=verifier,
+    )
+    schedule = PollSchedule(
+        getattr(options, "min_interval", DEFAULT_WATCH_MIN),
+        getattr(options, "max_interval", DEFAULT_WATCH_MAX),
+    )
+
+    try:
+        while not stop.is_set():
+            log.info(INFO_FETCHING_FOR, username)
+            try:
+                users_changed = sync_account(
+                    instagram, config, selection, options, slot=slot, stop=stop
+                )
+            except Exception:  # pylint: disable=broad-except
+                log.exception(ERROR_ACCOUNT, username)
+                instagram.count("polls_failed")
+                users_changed = []
+            instagram.count("polls")
+
+            seen = instagram.index.seen_reels(config["id"])
+            tray_latest = instagram.tray_latest()
+            pending = [
+                instagram.tray_index.get(a, {}).get("expiring_at") or 0
+                for a in users_changed
+                if seen.get(a, -1) < tray_latest.get(a, 0)
+            ]
+            export(
+                getattr(options, "metrics", None), getattr(options, "prometheus", None)
+            )
+            instagram.save_cookies()
+            delay = schedule.next_delay(len(users_changed), pending)
+            log.info(INFO_WATCH_NEXT, username, delay)
+            stop.wait(delay)
+    finally:
+        instagram.close()
+
+    log.info(INFO_FINISH_DOWNLOADING, username)
+    return instagram.stats
+
+
+async def download_stories_async(
+    config: dict,
+    selection: Selection,
+    options: dict,
+    downloader=None,
+    index=None,
+    limiter=None,
+    verifier=None,
+    slot: int = 0,
+) -> Counter:
+    """Download stories for a single account with the async backend.
+
+    See `download_stories` for the arguments, `downloader` is an
+    `AsyncDownloader`.
+    """
+    import asyncio
+
+    from .aio import AsyncInstagram
+
+    username = config["username"]
+
+    instagram = AsyncInstagram(
+        config,
+        options,
+        downloader=downloader,
+        index=index,
+        limiter=limiter,
+        verifier=verifier,
+    )
+
+    log.info(INFO_FETCHING_FOR, username)
+
+    try:
+        reels_tray = await instagram.get_tray()
+        users_changed, seen = select_users(
+            instagram, config, reels_tray, selection, options
+        )
+
+        tasks = []
+        reel_futures = {}
+        reels_bar, media_bar = progress_bars(len(users_changed), slot)
+        with reels_bar, media_bar:
+            async for user_id, reel in fetch_reels_async(
+                instagram,
+                users_changed,
+                chunk_size=getattr(options, "chunk_size", DEFAULT_CHUNK_SIZE),
+                prefetch=getattr(options, "prefetch", DEFAULT_PREFETCH),
+                on_fetched=reels_bar.update,
+            ):
+                save_reel(instagram, config, user_id, reel, media_bar)
+                queued = await instagram.download_reel(reel, since=seen.get(user_id, 0))
+                reel_futures[user_id] = (reel_latest(reel), queued)
+                track_downloads(queued, media_bar)
+                tasks.extend(queued)
+                instagram.count("reels")
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+            media_bar.set_description(INFO_PROGRESS_MEDIA)
+
+        mark_seen(instagram, config, reel_futures)
+    finally:
+        await instagram.close()
+
+    log.info(INFO_FINISH_DOWNLOADING, username)
+    return instagram.stats
+
+
+def account_backend(user: dict, options) -> str:
+    """HTTP backend of an account, the command line overrides the config."""
+    return getattr(options, "backend", None) or user.get("backend", BACKEND_SYNC)
+
+
+def run_accounts(user_list: list, selection: Selection, options) -> Counter:
+    """Download stories for every enabled account.
+
+    Accounts run in up to `--accounts` threads, accounts using the async
+    backend run as tasks on one event loop. They share one download pool,
+    which caps the total number of concurrent downloads, one rate limiter,
+    and one index of claimed posts, so a story seen by several accounts is
+    downloaded once. With `--watch` every account polls in its own thread
+    until SIGTERM.
+
+    Args:
+        user_list ([dict]): Account entries from `config.json`.
+        selection (Selection): Include and exclude lists of users.
+        options: Parsed command line options.
+
+    Returns:
+        Counter: Statistics aggregated over all accounts.
+    """
+    from .index import DownloadIndex
+    from .ratelimit import RateLimiter
+
+    accounts = [user for user in user_list if user.get("download")]
+    parallel = max(1, min(getattr(options, "accounts", 1), len(accounts) or 1))
+
+    index = DownloadIndex(getattr(options, "index", home_path(CONFIG_PATH_INDEX)))
+    limiter = RateLimiter(
+        api_rate=getattr(options, "api_rate", DEFAULT_API_RATE),
+        cdn_rate=getattr(options, "cdn_rate", DEFAULT_CDN_RATE),
+    )
+    verifier = (
+        Verifier(getattr(options, "verify_workers", DEFAULT_VERIFY_WORKERS))
+        if getattr(options, "verify", False)
+        else None
+    )
+    sync_accounts = [a for a in accounts if account_backend(a, options) == BACKEND_SYNC]
+    async_accounts = [a for a in accounts if a not in sync_accounts]
+
+    results = []
+    try:
+        if getattr(options, "watch", False):
+            from .watch import handle_stop_signals
+
+            stop = threading.Event()
+            handle_stop_signals(stop)
+            if async_accounts:
+                log.warning(WARNING_WATCH_BACKEND, len(async_accounts))
+            results += run_sync_accounts(
+                accounts,
+                selection,
+                options,
+                index,
+                limiter,
+                max(1, len(accounts)),
+                stop=stop,
+                verifier=verifier,
+            )
+        else:
+            if sync_accounts:
+                results += run_sync_accounts(
+                    sync_accounts,
+                    selection,
+                    options,
+                    index,
+                    limiter,
+                    parallel,
+                    verifier=verifier,
+                )
+            if async_accounts:
+                import asyncio
+
+                results += asyncio.run(
+                    run_async_accounts(
+                        async_accounts,
+                        selection,
+                        options,
+                        index,
+                        limiter,
+                        parallel,
+                        verifier=verifier,
+                    )
+                )
+    finally:
+        if verifier is not None:
+            verifier.close()
+        index.close()
+
+    totals = Counter()
+    for username, result in results:
+        if isinstance(result, Exception):
+            log.error(ERROR_ACCOUNT, username, exc_info=result)
+            totals["accounts_failed"] += 1
+        else:
+            totals.update(result)
+            totals["accounts"] += 1
+    return totals
+
+
+def run_sync_accounts(
+    accounts: list,
+    selection: Selection,
+    options,
+    index,
+    limiter,
+    parallel: int,
+    stop=None,
+    verifier=None,
+) -> list:
+    """Run `download_stories` for `accounts` in `parallel` threads.
+
+    With a `stop` event every account runs `watch_stories` in its own thread
+    until the event is set.
+
+    Returns:
+        list: Username and statistics or exception of every account.
+    """
+    downloader = Downloader(
+        workers=getattr(options, "workers", DEFAULT_WORKERS),
+        per_host=getattr(options, "per_host", DEFAULT_PER_HOST),
+    )
+
+    def run(position, user):
+        kwargs = dict(
+            downloader=downloader,
+            index=index,
+            limiter=limiter,
+            verifier=verifier,
+            slot=position % parallel,
+        )
+        if stop is not None:
+            return watch_stories(user, selection, options, stop, **kwargs)
+        return download_stories(user, selection, options, **kwargs)
+
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            jobs = {
+                executor.submit(run, position, user): user
+                for position, user in enumerate(accounts)
+            }
+            for job in as_completed(jobs):
+                username = jobs[job]["username"]
+                try:
+                    results.append((username, job.result()))
+                except Exception as e:  # pylint: disable=broad-except
+                    results.append((username, e))
+    finally:
+        downloader.close()
+
+    return results
+
+
+async def run_async_accounts(
+    accounts: list,
+    selection: Selection,
+    options,
+    index,
+    limiter,
+    parallel: int,
+    verifier=None,
+) -> list:
+    """Run `download_stories_async` for `accounts`, `parallel` at a time.
+
+    Returns:
+        list: Username and statistics or exception of every account.
+    """
+    import asyncio
+
+    from .aio import AsyncDownloader
+
+    downloader = AsyncDownloader(
+        workers=getattr(options, "workers", DEFAULT_WORKERS),
+        per_host=getattr(options, "per_host", DEFAULT_PER_HOST),
+    )
+    slots = asyncio.Semaphore(parallel)
+
+    async def run(position, user):
+        async with slots:
+            return await download_stories_async(
+                user,
+                selection,
+                options,
+                downloader=downloader,
+                index=index,
+                limiter=limiter,
+                verifier=verifier,
+                slot=position % parallel,
+            )
+
+    jobs = [run(position, user) for position, user in enumerate(accounts)]
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    return [(user["username"], result) for user, result in zip(accounts, results)]
+
+
+def media_directories(user_list: list, options) -> list:
+    """Media directory and path template of every account, without repeats."""
+    return sorted(
+        {(a["media_directory"], account_template(a, options)) for a in user_list}
+    )
+
+
+def rebuild_user_index(user_list: list, options):
+    """Rebuild the download index from the media directory of every account.
+
+    Args:
+        user_list ([dict]): Account entries from `config.json`.
+        options: Parsed command line options.
+    """
+    from .index import DownloadIndex
+    from .index import rebuild_index
+
+    index = DownloadIndex(options.index)
+    try:
+        for directory, template in media_directories(user_list, options):
+            rebuild_index(index, directory, options.workers, template)
+        print(INFO_INDEX_SIZE.format(options.index, len(index)))
+    finally:
+        index.close()
+
+
+def dedup_report(options):
+    """Print the space deduplicating the indexed media could save.
+
+    With `--store` the space the store's hardlinks actually save is printed
+    as well.
+    """
+    from .index import DownloadIndex
+
+    index = DownloadIndex(options.index)
+    try:
+        print(INFO_DEDUP_REPORT.format(**index.dedup_stats()))
+    finally:
+        index.close()
+    if options.store and os.path.isdir(options.store):
+        print(INFO_DEDUP_STORE.format(**ContentStore(options.store).usage()))
+
+
+def verify_media(user_list: list, options):
+    """Check every media file in the media directory of every account.
+
+    Corrupt files are listed, with `--remove` they are deleted and dropped
+    from the download index, so they are downloaded again while their story
+    is live.
+
+    Args:
+        user_list ([dict]): Account entries from `config.json`.
+        options: Parsed command line options.
+
+    Returns:
+        int: Number of corrupt files.
+    """
+    from .index import DownloadIndex
+    from .index import media_post_id
+
+    verifier = Verifier(options.verify_workers)
+    index = DownloadIndex(options.index) if options.remove else None
+    checked = corrupt = 0
+    try:
+        for directory, template in media_directories(user_list, options):
+            planner = PathPlanner(directory, template)
+            for path, problem in verifier.check_tree(directory):
+                checked += 1
+                if problem is None:
+                    continue
+                corrupt += 1
+                print("{}: {}".format(path, problem))
+                if index is not None:
+                    os.remove(path)
+                    post_id = media_post_id(path, planner)
+                    if post_id is not None:
+                        index.remove(post_id)
+    finally:
+        verifier.close()
+        if index is not None:
+            index.close()
+    print(INFO_VERIFY_REPORT.format(checked=checked, corrupt=corrupt))
+    return corrupt
+
+
+def reconcile_backups(user_list: list, options) -> Counter:
+    """Download stories found in the saved reels but missing on disk.
+
+    The `json_backup` of every account is read in `--processes` processes,
+    stories whose CDN URLs are still valid are downloaded again, see
+    `reconcile_account`.
+
+    Args:
+        user_list ([dict]): Account entries from `config.json`.
+        options: Parsed command line options.
+
+    Returns:
+        Counter: Statistics aggregated over all accounts.
+    """
+    from .index import DownloadIndex
+    from .instagram import Instagram
+    from .reconcile import reconcile_account
+
+    totals = Counter()
+    index = DownloadIndex(options.index)
+    try:
+        backups = set()
+        for user in user_list:
+            if user["json_backup"] in backups:
+                continue
+            backups.add(user["json_backup"])
+            instagram = Instagram(user, options, index=index)
+            try:
+                stats = reconcile_account(instagram, options.processes, options.dry_run)
+            finally:
+                instagram.close()
+            print(INFO_RECONCILE_REPORT.format(username=user["username"], **stats))
+            totals.update(instagram.stats)
+            totals["accounts"] += 1
+    finally:
+        index.close()
+    return totals
+
+
+def migrate_archives(user_list: list, options):
+    """Move the `json_backup` files of every account into an archive.
+
+    Args:
+        user_list ([dict]): Account entries from `config.json`.
+        options: Parsed command line options.
+    """
+    from .archive import JsonArchive
+    from .archive import migrate_json_backup
+
+    for user in user_list:
+        archive = JsonArchive(user["json_backup"], options.archive or "gzip")
+        migrate_json_backup(
+            archive,
+            user["json_backup"],
+            media_directory=user["media_directory"],
+            remove=options.remove,
+        )
+
+
+def print_report(totals: Counter):
+    print(INFO_REPORT)
+    for key in REPORT_KEYS:
+        print("  {:<16}{}".format(key, totals.get(key, 0)))
 
 
 def main():
@@ -176,18 +908,293 @@ def main():
         help="Download stories listed in the file. "
         "Defaults to " + home_path(CONFIG_PATH_INCLUDE),
     )
+    parser.add_argument(
+        "-x",
+        "--exclude",
+        type=str,
+        default=home_path(CONFIG_PATH_EXCLUDE),
+        help="Never download stories of users listed in the file. "
+        "Defaults to " + home_path(CONFIG_PATH_EXCLUDE),
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Number of media files downloaded concurrently. "
+        "Defaults to {}".format(DEFAULT_WORKERS),
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=DEFAULT_PER_HOST,
+        help="Number of concurrent downloads from a single CDN host. "
+        "Defaults to {}".format(DEFAULT_PER_HOST),
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of users per reels_media request. "
+        "Defaults to {}".format(DEFAULT_CHUNK_SIZE),
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=DEFAULT_PREFETCH,
+        help="Number of reels_media responses fetched ahead of the downloads. "
+        "Defaults to {}".format(DEFAULT_PREFETCH),
+    )
+    parser.add_argument(
+        "-a",
+        "--accounts",
+        type=int,
+        default=1,
+        help="Number of accounts from the config downloaded in parallel. "
+        "Defaults to 1",
+    )
+    parser.add_argument(
+        "--api-rate",
+        type=float,
+        default=DEFAULT_API_RATE,
+        help="Maximum API requests per second. "
+        "Defaults to {}".format(DEFAULT_API_RATE),
+    )
+    parser.add_argument(
+        "--cdn-rate",
+        type=float,
+        default=DEFAULT_CDN_RATE,
+        help="Maximum media requests per second. "
+        "Defaults to {}".format(DEFAULT_CDN_RATE),
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="Number of retries for failed requests. "
+        "Defaults to {}".format(DEFAULT_RETRIES),
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        help="HTTP backend, overrides the `backend` of every account in the "
+        "config. Defaults to " + BACKEND_SYNC,
+    )
+    parser.add_argument(
+        "--http2",
+        action="store_true",
+        help="Use HTTP/2 with the async backend.",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help="Number of pooled connections kept per host. "
+        "Defaults to {}".format(DEFAULT_POOL_SIZE),
+    )
+    parser.add_argument(
+        "--no-keep-alive",
+        action="store_true",
+        help="Close every connection after a single request.",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=DEFAULT_CONNECT_TIMEOUT,
+        help="Seconds to wait for a connection. "
+        "Defaults to {}".format(DEFAULT_CONNECT_TIMEOUT),
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        default=DEFAULT_READ_TIMEOUT,
+        help="Seconds to wait for data from the server. "
+        "Defaults to {}".format(DEFAULT_READ_TIMEOUT),
+    )
+    parser.add_argument(
+        "--rendition",
+        choices=RENDITIONS,
+        default=RENDITION_BEST,
+        help="Which rendition of a story to download: the highest or lowest "
+        "resolution, or only the smallest image of photos and videos. "
+        "Defaults to " + RENDITION_BEST,
+    )
+    parser.add_argument(
+        "--max-height",
+        type=int,
+        help="Prefer renditions at most this many pixels tall, the smallest "
+        "one is downloaded if none fits.",
+    )
+    parser.add_argument(
+        "--path-template",
+        type=path_template,
+        help="Media path below the media directory, overrides the "
+        "`path_template` of every account. Fields: {user_id}, {username}, "
+        "{post_id}, {timestamp}, {year}, {month}, {day}, {date}, {datetime}. "
+        "Defaults to " + DEFAULT_PATH_TEMPLATE,
+    )
+    parser.add_argument(
+        "--index",
+        type=str,
+        default=home_path(CONFIG_PATH_INDEX),
+        help="Path of the download index database. "
+        "Defaults to " + home_path(CONFIG_PATH_INDEX),
+    )
+
+    parser.add_argument(
+        "--archive",
+        choices=list(ARCHIVE_CODECS),
+        help="Append API responses and media sidecars to compressed segments "
+        "in json_backup instead of writing a file for each of them.",
+    )
+    parser.add_argument(
+        "--stream-json",
+        action="store_true",
+        help="Parse API responses while they arrive and save them unchanged, "
+        "keeping only compact tray entries in memory.",
+    )
+    parser.add_argument(
+        "--store",
+        type=str,
+        help="Directory of a content-addressed store. Every media file is "
+        "kept there once under its checksum and linked into the media "
+        "directory.",
+    )
+    parser.add_argument(
+        "--store-link",
+        choices=STORE_LINKS,
+        default=STORE_LINK_HARDLINK,
+        help="How media files are linked to the store. "
+        "Defaults to " + STORE_LINK_HARDLINK,
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check every downloaded file for truncation, non-media content "
+        "and unexpected dimensions in background processes, and download "
+        "corrupt files again while their story is live.",
+    )
+    parser.add_argument(
+        "--verify-workers",
+        type=int,
+        default=DEFAULT_VERIFY_WORKERS,
+        help="Number of processes checking media files. "
+        "Defaults to {}".format(DEFAULT_VERIFY_WORKERS),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and poll the reel tray of every account on an "
+        "adaptive schedule until SIGTERM or Ctrl+C.",
+    )
+    parser.add_argument(
+        "--min-interval",
+        type=float,
+        default=DEFAULT_WATCH_MIN,
+        help="Shortest delay between two polls in watch mode, in seconds. "
+        "Defaults to {:.0f}".format(DEFAULT_WATCH_MIN),
+    )
+    parser.add_argument(
+        "--max-interval",
+        type=float,
+        default=DEFAULT_WATCH_MAX,
+        help="Longest delay between two polls in watch mode, in seconds. "
+        "Defaults to {:.0f}".format(DEFAULT_WATCH_MAX),
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=home_path(CONFIG_PATH_METRICS),
+        help="Path of the JSON summary with request latencies, throughput and "
+        "time spent on network and disk, written after every run. "
+        "Defaults to " + home_path(CONFIG_PATH_METRICS),
+    )
+    parser.add_argument(
+        "--prometheus",
+        type=str,
+        help="Also write the metrics to this Prometheus textfile, e.g. for the "
+        "node_exporter textfile collector.",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Fetch every reel, even if it did not change since the last run.",
+    )
+
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    commands.add_parser(
+        "rebuild-index",
+        help="Rebuild the download index from existing media directories.",
+    )
+    commands.add_parser(
+        "dedup-report",
+        help="Show the space storing identical media once saves, or could save.",
+    )
+    verify = commands.add_parser(
+        "verify",
+        help="Check the media files of every account for truncated or invalid "
+        "files.",
+    )
+    verify.add_argument(
+        "--remove",
+        action="store_true",
+        help="Delete corrupt files and forget them in the download index.",
+    )
+    reconcile = commands.add_parser(
+        "reconcile",
+        help="Download stories saved in json_backup that are missing from the "
+        "media directory while their URLs are valid.",
+    )
+    reconcile.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of processes reading json_backup. Defaults to the number "
+        "of CPUs",
+    )
+    reconcile.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only list the missing files that could be downloaded.",
+    )
+    migrate = commands.add_parser(
+        "migrate-archive",
+        help="Move existing json_backup and sidecar files into an archive.",
+    )
+    migrate.add_argument(
+        "--remove",
+        action="store_true",
+        help="Delete the files once they are archived.",
+    )
 
     args = parser.parse_args()
+    setup_logging()
 
     config_filepath = args.config_location or home_path(CONFIG_PATH_JSON)
-    download_only = args.download_only
+    config = read_config(config_filepath)
 
-    config = read_config(config_filepath, download_only)
+    if args.command == "rebuild-index":
+        rebuild_user_index(config.get("user_list"), args)
+        return
+    if args.command == "dedup-report":
+        dedup_report(args)
+        return
+    if args.command == "migrate-archive":
+        migrate_archives(config.get("user_list"), args)
+        return
+    if args.command == "verify":
+        verify_media(config.get("user_list"), args)
+        return
+    if args.command == "reconcile":
+        totals = reconcile_backups(config.get("user_list"), args)
+        print_report(totals)
+        return
 
-    for user in config.get("user_list"):
-        downlaod_ids = config.get("include")
-        if user.get("download"):
-            download_stories(user, downlaod_ids, args)
+    selection = Selection(args.download_only, args.exclude)
+    totals = run_accounts(config.get("user_list"), selection, args)
+    print_report(totals)
+    log.info(INFO_REPORT_LOG, dict(totals))
+    export(args.metrics, args.prometheus, stats=totals)
 
     log.info(INFO_ALL_DONE)
 
@@ -0,0 +1,142 @@
+"""Extraction of downloadable media files from story items"""
+from collections import namedtuple
+
+from .constants import AUDIO_EXT
+from .constants import AUDIO_KEY_SUFFIX
+from .constants import DASH_NAMESPACE
+from .constants import MEDIA_TYPE_CAROUSEL
+from .constants import MEDIA_TYPE_EXT
+from .constants import RENDITION_BEST
+from .constants import RENDITION_THUMBNAIL
+from .constants import STORY_LIFETIME
+from .rendition import pick
+
+
+"""A file to download: `suffix` and `ext` are appended to the story's path,
+`width` and `height` are the expected dimensions, if known"""
+Media = namedtuple("Media", ["url", "suffix", "ext", "width", "height"])
+"""A queued download, recorded in the index under `key` once it succeeded"""
+Job = namedtuple(
+    "Job", ["post_id", "key", "url", "path", "expiring_at", "width", "height"]
+)
+
+
+def _record(node: dict, key: str, candidate: dict, policy: str) -> str:
+    node[key] = {
+        "policy": policy,
+        "width": candidate.get("width"),
+        "height": candidate.get("height"),
+        "type": candidate.get("type"),
+        "url": candidate["url"],
+    }
+    return candidate["url"]
+
+
+def _size(candidate: dict) -> tuple:
+    return candidate.get("width") or None, candidate.get("height") or None
+
+
+def dash_tracks(manifest: str) -> tuple:
+    """Parse the video and audio representations of a DASH manifest.
+
+    Args:
+        manifest (str): `video_dash_manifest` of a story item.
+
+    Returns:
+        tuple: Video and audio candidates, dicts like `video_versions`.
+    """
+    import xml.etree.ElementTree as ET
+
+    ns = {"mpd": DASH_NAMESPACE}
+    video, audio = [], []
+    root = ET.fromstring(manifest)
+    for adaptation in root.iterfind(".//mpd:AdaptationSet", ns):
+        kind = adaptation.get("contentType") or adaptation.get("mimeType", "")
+        for representation in adaptation.iterfind("mpd:Representation", ns):
+            base_url = representation.findtext("mpd:BaseURL", namespaces=ns)
+            if not base_url:
+                continue
+            mime = representation.get("mimeType") or kind
+            candidate = {
+                "url": base_url.strip(),
+                "width": int(representation.get("width") or 0),
+                "height": int(representation.get("height") or 0),
+                "bandwidth": int(representation.get("bandwidth") or 0),
+            }
+            (audio if mime.startswith("audio") else video).append(candidate)
+    return video, audio
+
+
+def _single(node: dict, suffix: str, policy: str, max_height) -> list:
+    """Media files of an item that is not a carousel."""
+    media_type = node.get("media_type")
+    if media_type == 2 and policy != RENDITION_THUMBNAIL:
+        candidate = pick(node.get("video_versions"), policy, max_height)
+        if candidate is not None:
+            url = _record(node, "rendition", candidate, policy)
+            return [Media(url, suffix, MEDIA_TYPE_EXT[2], *_size(candidate))]
+
+        manifest = node.get("video_dash_manifest")
+        if manifest:
+            video, audio = dash_tracks(manifest)
+            candidate = pick(video, policy, max_height)
+            if candidate is not None:
+                media = [
+                    Media(
+                        _record(node, "rendition", candidate, policy),
+                        suffix,
+                        MEDIA_TYPE_EXT[2],
+                        *_size(candidate),
+                    )
+                ]
+                candidate = pick(audio, policy)
+                if candidate is not None:
+                    url = _record(node, "audio_rendition", candidate, policy)
+                    media.append(Media(url, suffix, AUDIO_EXT, None, None))
+                return media
+
+    # Images, video covers in thumbnail mode and unknown types with a cover
+    candidates = (node.get("image_versions2") or {}).get("candidates")
+    candidate = pick(candidates, policy, max_height)
+    if candidate is None:
+        return []
+    url = _record(node, "rendition", candidate, policy)
+    return [Media(url, suffix, MEDIA_TYPE_EXT[1], *_size(candidate))]
+
+
+def extract_media(item: dict, policy: str = RENDITION_BEST, max_height=None):
+    """List the files to download for a story item.
+
+    Carousel children get the suffix `_<n>`, a video stored as separate DASH
+    tracks yields the video and an `.m4a` audio file. Items of unknown type
+    fall back to their cover image. The chosen renditions are recorded in the
+    item under `rendition` and `audio_rendition`.
+
+    Args:
+        item (dict): Story item from the API.
+        policy (str): Rendition policy, see `rendition.pick`.
+        max_height (int): Height limit in pixels.
+
+    Returns:
+        [Media]: Files to download, empty if the item has no media.
+    """
+    if item.get("media_type") == MEDIA_TYPE_CAROUSEL:
+        media = []
+        for n, child in enumerate(item.get("carousel_media") or [], 1):
+            media += _single(child, "_{}".format(n), policy, max_height)
+        return media
+    return _single(item, "", policy, max_height)
+
+
+def media_key(post_id: str, suffix: str, ext: str) -> str:
+    """Index key of a media file of a story.
+
+    Carousel children are keyed by their suffix, DASH audio tracks share the
+    name of their video and get `AUDIO_KEY_SUFFIX` on top.
+    """
+    return post_id + suffix + (AUDIO_KEY_SUFFIX if ext == AUDIO_EXT else "")
+
+
+def item_expiry(item: dict) -> int:
+    """Unix time at which the media URLs of a story item expire."""
+    return item.get("expiring_at") or item["taken_at"] + STORY_LIFETIME
@@ -0,0 +1,202 @@
+"""Run metrics: latency histograms, counters and their export"""
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .constants import LATENCY_BUCKETS
+from .constants import METRICS_PREFIX
+
+
+class Histogram:
+    """Cumulative-friendly histogram with fixed bucket upper bounds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile from the bucket bounds, `inf` past the last."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (math.inf,), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def summary(self) -> dict:
+        """Count, sum, mean and quantiles, None for quantiles past the last bucket."""
+        quantiles = {
+            name: self.quantile(q)
+            for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+        }
+        return dict(
+            count=self.count,
+            sum=round(self.sum, 6),
+            mean=round(self.sum / self.count, 6) if self.count else 0.0,
+            **{k: None if v == math.inf else v for k, v in quantiles.items()},
+        )
+
+
+def _key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _labels(key: tuple, **extra) -> str:
+    pairs = list(key) + [(k, str(v)) for k, v in extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in pairs) + "}"
+
+
+class Metrics:
+    """Thread-safe registry of labelled counters and histograms."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add `value` to a counter."""
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = _key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """Record a value, usually seconds, in a histogram."""
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = _key(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the duration of the `with` block in histogram `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def disk_timer(self, op: str):
+        """Add the duration of the `with` block to the disk time of `op`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc("disk_seconds_total", time.perf_counter() - start, op=op)
+
+    def summary(self, stats: dict = None) -> dict:
+        """JSON serializable summary of the run.
+
+        Args:
+            stats (dict): Run statistics to include, e.g. the report totals.
+        """
+        with self.lock:
+            counters = {
+                name: {_labels(key) or "total": value for key, value in series.items()}
+                for name, series in self.counters.items()
+            }
+            histograms = {
+                name: {_labels(key) or "all": h.summary() for key, h in series.items()}
+                for name, series in self.histograms.items()
+            }
+        # Network time is waiting for response headers plus reading bodies
+        requests = {
+            key: h["sum"]
+            for key, h in histograms.get("http_request_seconds", {}).items()
+        }
+        transfer = sum(counters.get("transfer_seconds_total", {}).values())
+        network = transfer + sum(requests.values())
+        cdn = transfer + requests.get(_labels((("kind", "cdn"),)), 0.0)
+        disk = sum(counters.get("disk_seconds_total", {}).values())
+        received = sum(counters.get("download_bytes_total", {}).values())
+        return {
+            "started": int(self.started),
+            "duration": round(time.time() - self.started, 3),
+            "network_seconds": round(network, 3),
+            "disk_seconds": round(disk, 3),
+            "bytes_per_second": round(received / cdn, 1) if cdn else 0.0,
+            "stats": dict(stats or {}),
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def prometheus(self, stats: dict = None) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append("# TYPE {}{} counter".format(METRICS_PREFIX, name))
+                for key, value in sorted(series.items()):
+                    lines.append(
+                        "{}{}{} {}".format(METRICS_PREFIX, name, _labels(key), value)
+                    )
+            for name, series in sorted(self.histograms.items()):
+                metric = METRICS_PREFIX + name
+                lines.append("# TYPE {} histogram".format(metric))
+                for key, h in sorted(series.items()):
+                    cumulative = 0
+                    for bound, n in zip(h.buckets + (math.inf,), h.counts):
+                        cumulative += n
+                        le = "+Inf" if bound == math.inf else repr(float(bound))
+                        lines.append(
+                            "{}_bucket{} {}".format(
+                                metric, _labels(key, le=le), cumulative
+                            )
+                        )
+                    lines.append("{}_sum{} {}".format(metric, _labels(key), h.sum))
+                    lines.append("{}_count{} {}".format(metric, _labels(key), h.count))
+        for name, value in sorted((stats or {}).items()):
+            lines.append("# TYPE {}run_{} gauge".format(METRICS_PREFIX, name))
+            lines.append("{}run_{} {}".format(METRICS_PREFIX, name, value))
+        lines.append("# TYPE {}last_run_timestamp_seconds gauge".format(METRICS_PREFIX))
+        lines.append(
+            "{}last_run_timestamp_seconds {}".format(METRICS_PREFIX, time.time())
+        )
+        return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: str, content: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(tmp, "w") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def export(path: str = None, textfile: str = None, stats: dict = None):
+    """Write the JSON summary and the Prometheus textfile of `REGISTRY`.
+
+    Args:
+        path (str): Path of the JSON summary, skipped if None.
+        textfile (str): Path of the Prometheus textfile, skipped if None.
+        stats (dict): Run statistics to include.
+    """
+    if path:
+        _write_atomic(path, json.dumps(REGISTRY.summary(stats), indent=2))
+    if textfile:
+        _write_atomic(textfile, REGISTRY.prometheus(stats))
+
+
+"""Metrics of the current process"""
+REGISTRY = Metrics()
@@ -0,0 +1,187 @@
+"""Destination paths of stories and creation of their directories"""
+import os
+import re
+import string
+import threading
+import time
+
+from .constants import DEFAULT_PATH_TEMPLATE
+from .constants import ERROR_PATH_TEMPLATE
+from .constants import PATH_FIELDS
+from .constants import PATH_TIME_FIELDS
+
+
+_known_directories = set()
+_known_lock = threading.Lock()
+"""What every field of a path template expands to, a `_<n>` after a
+username is read as the suffix of a carousel item"""
+_FIELD_PATTERNS = {
+    "user_id": r"\d+",
+    "username": r"[^/]*?",
+    "post_id": r"[^/_]+_[^/_]+",
+    "timestamp": r"\d+",
+    "year": r"\d{4}",
+    "month": r"\d{2}",
+    "day": r"\d{2}",
+    "date": r"\d{4}-\d{2}-\d{2}",
+    "datetime": r"\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}",
+}
+
+
+def ensure_directory(path: str, refresh: bool = False):
+    """Create directory `path` unless this process created or saw it before.
+
+    Directories are remembered for the lifetime of the process, see
+    `open_file` for directories removed while the program runs.
+
+    Args:
+        path (str): Directory to create.
+        refresh (bool): Create the directory even if it was seen before.
+    """
+    if not path or (path in _known_directories and not refresh):
+        return
+    os.makedirs(path, exist_ok=True)
+    with _known_lock:
+        _known_directories.add(path)
+
+
+def open_file(path: str, mode: str):
+    """Open `path` for writing, creating its directory first.
+
+    A directory that was removed since `ensure_directory` created it, e.g.
+    pruned during `--watch`, is created again.
+    """
+    directory = os.path.dirname(path)
+    ensure_directory(directory)
+    try:
+        return open(path, mode)
+    except FileNotFoundError:
+        ensure_directory(directory, refresh=True)
+        return open(path, mode)
+
+
+def template_fields(template: str) -> set:
+    """Names of the fields used by a path template."""
+    return {a[1] for a in string.Formatter().parse(template) if a[1]}
+
+
+def path_template(template: str) -> str:
+    """Check a path template, see `PathPlanner`.
+
+    Raises:
+        ValueError: The template uses an unknown field or no `{post_id}`.
+    """
+    fields = template_fields(template)
+    if "post_id" not in fields or not fields <= set(PATH_FIELDS):
+        raise ValueError(ERROR_PATH_TEMPLATE.format(template, ", ".join(PATH_FIELDS)))
+    return template
+
+
+def account_template(config: dict, options) -> str:
+    """Path template of an account, `--path-template` overrides its config."""
+    return getattr(options, "path_template", None) or config.get(
+        "path_template", DEFAULT_PATH_TEMPLATE
+    )
+
+
+def template_pattern(template: str):
+    """Regular expression matching the paths formatted from a template.
+
+    Carousel items append their `_<n>` suffix to the formatted path, it is
+    matched by the `suffix` group.
+    """
+    pattern = []
+    seen = set()
+    for literal, field, _, _ in string.Formatter().parse(template):
+        pattern.append(re.escape(literal))
+        if not field:
+            continue
+        if field in seen:
+            pattern.append("(?P={})".format(field))
+        else:
+            seen.add(field)
+            pattern.append("(?P<{}>{})".format(field, _FIELD_PATTERNS[field]))
+    pattern.append(r"(?P<suffix>_\d+)?")
+    return re.compile("".join(pattern))
+
+
+class PathPlanner:
+    """Compute the destination paths of stories from a path template.
+
+    The template is a `str.format` pattern relative to the media directory,
+    see `PATH_FIELDS` for the available fields. The media extension is
+    appended to the formatted path.
+    """
+
+    def __init__(self, directory: str, template: str = DEFAULT_PATH_TEMPLATE):
+        """Initialize the planner.
+
+        Args:
+            directory (str): Media directory of the account.
+            template (str): Path template, must contain `{post_id}`.
+
+        Raises:
+            ValueError: The template uses an unknown field or no `{post_id}`.
+        """
+        self.directory = directory
+        self.template = path_template(template)
+        self.timed = bool(template_fields(template) & set(PATH_TIME_FIELDS))
+        self.pattern = template_pattern(template)
+
+    def path(self, user: dict, item: dict) -> str:
+        """Destination of a story without extension.
+
+        Args:
+            user (dict): Owner of the story with `pk` and `username`.
+            item (dict): Story with `id` and `taken_at`.
+
+        Returns:
+            str: Path below the media directory.
+        """
+        timestamp = item["taken_at"]
+        values = {
+            "user_id": user["pk"],
+            "username": user.get("username"),
+            "post_id": item["id"],
+            "timestamp": timestamp,
+        }
+        if self.timed:
+            t = time.gmtime(timestamp)
+            date = "%04d-%02d-%02d" % t[:3]
+            values.update(
+                year="%04d" % t.tm_year,
+                month="%02d" % t.tm_mon,
+                day="%02d" % t.tm_mday,
+                date=date,
+                datetime="%s_%02d-%02d-%02d" % ((date,) + t[3:6]),
+            )
+        return os.path.join(self.directory, self.template.format(**values))
+
+    def plan(self, user: dict, items: list) -> list:
+        """Destinations of the stories of a reel, creating their directories.
+
+        Every distinct directory is created once.
+
+        Returns:
+            [str]: Path of every item of `items`, without extension.
+        """
+        paths = [self.path(user, a) for a in items]
+        for directory in {os.path.dirname(a) for a in paths}:
+            ensure_directory(directory)
+        return paths
+
+    def post_key(self, path: str) -> str:
+        """Recover the post ID from a path planned by the template.
+
+        Args:
+            path (str): Media path without extension.
+
+        Returns:
+            str: Post ID with the suffix of a carousel item, None if `path`
+                does not follow the template.
+        """
+        relative = os.path.relpath(path, self.directory).replace(os.sep, "/")
+        match = self.pattern.fullmatch(relative)
+        if match is None:
+            return None
+        return match.group("post_id") + (match.group("suffix") or "")
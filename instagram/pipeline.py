@@ -0,0 +1,190 @@
+"""Producer/consumer pipeline for fetching user reels"""
+import logging
+import math
+import queue
+import threading
+
+from .constants import DEFAULT_CHUNK_SIZE
+from .constants import DEFAULT_PREFETCH
+from .constants import PRIORITY_PREFERRED_BONUS
+
+
+log = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def plan_chunks(user_ids: list, cached: dict, n: int):
+    """Split `user_ids` into chunks of at most `n` users that are not cached.
+
+    Cached users stay in place, so the order of `user_ids` is kept.
+    """
+    chunk = []
+    remaining = 0
+    for user_id in user_ids:
+        chunk.append(user_id)
+        if user_id not in cached:
+            remaining += 1
+        if remaining == n:
+            yield chunk
+            chunk = []
+            remaining = 0
+    if chunk:
+        yield chunk
+
+
+def prioritize(
+    user_ids: list,
+    tray_index: dict,
+    preferred=(),
+    bonus: int = PRIORITY_PREFERRED_BONUS,
+) -> list:
+    """Order users by the urgency of their reels, earliest expiry first.
+
+    Args:
+        user_ids ([str]): Users to order.
+        tray_index (dict): Tray entries by user ID, see `Instagram.tray_index`.
+        preferred ([str]): Users served as if their reel expired `bonus`
+            seconds earlier, e.g. the include list.
+        bonus (int): Head start of preferred users in seconds.
+
+    Returns:
+        list: `user_ids` sorted by urgency, ties keep the tray order.
+    """
+    if not isinstance(preferred, (set, frozenset)):
+        preferred = set(preferred)
+
+    def urgency(user_id):
+        expiring_at = tray_index.get(user_id, {}).get("expiring_at") or math.inf
+        return expiring_at - bonus if user_id in preferred else expiring_at
+
+    return sorted(user_ids, key=urgency)
+
+
+def fetch_reels(
+    instagram,
+    user_ids: list,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    prefetch: int = DEFAULT_PREFETCH,
+    on_fetched=None,
+):
+    """Yield `(user_id, reel)` while the next chunks are fetched in background.
+
+    Reels are yielded in the order of `user_ids`. A producer thread requests
+    `reels_media` for `chunk_size` users at a time and keeps at most
+    `prefetch` chunks ahead of the consumer. Reels prefetched with the tray
+    are served without an API request.
+
+    Args:
+        instagram (Instagram): Logged in Instagram session.
+        user_ids ([str]): Users to fetch reels for, in order.
+        chunk_size (int): Number of users per `reels_media` request.
+        prefetch (int): Number of chunks buffered ahead of the consumer.
+        on_fetched: Optional callable receiving the number of users fetched.
+
+    Yields:
+        tuple: User ID and reel for every user that has a reel.
+    """
+    buffer = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    cached = instagram.cached_reels(user_ids)
+    log.debug(
+        "Serving %s reels from tray, fetching %s",
+        len(cached),
+        len(user_ids) - len(cached),
+    )
+
+    def produce():
+        try:
+            for chunk in plan_chunks(user_ids, cached, max(1, chunk_size)):
+                reels = instagram.get_reel_chunk(chunk)
+                if on_fetched is not None:
+                    on_fetched(len(chunk))
+                if not put((chunk, reels)):
+                    return
+        except Exception as e:  # pylint: disable=broad-except
+            put(e)
+            return
+        put(_DONE)
+
+    producer = threading.Thread(target=produce, name="reels-producer", daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            entry = buffer.get()
+            if entry is _DONE:
+                break
+            if isinstance(entry, Exception):
+                raise entry
+
+            chunk, reels = entry
+            for user_id in chunk:
+                if user_id in reels:
+                    yield user_id, reels.get(user_id)
+    finally:
+        stop.set()
+        producer.join()
+
+
+async def fetch_reels_async(
+    instagram,
+    user_ids: list,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    prefetch: int = DEFAULT_PREFETCH,
+    on_fetched=None,
+):
+    """Asyncio counterpart of `fetch_reels` for an `AsyncInstagram` session.
+
+    Yields:
+        tuple: User ID and reel for every user that has a reel.
+    """
+    import asyncio
+
+    buffer = asyncio.Queue(maxsize=max(1, prefetch))
+
+    cached = instagram.cached_reels(user_ids)
+    log.debug(
+        "Serving %s reels from tray, fetching %s",
+        len(cached),
+        len(user_ids) - len(cached),
+    )
+
+    async def produce():
+        try:
+            for chunk in plan_chunks(user_ids, cached, max(1, chunk_size)):
+                reels = await instagram.get_reel_chunk(chunk)
+                if on_fetched is not None:
+                    on_fetched(len(chunk))
+                await buffer.put((chunk, reels))
+        except Exception as e:  # pylint: disable=broad-except
+            await buffer.put(e)
+            return
+        await buffer.put(_DONE)
+
+    producer = asyncio.ensure_future(produce())
+
+    try:
+        while True:
+            entry = await buffer.get()
+            if entry is _DONE:
+                break
+            if isinstance(entry, Exception):
+                raise entry
+
+            chunk, reels = entry
+            for user_id in chunk:
+                if user_id in reels:
+                    yield user_id, reels.get(user_id)
+    finally:
+        producer.cancel()
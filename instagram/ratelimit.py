@@ -0,0 +1,150 @@
+"""Adaptive rate limiting and retries for requests to Instagram"""
+import logging
+import random
+import threading
+import time
+
+from .constants import DEFAULT_API_RATE
+from .constants import DEFAULT_BACKOFF_BASE
+from .constants import DEFAULT_BACKOFF_CAP
+from .constants import DEFAULT_CDN_RATE
+
+
+log = logging.getLogger(__name__)
+
+"""HTTP status codes worth retrying"""
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Token bucket whose refill rate adapts to throttling by the server.
+
+    The rate is halved whenever the server answers 429 and grows back
+    linearly towards `rate` on every successful request (AIMD). A
+    `Retry-After` header pauses the whole bucket.
+    """
+
+    def __init__(self, rate: float, burst: float = None, min_rate: float = None):
+        """Initialize the bucket.
+
+        Args:
+            rate (float): Maximum number of requests per second.
+            burst (float): Bucket capacity, defaults to `rate` (at least 1).
+            min_rate (float): Lower bound of the adapted rate.
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate or rate / 32
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _reserve(self) -> float:
+        """Take a token if available.
+
+        Returns:
+            float: 0 if a token was taken, else seconds to wait before retrying.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        delay = self._reserve()
+        while delay:
+            time.sleep(delay)
+            delay = self._reserve()
+
+    async def acquire_async(self):
+        """Wait without blocking the event loop until a request may be sent."""
+        import asyncio
+
+        delay = self._reserve()
+        while delay:
+            await asyncio.sleep(delay)
+            delay = self._reserve()
+
+    def throttled(self, retry_after: float = None):
+        """Slow down after the server answered 429 Too Many Requests.
+
+        Args:
+            retry_after (float): Seconds to pause, from `Retry-After`.
+        """
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + retry_after
+                )
+        log.warning("Throttled, request rate lowered to %.2f/s", self.rate)
+
+    def succeeded(self):
+        """Speed up again after a successful request."""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter:
+    """Token buckets per endpoint class, shared by all sessions of a run."""
+
+    def __init__(self, api_rate=DEFAULT_API_RATE, cdn_rate=DEFAULT_CDN_RATE):
+        """Initialize the buckets.
+
+        Args:
+            api_rate (float): Requests per second to the private API.
+            cdn_rate (float): Requests per second to the media CDN.
+        """
+        self.buckets = {
+            "api": TokenBucket(api_rate),
+            "cdn": TokenBucket(cdn_rate),
+        }
+
+    def __getitem__(self, name: str) -> TokenBucket:
+        return self.buckets[name]
+
+
+def retry_after(response) -> float:
+    """Parse the `Retry-After` header of a response.
+
+    Returns:
+        float: Seconds to wait or None if the header is missing or invalid.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils
+
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def backoff(attempt: int, base=DEFAULT_BACKOFF_BASE, cap=DEFAULT_BACKOFF_CAP) -> float:
+    """Exponential backoff delay with full jitter.
+
+    Args:
+        attempt (int): Number of the failed attempt, starting at 0.
+        base (float): Delay of the first retry in seconds.
+        cap (float): Maximum delay in seconds.
+
+    Returns:
+        float: Seconds to sleep before the next attempt.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
@@ -0,0 +1,285 @@
+"""Find stories missing from the media directory in the saved API responses
+
+Every reel fetched from `reels_media` is saved in `json_backup`, either as
+`<date>/<datetime>_user_reel_<id>.json` or as a record of a `JsonArchive`
+segment, reels prefetched with the tray in the saved tray. The stories in
+them are mapped to their media paths again and compared with the media
+directory and the download index. Stories whose CDN URLs did not expire
+yet are downloaded again.
+"""
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from collections import deque
+from collections import namedtuple
+from concurrent.futures import wait
+from functools import partial
+
+from .archive import JsonArchive
+from .archive import RESPONSE_FILENAME
+from .constants import ARCHIVE_CODECS
+from .constants import ARCHIVE_INDEX_EXT
+from .constants import CONTENT_TYPE_REEL
+from .constants import CONTENT_TYPE_TRAY
+from .constants import RECONCILE_KEYS
+from .media import extract_media
+from .media import item_expiry
+from .media import Job
+from .media import media_key
+
+
+log = logging.getLogger(__name__)
+
+"""Date directories written by `dump_response`"""
+_DATE_DIRECTORY = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+"""Saved reels of one day: a date directory if `codec` is None, else the
+segment of `date` in the archive at `path`"""
+Unit = namedtuple("Unit", ["date", "path", "codec"])
+
+"""Media files of one unit, see `scan_unit`"""
+UnitResult = namedtuple("UnitResult", ["date", "stats", "present", "live", "expired"])
+
+
+def backup_units(json_backup: str) -> list:
+    """List the date directories and archive segments of `json_backup`.
+
+    Segments of a codec that is not available are skipped with a warning.
+
+    Returns:
+        [Unit]: Units of work, oldest first.
+    """
+    try:
+        names = os.listdir(json_backup)
+    except FileNotFoundError:
+        return []
+    units = [
+        Unit(a, os.path.join(json_backup, a), None)
+        for a in names
+        if _DATE_DIRECTORY.match(a) and os.path.isdir(os.path.join(json_backup, a))
+    ]
+    for codec, ext in ARCHIVE_CODECS.items():
+        suffix = ext + ARCHIVE_INDEX_EXT
+        dates = [a[: -len(suffix)] for a in names if a.endswith(suffix)]
+        if not dates:
+            continue
+        try:
+            JsonArchive(json_backup, codec)
+        except ImportError as e:
+            log.warning("Skipping %s segments in %s: %s", codec, json_backup, e)
+            continue
+        units += [Unit(a, json_backup, codec) for a in dates]
+    return sorted(units, key=lambda a: (a.date, a.codec or ""))
+
+
+_REEL = CONTENT_TYPE_REEL.format("")
+_TRAY = CONTENT_TYPE_TRAY.format("")
+
+
+def _saved(unit: Unit):
+    """Yield content type and data of every saved reel and tray of a unit."""
+    if unit.codec is not None:
+        archive = JsonArchive(unit.path, unit.codec)
+        for record in archive.records(unit.date, prefix=(_REEL, _TRAY)):
+            yield record["type"], record["data"]
+        return
+
+    for filename in sorted(os.listdir(unit.path)):
+        match = RESPONSE_FILENAME.match(filename)
+        if match is None or not match.group(2).startswith((_REEL, _TRAY)):
+            continue
+        path = os.path.join(unit.path, filename)
+        try:
+            with open(path) as f:
+                yield match.group(2), json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Skipping unreadable response %s: %s", path, e)
+
+
+def _reels(unit: Unit):
+    """Yield every saved reel of a unit, one at a time.
+
+    Reels prefetched with the tray are not requested again, so with
+    `--stream-json` their stories are only saved in the tray.
+    """
+    for content_type, data in _saved(unit):
+        if content_type.startswith(_REEL):
+            yield data
+        else:
+            yield from (a for a in data.get("tray") or [] if a.get("items"))
+
+
+def scan_unit(
+    unit: Unit, planner, rendition: str, max_height: int, now: float
+) -> UnitResult:
+    """Map the stories saved in a unit to their media files.
+
+    Runs in a worker process. Every file is looked up on disk, only the
+    files that are missing are returned in full.
+
+    Args:
+        unit (Unit): Saved reels of one day.
+        planner (PathPlanner): Media paths of the account.
+        rendition (str): Rendition policy, see `extract_media`.
+        max_height (int): Height limit of renditions, see `pick`.
+        now (float): Unix time the CDN URLs are checked against.
+
+    Returns:
+        UnitResult: Counts of `reels` and `invalid` stories, index keys of
+            the files on disk, `Job`s of missing files of live stories and
+            index keys of missing files of expired stories.
+    """
+    stats = Counter()
+    seen = set()
+    present, live, expired = [], [], []
+    for reel in _reels(unit):
+        stats["reels"] += 1
+        user = reel.get("user") or {}
+        for item in reel.get("items") or []:
+            try:
+                filepath = planner.path(user, item)
+                media = extract_media(item, rendition, max_height)
+                expiring_at = item_expiry(item)
+            except (KeyError, IndexError, TypeError, ValueError):
+                stats["invalid"] += 1
+                continue
+            for a in media:
+                key = media_key(item["id"], a.suffix, a.ext)
+                if key in seen:
+                    continue
+                seen.add(key)
+                path = filepath + a.suffix + a.ext
+                if os.path.exists(path):
+                    present.append(key)
+                elif expiring_at > now:
+                    live.append(
+                        Job(
+                            item["id"],
+                            key,
+                            a.url,
+                            path,
+                            expiring_at,
+                            a.width,
+                            a.height,
+                        )
+                    )
+                else:
+                    expired.append(key)
+    return UnitResult(unit.date, stats, present, live, expired)
+
+
+def scan_backup(units: list, planner, rendition: str, max_height: int, processes: int):
+    """Scan units in a pool of processes, see `scan_unit`.
+
+    At most two units per process are in flight, so memory stays bounded
+    by the size of a few days of saved reels however long the backup is.
+
+    Yields:
+        UnitResult: Result of every unit, in the order of `units`.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    scan = partial(
+        scan_unit,
+        planner=planner,
+        rendition=rendition,
+        max_height=max_height,
+        now=time.time(),
+    )
+    units = iter(units)
+    pending = deque()
+    # Spawned like `Verifier`, the parent may be running download threads
+    with ProcessPoolExecutor(
+        max_workers=max(1, processes), mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        for unit in units:
+            pending.append(executor.submit(scan, unit))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _on_disk(entry: dict) -> bool:
+    return entry is not None and os.path.exists(entry["path"])
+
+
+def reconcile_account(instagram, processes: int, dry_run: bool = False) -> Counter:
+    """Download the live stories of an account missing from disk and index.
+
+    Files are compared with the media directory in the worker processes and
+    with the download index in bulk, one lookup per unit. The index is
+    shared by all accounts, a missing file it holds is skipped if the path
+    it was downloaded to still exists. Otherwise the row is stale, it is
+    dropped and the file counts as missing. A story appears
+    in the saved reels of at most two consecutive days, duplicates are only
+    tracked across the current and the previous day. Returns once the
+    queued downloads finished.
+
+    Args:
+        instagram (Instagram): Session of the account, its planner, rendition
+            policy, index and download pool are used.
+        processes (int): Number of processes reading the backup.
+        dry_run (bool): Only print the missing live files.
+
+    Returns:
+        Counter: Number of `reels` and media `files` found, files `present`
+            on disk, `indexed` at another path, indexed but `stale`,
+            `expired` or `missing` and live, and the files `requeued` for
+            download.
+    """
+    stats = Counter(dict.fromkeys(RECONCILE_KEYS, 0))
+    units = backup_units(instagram.json_backup)
+    date, current, previous = None, set(), set()
+    futures = []
+    for result in scan_backup(
+        units,
+        instagram.planner,
+        instagram.rendition,
+        instagram.max_height,
+        processes,
+    ):
+        if result.date != date:
+            date, current, previous = result.date, set(), current
+        stats.update(result.stats)
+
+        def new(key):
+            if key in current or key in previous:
+                return False
+            current.add(key)
+            return True
+
+        present = [a for a in result.present if new(a)]
+        live = [a for a in result.live if new(a.key)]
+        expired = [a for a in result.expired if new(a)]
+        stats["files"] += len(present) + len(live) + len(expired)
+        indexed = instagram.index.known([a.key for a in live] + expired)
+        stale = {a for a in indexed if not _on_disk(instagram.index.get(a))}
+        indexed -= stale
+        stats["stale"] += len(stale)
+        if not dry_run:
+            for key in stale:
+                instagram.index.remove(key)
+        live = [a for a in live if a.key not in indexed]
+        stats["present"] += len(present)
+        stats["indexed"] += len(indexed)
+        stats["expired"] += len(expired) - len(indexed.intersection(expired))
+        stats["missing"] += len(live)
+
+        if dry_run:
+            for job in live:
+                print(job.path)
+            continue
+        jobs = [
+            a
+            for a in live
+            if time.time() < a.expiring_at and instagram.index.claim(a.key)
+        ]
+        futures += instagram.download_jobs(jobs)
+        stats["requeued"] += len(jobs)
+    wait(futures)
+    return stats
@@ -0,0 +1,40 @@
+"""Selection of the media rendition to download"""
+from .constants import RENDITION_BEST
+from .constants import RENDITION_SMALLEST
+from .constants import RENDITION_THUMBNAIL
+
+
+def _pixels(candidate: dict) -> int:
+    return (candidate.get("width") or 0) * (candidate.get("height") or 0)
+
+
+def _rank(candidate: dict) -> tuple:
+    return (
+        _pixels(candidate),
+        candidate.get("bandwidth") or 0,
+        candidate.get("type") or 0,
+    )
+
+
+def pick(candidates: list, policy: str = RENDITION_BEST, max_height: int = None):
+    """Pick a candidate by its `width`, `height`, `bandwidth` and `type`.
+
+    Args:
+        candidates ([dict]): `video_versions` or `image_versions2` candidates.
+        policy (str): `best` picks the highest resolution, `smallest` and
+            `thumbnail` the lowest.
+        max_height (int): Ignore candidates taller than this, unless none is
+            small enough.
+
+    Returns:
+        dict: Chosen candidate or None if there are no candidates.
+    """
+    candidates = [a for a in candidates or [] if a.get("url")]
+    if not candidates:
+        return None
+    if max_height:
+        fitting = [a for a in candidates if (a.get("height") or 0) <= max_height]
+        candidates = fitting or [min(candidates, key=_pixels)]
+    if policy in (RENDITION_SMALLEST, RENDITION_THUMBNAIL):
+        return min(candidates, key=_rank)
+    return max(candidates, key=_rank)
@@ -0,0 +1,124 @@
+"""Include and exclude lists deciding whose stories are downloaded"""
+import logging
+import os
+import re
+import threading
+
+from .constants import INFO_USER_LIST
+
+
+log = logging.getLogger(__name__)
+
+"""User ID at the start of a line, the rest of the line is ignored"""
+_USER_ID = re.compile(rb"^\d+", re.MULTILINE)
+
+
+class UserList:
+    """User IDs read from a file, read again when the file changes.
+
+    A missing or unreadable file is an empty list.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.mtime = None
+        self.ids = frozenset()
+        self.lock = threading.Lock()
+
+    def get(self) -> frozenset:
+        """Current user IDs, reloaded if the modification time changed."""
+        if not self.path:
+            return self.ids
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self.lock:
+            if mtime != self.mtime:
+                self.ids = self._load() if mtime is not None else frozenset()
+                self.mtime = mtime
+            return self.ids
+
+    def _load(self) -> frozenset:
+        try:
+            with open(self.path, "rb") as f:
+                ids = frozenset(a.decode() for a in _USER_ID.findall(f.read()))
+        except OSError as e:
+            log.warning("Unable to read %s: %s", self.path, e)
+            return frozenset()
+        log.info(INFO_USER_LIST, len(ids), self.path)
+        return ids
+
+
+class Rules:
+    """Compiled include and exclude sets of one account."""
+
+    __slots__ = ("include", "excludes")
+
+    def __init__(self, include: frozenset, excludes: tuple):
+        self.include = include
+        self.excludes = excludes
+
+    def allows(self, user_id: str) -> bool:
+        """Whether stories of `user_id` are downloaded."""
+        if self.include and user_id not in self.include:
+            return False
+        return not any(user_id in a for a in self.excludes)
+
+    def select(self, tray_index: dict) -> tuple:
+        """Split the users of a tray in one pass.
+
+        Args:
+            tray_index (dict): Tray entries by user ID, see
+                `Instagram.tray_index`.
+
+        Returns:
+            tuple: Selected user IDs in tray order and `username (user_id)`
+                of every ignored user.
+        """
+        selected = []
+        ignored = []
+        for user_id, entry in tray_index.items():
+            if self.allows(user_id):
+                selected.append(user_id)
+            else:
+                ignored.append("{} ({})".format(entry["user"]["username"], user_id))
+        return selected, ignored
+
+
+class Selection:
+    """Include and exclude lists shared by all accounts.
+
+    Every user with a reel is downloaded unless the include list is not
+    empty and lacks the user, or an exclude list has the user. Accounts may
+    set their own `include` list of user IDs in `config.json`, which
+    replaces the shared one, and an `exclude` list added to the shared one.
+    """
+
+    def __init__(self, include: str = None, exclude: str = None):
+        """Initialize the selection.
+
+        Args:
+            include (str): File listing one user ID per line.
+            exclude (str): File listing one user ID per line.
+        """
+        self.include = UserList(include)
+        self.exclude = UserList(exclude)
+        self.accounts = {}
+
+    def _account(self, config: dict) -> tuple:
+        key = config.get("id")
+        if key not in self.accounts:
+            include = config.get("include")
+            self.accounts[key] = (
+                frozenset(map(str, include)) if include is not None else None,
+                frozenset(map(str, config.get("exclude") or [])),
+            )
+        return self.accounts[key]
+
+    def rules(self, config: dict) -> Rules:
+        """Rules of an account with the current content of the lists."""
+        include, exclude = self._account(config)
+        if include is None:
+            include = self.include.get()
+        return Rules(include, (self.exclude.get(), exclude))
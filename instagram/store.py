@@ -0,0 +1,119 @@
+"""Content-addressed storage of media files"""
+import logging
+import os
+import shutil
+
+from .constants import FICLONE
+from .constants import STORE_LINK_HARDLINK
+from .constants import STORE_LINK_REFLINK
+from .paths import ensure_directory
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+log = logging.getLogger(__name__)
+
+
+class ContentStore:
+    """Store every media file once under its checksum.
+
+    Blobs live at `<root>/<ab>/<cd>/<checksum>`, the human-readable media
+    path is a hardlink or reflink to the blob. Media downloaded again, e.g. a
+    reshared story, only adds another link.
+    """
+
+    def __init__(self, root: str, link: str = STORE_LINK_HARDLINK):
+        """Initialize the store.
+
+        Args:
+            root (str): Directory holding the blobs. Hardlinks require it to
+                be on the same file system as the media directories.
+            link (str): `hardlink` or `reflink`, falls back to a copy if the
+                file system does not support it.
+        """
+        self.root = root
+        self.link = link
+        os.makedirs(root, exist_ok=True)
+
+    def blob_path(self, checksum: str) -> str:
+        """Path of the blob with `checksum`."""
+        return os.path.join(self.root, checksum[:2], checksum[2:4], checksum)
+
+    def _reflink(self, blob: str, dest: str):
+        if fcntl is None:
+            raise OSError("reflink is not supported on this platform")
+        with open(blob, "rb") as src, open(dest, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+    def _link(self, blob: str, dest: str):
+        try:
+            if self.link == STORE_LINK_REFLINK:
+                self._reflink(blob, dest)
+            else:
+                os.link(blob, dest)
+        except OSError as e:
+            log.debug("Cannot %s %s, copying: %s", self.link, dest, e)
+            shutil.copyfile(blob, dest)
+
+    def commit(self, part: str, dest: str, checksum: str) -> bool:
+        """Move a complete download into the store and link it to `dest`.
+
+        Args:
+            part (str): Path of the downloaded `.part` file.
+            dest (str): Human-readable media path.
+            checksum (str): Hex digest of `part`.
+
+        Returns:
+            bool: True if the blob was stored before, i.e. `part` was a
+                duplicate.
+        """
+        blob = self.blob_path(checksum)
+        duplicate = os.path.exists(blob)
+        if duplicate:
+            os.remove(part)
+        else:
+            ensure_directory(os.path.dirname(blob))
+            os.replace(part, blob)
+
+        tmp = part + ".link"
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        self._link(blob, tmp)
+        os.replace(tmp, dest)
+        return duplicate
+
+    def remove(self, checksum: str):
+        """Remove the blob with `checksum`, e.g. after it failed verification.
+
+        Hardlinks to the blob keep their data, a later download of the same
+        checksum is stored anew.
+        """
+        try:
+            os.remove(self.blob_path(checksum))
+        except FileNotFoundError:
+            pass
+
+    def usage(self) -> dict:
+        """Space the blobs take up and the space their hardlinks save.
+
+        A blob linked to a single media path saves nothing, every further
+        hardlink saves the size of the blob. Reflinks and copies cannot be
+        told apart from independent files and are not counted.
+
+        Returns:
+            dict: Number of `blobs`, their `size` and the bytes `saved`.
+        """
+        blobs = size = saved = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except OSError:
+                    continue
+                blobs += 1
+                size += stat.st_size
+                saved += max(0, stat.st_nlink - 2) * stat.st_size
+        return {"blobs": blobs, "size": size, "saved": saved}
@@ -0,0 +1,183 @@
+"""Incremental parsing of large API responses into compact records"""
+import json
+import os
+import re
+
+from .paths import open_file
+
+
+_STRUCTURE = re.compile(rb'["{}\[\]]')
+_STRING = re.compile(rb'["\\]')
+_QUOTE, _BACKSLASH = ord('"'), ord("\\")
+_OPEN = (ord("{"), ord("["))
+
+
+class JsonStream:
+    """Split a streamed JSON object into the raw bytes of one container.
+
+    `feed` returns the elements of the array, or the members of the object,
+    stored under `key` in the top-level object as soon as they are complete.
+    Only the element being parsed is buffered, never the whole document.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.buf = bytearray()
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.string_start = None
+        self.last_string = None
+        self.active = False
+        self.element_start = None
+        self.member = None
+
+    def feed(self, chunk: bytes) -> list:
+        """Parse the next chunk of the document.
+
+        Returns:
+            list: Tuples of member key (None for array elements) and the raw
+                JSON bytes of every element completed by this chunk.
+        """
+        buf = self.buf
+        buf += chunk
+        found = []
+        while True:
+            if self.in_string:
+                match = _STRING.search(buf, self.pos)
+                if match is None:
+                    self.pos = len(buf)
+                    break
+                i = match.start()
+                if buf[i] == _BACKSLASH:
+                    if i + 1 >= len(buf):
+                        self.pos = i
+                        break
+                    self.pos = i + 2
+                    continue
+                self.in_string = False
+                self.pos = i + 1
+                if self.string_start is not None:
+                    self.last_string = json.loads(bytes(buf[self.string_start : i + 1]))
+                    self.string_start = None
+                continue
+
+            match = _STRUCTURE.search(buf, self.pos)
+            if match is None:
+                self.pos = len(buf)
+                break
+            i = match.start()
+            char = buf[i]
+            self.pos = i + 1
+            if char == _QUOTE:
+                self.in_string = True
+                if self.element_start is None and self.depth in (1, 2):
+                    self.string_start = i
+            elif char in _OPEN:
+                if self.depth == 1 and self.last_string == self.key:
+                    self.active = True
+                    self.last_string = None
+                elif self.active and self.depth == 2 and self.element_start is None:
+                    self.element_start = i
+                    self.member = self.last_string if char == _OPEN[0] else None
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.active and self.depth == 2 and self.element_start is not None:
+                    found.append((self.member, bytes(buf[self.element_start : i + 1])))
+                    self.element_start = None
+                elif self.active and self.depth == 1:
+                    self.active = False
+
+        keep = min(
+            a
+            for a in (self.pos, self.element_start, self.string_start)
+            if a is not None
+        )
+        if keep:
+            del buf[:keep]
+            self.pos -= keep
+            if self.element_start is not None:
+                self.element_start -= keep
+            if self.string_start is not None:
+                self.string_start -= keep
+        return found
+
+
+"""Value of a field missing from a `TrayEntry`, a null field is None"""
+_MISSING = object()
+
+
+class TrayEntry:
+    """Compact reel tray entry with the fields the downloader needs.
+
+    Supports the `dict` accessors used on tray entries (`get`, `[]` and
+    `in`) with the same results, null fields are None and missing fields
+    raise KeyError. Prefetched items are only kept if they make up the
+    whole reel.
+    """
+
+    __slots__ = (
+        "user",
+        "latest_reel_media",
+        "expiring_at",
+        "media_count",
+        "prefetch_count",
+        "items",
+    )
+
+    def __init__(self, entry: dict):
+        if "user" in entry:
+            user = entry["user"] or {}
+            self.user = {a: user[a] for a in ("pk", "username") if a in user}
+        else:
+            self.user = _MISSING
+        self.latest_reel_media = entry.get("latest_reel_media", _MISSING)
+        self.expiring_at = entry.get("expiring_at", _MISSING)
+        self.media_count = entry.get("media_count", _MISSING)
+        self.prefetch_count = entry.get("prefetch_count", _MISSING)
+        items = entry.get("items")
+        complete = items and len(items) >= (entry.get("media_count") or 0)
+        self.items = items if entry.get("prefetch_count") and complete else _MISSING
+
+    def _value(self, name: str):
+        return getattr(self, name) if name in self.__slots__ else _MISSING
+
+    def get(self, name: str, default=None):
+        value = self._value(name)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, name: str):
+        value = self._value(name)
+        if value is _MISSING:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name: str) -> bool:
+        return self._value(name) is not _MISSING
+
+
+class ResponseFile:
+    """Write a streamed response to `path` unless it exists already."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.handle = None
+        if not os.path.isfile(path):
+            self.handle = open_file(path + ".part", "wb")
+
+    def write(self, data: bytes):
+        if self.handle is not None:
+            self.handle.write(data)
+
+    def abort(self):
+        """Remove the incomplete file."""
+        if self.handle is not None:
+            self.handle.close()
+            os.remove(self.path + ".part")
+            self.handle = None
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            os.replace(self.path + ".part", self.path)
@@ -0,0 +1,115 @@
+"""Connection pooling and transport settings for requests sessions"""
+import threading
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.connectionpool import HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from .constants import DEFAULT_CONNECT_RETRIES
+from .constants import DEFAULT_CONNECT_TIMEOUT
+from .constants import DEFAULT_POOL_SIZE
+from .constants import DEFAULT_READ_TIMEOUT
+from .constants import POOL_HOSTS
+
+
+class TransportStats:
+    """Thread-safe counters of requests and newly opened connections."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def add(self, requests: int = 0, connections: int = 0):
+        with self.lock:
+            self.requests += requests
+            self.connections += connections
+
+    def summary(self) -> dict:
+        """Requests, new connections (TCP/TLS handshakes) and reused sockets."""
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "connections": self.connections,
+                "reused": max(0, self.requests - self.connections),
+            }
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter counting requests and new connections in `stats`."""
+
+    def __init__(self, stats: TransportStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.stats
+
+        def counting(pool_class):
+            class CountingConnection(pool_class.ConnectionCls):
+                def connect(self):
+                    stats.add(connections=1)
+                    return super().connect()
+
+            class CountingPool(pool_class):
+                ConnectionCls = CountingConnection
+
+            return CountingPool
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": counting(HTTPConnectionPool),
+            "https": counting(HTTPSConnectionPool),
+        }
+
+    def send(self, request, **kwargs):
+        self.stats.add(requests=1)
+        return super().send(request, **kwargs)
+
+
+def configure_session(session, options) -> TransportStats:
+    """Mount pooled, retry-aware adapters on a requests session.
+
+    Connection failures are retried by the adapter before a request is sent,
+    HTTP errors are left to the rate limiting layer.
+
+    Args:
+        session (requests.Session): Session to configure.
+        options: Parsed command line options.
+
+    Returns:
+        TransportStats: Connection statistics of the session.
+    """
+    stats = TransportStats()
+    pool_size = getattr(options, "pool_size", DEFAULT_POOL_SIZE)
+    retries = Retry(
+        total=None,
+        connect=getattr(options, "connect_retries", DEFAULT_CONNECT_RETRIES),
+        read=0,
+        status=0,
+        redirect=10,
+        backoff_factor=0.5,
+        raise_on_status=False,
+    )
+    for prefix in ("http://", "https://"):
+        session.mount(
+            prefix,
+            PooledAdapter(
+                stats,
+                pool_connections=POOL_HOSTS,
+                pool_maxsize=pool_size,
+                max_retries=retries,
+            ),
+        )
+    if getattr(options, "no_keep_alive", False):
+        session.headers["connection"] = "close"
+    return stats
+
+
+def timeouts(options) -> tuple:
+    """Connect and read timeout in seconds for requests."""
+    return (
+        getattr(options, "connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+        getattr(options, "read_timeout", DEFAULT_READ_TIMEOUT),
+    )
@@ -1,17 +1,19 @@
+import hashlib
 import json
 import logging
 import os
 import time
 from datetime import datetime
 
-from jsonschema import validate
-
+from .constants import BACKENDS
 from .constants import FMT_DATE
 from .constants import FMT_DATETIME
 from .constants import USER_ASK_COOKIE
 from .constants import USER_ASK_DIRECTORY
 from .constants import USER_ASK_USER_ID
 from .constants import USER_ASK_USERNAME
+from .metrics import REGISTRY
+from .paths import open_file
 
 
 log = logging.getLogger(__name__)
@@ -67,13 +69,9 @@ def dump_text_file(content: str, filepath: str):
 
     This will overwrite the file.
     """
-    dirpath = os.path.dirname(filepath)
-
-    os.makedirs(dirpath, exist_ok=True)
-
     if not os.path.isfile(filepath):
         log.debug("File written: %s", filepath)
-        with open(filepath, "w+") as f:
+        with REGISTRY.disk_timer("json"), open_file(filepath, "w+") as f:
             f.write(content)
 
 
@@ -92,38 +90,67 @@ def ask_user_for_input():
     }
 
 
+"""JSON schema of `config.json`"""
+CONFIG_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "headers": {
+                "type": "object",
+                "properties": {
+                    "cookie": {"type": "string"},
+                },
+            },
+            "username": {"type": "string"},
+            "media_directory": {"type": "string"},
+            "json_backup": {"type": "string"},
+            "download": {"type": "boolean"},
+            "backend": {"enum": BACKENDS},
+            "api_url": {"type": "string"},
+            "path_template": {"type": "string"},
+            "include": {"type": "array", "items": {"type": "string"}},
+            "exclude": {"type": "array", "items": {"type": "string"}},
+        },
+    },
+}
+
+_config_schema = None
+
+
 def config_validator(data: dict):
     """Validate config json data.
 
+    `jsonschema` is imported and the schema compiled on first use.
+
     Args:
         data (dict): Config json data
 
     Returns:
         bool: True if data validated successfully else false.
+
+    Raises:
+        jsonschema.ValidationError: `data` does not match `CONFIG_SCHEMA`.
     """
-    SCHEMA = {
-        "type": "array",
-        "items": {
-            "type": "object",
-            "properties": {
-                "headers": {
-                    "type": "object",
-                    "properties": {
-                        "cookie": {"type": "string"},
-                    },
-                },
-                "username": {"type": "string"},
-                "media_directory": {"type": "string"},
-                "json_backup": {"type": "string"},
-                "download": {"type": "boolean"},
-            },
-        },
-    }
-    validate(instance=data, schema=SCHEMA)
+    global _config_schema
+    if _config_schema is None:
+        from jsonschema.validators import validator_for
+
+        cls = validator_for(CONFIG_SCHEMA)
+        cls.check_schema(CONFIG_SCHEMA)
+        _config_schema = cls(CONFIG_SCHEMA)
+    _config_schema.validate(data)
 
     return True
 
 
+def config_digest(content: bytes) -> str:
+    """Checksum of a config file and the schema it is validated against."""
+    digest = hashlib.sha256(json.dumps(CONFIG_SCHEMA, sort_keys=True).encode())
+    digest.update(content)
+    return digest.hexdigest()
+
+
 def dump_response(timestamp: int, content_type: str, content: dict, prefix: str):
     """Save JSON file
 
@@ -136,9 +163,15 @@ def dump_response(timestamp: int, content_type: str, content: dict, prefix: str)
     Returns:
         None
     """
+    with REGISTRY.timer("dump_response_seconds"):
+        path = response_path(timestamp, content_type, prefix)
+        dump_text_file(json.dumps(content), path)
+
+
+def response_path(timestamp: int, content_type: str, prefix: str) -> str:
+    """Path of the JSON file `dump_response` saves a response to."""
     utcdatetime = format_time(timestamp, time_fmt=FMT_DATETIME)
     folder = format_time(timestamp, time_fmt=FMT_DATE)
 
     filename = "{}_{}.json".format(utcdatetime, content_type)
-    path = os.path.join(prefix, folder, filename)
-    dump_text_file(json.dumps(content), path)
+    return os.path.join(prefix, folder, filename)
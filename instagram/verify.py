@@ -0,0 +1,281 @@
+"""Integrity checks of downloaded media files
+
+Checks only look at the container: the magic bytes, the JPEG end of image
+marker, the box structure and `moov` atom of MP4 files and the dimensions
+stored in them. They run in a pool of processes, away from the download
+threads.
+"""
+import itertools
+import json
+import os
+import struct
+from collections import deque
+
+from .constants import AUDIO_EXT
+from .constants import DEFAULT_VERIFY_WORKERS
+from .constants import MEDIA_TYPE_EXT
+from .constants import VERIFY_TOLERANCE
+
+_JPEG_SOI = b"\xff\xd8\xff"
+_JPEG_EOI = b"\xff\xd9"
+"""Start of frame markers, they hold the dimensions of the image"""
+_JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+"""Markers without a length field"""
+_JPEG_STANDALONE = set(range(0xD0, 0xD9)) | {0x01}
+"""End of image and start of scan, no frame header follows"""
+_JPEG_END = {0xD9, 0xDA}
+
+
+def _jpeg_size(f) -> tuple:
+    """Width and height from the start of frame segment of a JPEG."""
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in _JPEG_STANDALONE:
+            continue
+        if marker in _JPEG_END:
+            return None
+        header = f.read(2)
+        if len(header) < 2:
+            return None
+        (length,) = struct.unpack(">H", header)
+        if marker in _JPEG_SOF:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">xHH", data)
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+        # A marker must follow every segment
+        if f.read(1) != b"\xff":
+            return None
+        f.seek(-1, os.SEEK_CUR)
+
+
+def check_jpeg(path: str) -> tuple:
+    """Check the markers of a JPEG file.
+
+    Returns:
+        tuple: Problem or None, and width and height if found.
+    """
+    with open(path, "rb") as f:
+        head = f.read(len(_JPEG_SOI))
+        if head != _JPEG_SOI:
+            return "not a JPEG, starts with {!r}".format(head + f.read(8)), None
+        f.seek(max(0, os.fstat(f.fileno()).st_size - 64))
+        if not f.read().rstrip(b"\x00").endswith(_JPEG_EOI):
+            return "JPEG end of image marker missing", None
+        return None, _jpeg_size(f)
+
+
+def _boxes(data: bytes, offset: int = 0, end: int = None):
+    """Yield `(type, payload start, box end)` of the MP4 boxes in `data`."""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[offset : offset + 8])
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", data[offset + 8 : offset + 16])
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            return
+        yield kind, offset + header, offset + size
+        offset += size
+
+
+def _mp4_size(moov: bytes) -> tuple:
+    """Largest width and height of the tracks in a `moov` payload."""
+    best = None
+    for kind, start, end in _boxes(moov):
+        if kind != b"trak":
+            continue
+        for inner, payload, stop in _boxes(moov, start, end):
+            if inner != b"tkhd" or payload >= stop:
+                continue
+            # Version, flags, times, track ID and duration, then layer,
+            # volume and matrix precede the 16.16 fixed point dimensions
+            skip = 32 if moov[payload] == 1 else 20
+            position = payload + 4 + skip + 52
+            if position + 8 > stop:
+                continue
+            width, height = struct.unpack(">II", moov[position : position + 8])
+            size = (width >> 16, height >> 16)
+            if size[0] and (best is None or size[0] * size[1] > best[0] * best[1]):
+                best = size
+    return best
+
+
+def check_mp4(path: str) -> tuple:
+    """Check the top-level boxes of an MP4 file.
+
+    Every box has to fit in the file, which catches truncated downloads,
+    and the file needs `ftyp`, `moov` and `mdat` boxes.
+
+    Returns:
+        tuple: Problem or None, and width and height of the video if found.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        kinds = []
+        moov = None
+        offset = 0
+        while offset < size:
+            f.seek(offset)
+            header = f.read(16)
+            if len(header) < 8:
+                return "truncated MP4 box header at {}".format(offset), None
+            length, kind = struct.unpack(">I4s", header[:8])
+            if length == 1:
+                if len(header) < 16:
+                    return "truncated MP4 box header at {}".format(offset), None
+                (length,) = struct.unpack(">Q", header[8:16])
+            elif length == 0:
+                length = size - offset
+            if length < 8 or offset + length > size:
+                return "truncated MP4 {} box".format(kind.decode("latin-1")), None
+            if not kinds and kind != b"ftyp":
+                return "not an MP4, starts with {!r}".format(header[:12]), None
+            if kind == b"moov":
+                f.seek(offset + 8)
+                moov = f.read(length - 8)
+            kinds.append(kind)
+            offset += length
+    if moov is None:
+        return "MP4 moov atom missing", None
+    if b"mdat" not in kinds:
+        return "MP4 mdat atom missing", None
+    return None, _mp4_size(moov)
+
+
+def _fits(actual: tuple, width: int, height: int) -> bool:
+    return any(
+        abs(a - width) <= VERIFY_TOLERANCE and abs(b - height) <= VERIFY_TOLERANCE
+        for a, b in (actual, actual[::-1])
+    )
+
+
+def check_media(path: str, width: int = None, height: int = None) -> str:
+    """Check a downloaded media file.
+
+    Args:
+        path (str): `.jpg`, `.mp4` or `.m4a` file.
+        width (int): Expected width in pixels, from the item JSON.
+        height (int): Expected height in pixels, from the item JSON.
+
+    Returns:
+        str: Description of the problem, None if the file looks complete.
+    """
+    ext = os.path.splitext(path)[1]
+    try:
+        if os.path.getsize(path) == 0:
+            return "empty file"
+        if ext == MEDIA_TYPE_EXT[1]:
+            problem, actual = check_jpeg(path)
+        elif ext in (MEDIA_TYPE_EXT[2], AUDIO_EXT):
+            problem, actual = check_mp4(path)
+        else:
+            return None
+    except OSError as e:
+        return str(e)
+    if problem is None and width and height and actual is not None:
+        if not _fits(actual, width, height):
+            return "{}x{} instead of {}x{}".format(actual[0], actual[1], width, height)
+    return problem
+
+
+def expected_size(path: str) -> tuple:
+    """Width and height of a media file recorded in its `.json` sidecar.
+
+    Media files are named `<name>[_<n>].<ext>` next to `<name>.json`, see
+    `PathPlanner` and `extract_media`.
+
+    Returns:
+        tuple: Width and height, None if unknown.
+    """
+    name, ext = os.path.splitext(path)
+    if ext not in MEDIA_TYPE_EXT[1:3]:
+        return None, None
+    node = None
+    sidecar = name + MEDIA_TYPE_EXT[3]
+    base, _, n = name.rpartition("_")
+    try:
+        if os.path.isfile(sidecar):
+            with open(sidecar) as f:
+                node = json.load(f)
+        elif n.isdigit() and os.path.isfile(base + MEDIA_TYPE_EXT[3]):
+            with open(base + MEDIA_TYPE_EXT[3]) as f:
+                node = json.load(f)["carousel_media"][int(n) - 1]
+    except (OSError, ValueError, KeyError, IndexError, TypeError):
+        return None, None
+    rendition = (node or {}).get("rendition") or {}
+    return rendition.get("width"), rendition.get("height")
+
+
+def _check_files(paths: list) -> list:
+    return [(a, check_media(a, *expected_size(a))) for a in paths]
+
+
+class Verifier:
+    """Check media files in a pool of processes, see `check_media`."""
+
+    def __init__(self, workers: int = DEFAULT_VERIFY_WORKERS):
+        # multiprocessing takes long to import, only load it when used
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Workers are spawned, forking a process running download threads
+        # is not safe
+        self.workers = max(1, workers)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def submit(self, path: str, width: int = None, height: int = None):
+        """Check a file in the background.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the result of `check_media`.
+        """
+        return self.executor.submit(check_media, path, width, height)
+
+    def check_tree(self, directory: str, chunksize: int = 16):
+        """Check every media file below `directory`.
+
+        Expected dimensions are read from the `.json` sidecars. Files are
+        checked `chunksize` at a time and at most two chunks per worker are
+        in flight, so memory does not grow with the size of the tree.
+
+        Yields:
+            tuple: Path and problem of every media file, None if it is fine.
+        """
+
+        def scan():
+            for dirpath, _, filenames in os.walk(directory):
+                for filename in sorted(filenames):
+                    if os.path.splitext(filename)[1] in MEDIA_TYPE_EXT[1:3] + [
+                        AUDIO_EXT
+                    ]:
+                        yield os.path.join(dirpath, filename)
+
+        paths = scan()
+        pending = deque()
+        while True:
+            chunk = list(itertools.islice(paths, chunksize))
+            if chunk:
+                pending.append(self.executor.submit(_check_files, chunk))
+            if pending and (not chunk or len(pending) >= 2 * self.workers):
+                yield from pending.popleft().result()
+            elif not chunk:
+                return
+
+    def close(self):
+        """Wait for pending checks and stop the workers."""
+        self.executor.shutdown()
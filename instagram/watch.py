@@ -0,0 +1,68 @@
+"""Scheduling for the long-running watch mode"""
+import logging
+import signal
+import time
+
+from .constants import DEFAULT_WATCH_MAX
+from .constants import DEFAULT_WATCH_MIN
+from .constants import INFO_WATCH_STOP
+
+
+log = logging.getLogger(__name__)
+
+
+class PollSchedule:
+    """Adaptive delay between two polls of an account's reel tray.
+
+    The interval halves after a poll that found changed reels and doubles
+    after a quiet one, within `min_interval` and `max_interval`. Reels with
+    stories that are still pending, e.g. after failed downloads, are polled
+    again well before they expire.
+    """
+
+    def __init__(self, min_interval=DEFAULT_WATCH_MIN, max_interval=DEFAULT_WATCH_MAX):
+        """Initialize the schedule.
+
+        Args:
+            min_interval (float): Shortest delay between polls in seconds.
+            max_interval (float): Longest delay between polls in seconds.
+        """
+        self.min_interval = max(1.0, min_interval)
+        self.max_interval = max(self.min_interval, max_interval)
+        self.interval = self.min_interval
+
+    def next_delay(self, changed: int, pending: list, now: float = None) -> float:
+        """Compute the delay to the next poll.
+
+        Args:
+            changed (int): Number of reels that changed in the last poll.
+            pending ([int]): `expiring_at` of reels with pending stories.
+            now (float): Current Unix time, defaults to `time.time()`.
+
+        Returns:
+            float: Seconds to wait.
+        """
+        now = time.time() if now is None else now
+        if changed:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 2)
+
+        delay = self.interval
+        for expiring_at in pending:
+            delay = min(delay, max(self.min_interval, (expiring_at - now) / 2))
+        return delay
+
+
+def handle_stop_signals(stop):
+    """Set the `stop` event on SIGTERM and SIGINT.
+
+    Must be called from the main thread.
+    """
+
+    def handler(signum, _):
+        log.info(INFO_WATCH_STOP, signal.Signals(signum).name)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
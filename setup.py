@@ -26,7 +26,11 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     include_package_data=True,
     install_requires=requirements,
-    python_requires=">=3.6",
+    extras_require={
+        "async": ["httpx[http2]>=0.18.0"],
+        "zstd": ["zstandard"],
+    },
+    python_requires=">=3.7",
     entry_points={
         "console_scripts": ["instagram-story=instagram.main:main"],
     },
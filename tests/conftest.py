@@ -0,0 +1,47 @@
+import os
+import sys
+import types
+
+import pytest
+
+from instagram import instagram as module
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks")
+)
+
+from mock_server import MockInstagram  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def mock_server():
+    server = MockInstagram(users=2, items=2, image_size=20000, video_size=50000)
+    server.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def account(tmp_path, monkeypatch, mock_server):
+    """Config and options of an account of `mock_server` below `tmp_path`."""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    (tmp_path / ".instagram-story").mkdir()
+    monkeypatch.setattr(module.time, "sleep", lambda delay: None)
+    config = {
+        "username": "test",
+        "id": "1",
+        "media_directory": str(tmp_path / "media"),
+        "json_backup": str(tmp_path / "json"),
+        "headers": {"cookie": "sessionid=test"},
+        "api_url": mock_server.api_url,
+    }
+    options = types.SimpleNamespace(retries=2, api_rate=1000.0, cdn_rate=1000.0)
+    return config, options
+
+
+@pytest.fixture
+def instagram(account):
+    """Sync session of the `account`."""
+    session = module.Instagram(*account)
+    yield session
+    session.close()
@@ -0,0 +1,60 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from instagram.aio import AsyncInstagram
+
+pytest.importorskip("httpx")
+
+
+def run(account, stream_json: bool) -> tuple:
+    config, options = account
+    options.stream_json = stream_json
+
+    async def main():
+        instagram = AsyncInstagram(config, options)
+        try:
+            tray = await instagram.get_tray()
+            user_ids = [a["user"]["pk"] for a in tray["tray"]]
+            reels = await instagram.get_reel_chunk(user_ids)
+            tasks = []
+            for reel in reels.values():
+                tasks += await instagram.download_reel(reel)
+            return reels, await asyncio.gather(*tasks)
+        finally:
+            await instagram.close()
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("stream_json", [False, True])
+def test_download_reels(account, mock_server, stream_json):
+    reels, entries = run(account, stream_json)
+
+    assert len(reels) == 2
+    assert len(entries) == 4
+    for entry in entries:
+        body = mock_server.media[
+            "_l.mp4" if entry["path"].endswith(".mp4") else "_l.jpg"
+        ]
+        assert entry["checksum"] == hashlib.sha256(body).hexdigest()
+        assert os.path.getsize(entry["path"]) == len(body)
+
+
+def test_transport_stats(account, mock_server):
+    config, options = account
+    options.stream_json = False
+
+    async def main():
+        instagram = AsyncInstagram(config, options)
+        await instagram.get_tray()
+        await instagram.close()
+        return instagram
+
+    instagram = asyncio.run(main())
+
+    assert not hasattr(instagram, "session")
+    assert instagram.stats["requests"] == 1
+    assert instagram.stats["connections"] == 1
@@ -0,0 +1,89 @@
+import json
+import os
+
+from instagram.archive import JsonArchive
+from instagram.archive import migrate_json_backup
+
+DAY = 1700000000
+
+
+def test_write_and_find(tmp_path):
+    archive = JsonArchive(str(tmp_path))
+    archive.write("1", DAY, "item", {"id": "1", "n": 1})
+    archive.write("2", DAY, "item", b'{"id": "2"}')
+    archive.write("1", DAY + 86400, "item", {"id": "1", "n": 2})
+
+    assert archive.dates() == ["2023-11-14", "2023-11-15"]
+    assert archive.find("1")["data"] == {"id": "1", "n": 2}
+    assert archive.find("1", "2023-11-14")["data"] == {"id": "1", "n": 1}
+    assert archive.find("2") == {
+        "key": "2",
+        "type": "item",
+        "timestamp": DAY,
+        "data": {"id": "2"},
+    }
+    assert archive.find("3") is None
+
+
+def test_read_by_offset(tmp_path):
+    archive = JsonArchive(str(tmp_path))
+    archive.write("a", DAY, "item", {"a": 1})
+    segment, offset, length = archive.write("b", DAY, "item", {"b": 2})
+    assert os.path.getsize(segment) == offset + length
+    assert archive.read(segment, offset, length)["data"] == {"b": 2}
+
+
+def test_records(tmp_path):
+    archive = JsonArchive(str(tmp_path))
+    archive.write("tray_1", DAY, "tray_1", {"tray": []})
+    archive.write("9", DAY, "item", {"id": "9"})
+
+    date = archive.dates()[0]
+    assert [a["key"] for a in archive.records(date)] == ["tray_1", "9"]
+
+
+def test_migrate_json_backup(tmp_path):
+    backup = tmp_path / "json" / "2023-11-14"
+    media = tmp_path / "media" / "1" / "2023"
+    os.makedirs(str(backup))
+    os.makedirs(str(media))
+    (backup / "2023-11-14_22-13-20_tray_1.json").write_text('{"tray": []}')
+    item = {"id": "5_1", "taken_at": DAY}
+    (media / "2023-11-14_22-13-20 5_1.json").write_text(json.dumps(item))
+    archive = JsonArchive(str(tmp_path / "archive"))
+
+    migrated = migrate_json_backup(
+        archive, str(tmp_path / "json"), str(tmp_path / "media"), remove=True
+    )
+
+    assert migrated == 2
+    assert archive.find("tray_1")["data"] == {"tray": []}
+    assert archive.find("5_1")["data"] == item
+    assert not os.path.exists(str(backup))
+
+
+def test_streamed_record(tmp_path):
+    archive = JsonArchive(str(tmp_path))
+    writer = archive.writer("tray_1", DAY, "tray_1")
+    for chunk in (b'{"tray": [', b"1, 2", b"]}"):
+        writer.write(chunk)
+    writer.close()
+    aborted = archive.writer("tray_2", DAY, "tray_2")
+    aborted.write(b"{")
+    aborted.abort()
+
+    assert archive.find("tray_1")["data"] == {"tray": [1, 2]}
+    assert archive.find("tray_2") is None
+
+
+def test_records_by_prefix(tmp_path):
+    archive = JsonArchive(str(tmp_path))
+    archive.write("tray_1", DAY, "tray_1", {"tray": []})
+    archive.write("user_reel_5", DAY, "user_reel_5", {"id": 5})
+    archive.write("9", DAY, "item", {"id": "9"})
+
+    date = archive.dates()[0]
+    assert [a["key"] for a in archive.records(date, prefix="user_reel_")] == [
+        "user_reel_5"
+    ]
+    assert len(list(archive.records(date, prefix=("tray_", "user_reel_")))) == 2
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+
+from requests.cookies import RequestsCookieJar
+
+from instagram.cookies import CookieStore
+from instagram.cookies import merge_header
+
+HEADER = "sessionid=1; csrftoken=a"
+
+
+def jar(**cookies) -> RequestsCookieJar:
+    result = RequestsCookieJar()
+    for name, value in cookies.items():
+        result.set(name, value, domain=".instagram.com", path="/")
+    return result
+
+
+def test_only_changed_cookies_are_written(tmp_path):
+    path = str(tmp_path / "cookie-1.json")
+    store = CookieStore(path, HEADER)
+    assert store.load() == []
+
+    assert store.save(jar(csrftoken="b"))
+    os.utime(path, ns=(0, 0))
+    assert not store.save(jar(csrftoken="b"))
+    assert os.stat(path).st_mtime_ns == 0
+    assert store.save(jar(csrftoken="c"))
+
+    assert [a["value"] for a in CookieStore(path, HEADER).load()] == ["c"]
+
+
+def test_concurrent_sessions_keep_each_others_cookies(tmp_path):
+    path = str(tmp_path / "cookie-1.json")
+    first = CookieStore(path, HEADER)
+    second = CookieStore(path, HEADER)
+    first.load()
+    second.load()
+
+    first.save(jar(csrftoken="b"))
+    second.save(jar(rur="x"))
+
+    names = {a["name"] for a in CookieStore(path, HEADER).load()}
+    assert names == {"csrftoken", "rur"}
+
+
+def test_save_waits_for_the_lock(tmp_path):
+    path = str(tmp_path / "cookie-1.json")
+    store = CookieStore(path, HEADER)
+    other = CookieStore(path, HEADER)
+    thread = threading.Thread(target=store.save, args=(jar(csrftoken="b"),))
+
+    with other._locked():
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        assert not os.path.exists(path)
+    thread.join()
+
+    assert os.path.exists(path)
+
+
+def test_cookies_of_another_login_are_discarded(tmp_path):
+    path = str(tmp_path / "cookie-1.json")
+    CookieStore(path, HEADER).save(jar(csrftoken="b"))
+
+    assert CookieStore(path, "sessionid=2").load() == []
+
+
+def test_unreadable_and_expired_cookies_are_ignored(tmp_path):
+    path = tmp_path / "cookie-1.json"
+    path.write_text("{")
+    assert CookieStore(str(path), HEADER).load() == []
+
+    store = CookieStore(str(path), HEADER)
+    cookie = {"name": "a", "value": "1", "domain": "", "path": "/", "expires": 1}
+    path.write_text(json.dumps({"source": store.source, "cookies": [cookie]}))
+    assert store.load() == []
+
+
+def test_merge_header():
+    records = [
+        {"name": "csrftoken", "value": "b", "domain": ".instagram.com"},
+        {"name": "other", "value": "x", "domain": "example.com"},
+        {"name": "rur", "value": "y", "domain": "i.instagram.com"},
+    ]
+    merged = merge_header(HEADER, records, "i.instagram.com")
+    assert merged == "sessionid=1; csrftoken=b; rur=y"
@@ -0,0 +1,96 @@
+import hashlib
+import os
+
+from instagram.constants import PART_SUFFIX
+from instagram.instagram import IncompleteDownloadError
+
+
+def cdn(server, name: str) -> str:
+    return "http://127.0.0.1:{}/cdn/1000_1{}".format(server.server_address[1], name)
+
+
+def test_download(instagram, mock_server, tmp_path):
+    dest = str(tmp_path / "media" / "a" / "story.mp4")
+    body = mock_server.media["_l.mp4"]
+
+    entry = instagram.download_file(cdn(mock_server, "_l.mp4"), dest)
+
+    assert entry == {
+        "path": dest,
+        "size": len(body),
+        "checksum": hashlib.sha256(body).hexdigest(),
+    }
+    assert open(dest, "rb").read() == body
+    assert not os.path.exists(dest + PART_SUFFIX)
+    assert instagram.download_file(cdn(mock_server, "_l.mp4"), dest)["path"] == dest
+    assert instagram.stats["exists"] == 1
+
+
+def test_resume_part(instagram, mock_server, tmp_path):
+    dest = str(tmp_path / "media" / "story.jpg")
+    body = mock_server.media["_l.jpg"]
+    os.makedirs(os.path.dirname(dest))
+    with open(dest + PART_SUFFIX, "wb") as f:
+        f.write(body[:5000])
+
+    entry = instagram.download_file(cdn(mock_server, "_l.jpg"), dest)
+
+    assert open(dest, "rb").read() == body
+    assert entry["checksum"] == hashlib.sha256(body).hexdigest()
+    assert instagram.stats["downloaded"] == 1
+
+
+def test_restart_part_larger_than_file(instagram, mock_server, tmp_path):
+    dest = str(tmp_path / "media" / "story.jpg")
+    body = mock_server.media["_s.jpg"]
+    os.makedirs(os.path.dirname(dest))
+    with open(dest + PART_SUFFIX, "wb") as f:
+        f.write(b"x" * (len(body) + 10))
+
+    instagram.download_file(cdn(mock_server, "_s.jpg"), dest)
+
+    assert open(dest, "rb").read() == body
+
+
+def test_failed_download_leaves_no_file(instagram, mock_server, tmp_path):
+    dest = str(tmp_path / "media" / "missing.jpg")
+
+    assert instagram.download_file(cdn(mock_server, "_x.jpg"), dest) is None
+
+    assert instagram.stats["failed"] == 1
+    assert not os.path.exists(dest)
+
+
+def test_client_error_is_not_retried(instagram, mock_server, tmp_path):
+    dest = str(tmp_path / "media" / "missing.jpg")
+    before = mock_server.counters["requests"]
+
+    assert instagram.download_file(cdn(mock_server, "_x.jpg"), dest) is None
+
+    assert mock_server.counters["requests"] - before == 1
+
+
+def test_body_cut_short_is_resumed(instagram, mock_server, tmp_path, monkeypatch):
+    dest = str(tmp_path / "media" / "story.jpg")
+    fetch_part = instagram._fetch_part
+    failures = [IncompleteDownloadError("cut short")]
+
+    def flaky(url, part):
+        if failures:
+            raise failures.pop()
+        return fetch_part(url, part)
+
+    monkeypatch.setattr(instagram, "_fetch_part", flaky)
+
+    assert instagram.download_file(cdn(mock_server, "_l.jpg"), dest) is not None
+    assert instagram.stats["retries"] == 1
+
+
+def test_pruned_directory_is_created_again(instagram, mock_server, tmp_path):
+    directory = tmp_path / "media" / "pruned"
+    url = cdn(mock_server, "_s.jpg")
+    instagram.download_file(url, str(directory / "a.jpg"))
+    os.remove(str(directory / "a.jpg"))
+    os.rmdir(str(directory))
+
+    assert instagram.download_file(url, str(directory / "b.jpg")) is not None
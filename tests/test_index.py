@@ -0,0 +1,173 @@
+import os
+
+from instagram import index as module
+from instagram.constants import INDEX_REBUILD_WINDOW
+from instagram.index import DownloadIndex
+from instagram.index import media_post_id
+from instagram.index import MemoryIndex
+from instagram.index import rebuild_index
+from instagram.paths import PathPlanner
+
+
+def test_claim_and_release():
+    index = MemoryIndex()
+    assert index.claim("1")
+    assert not index.claim("1")
+    index.release("1")
+    assert index.claim("1")
+
+
+def test_downloaded_posts_are_not_claimed(tmp_path):
+    index = DownloadIndex(str(tmp_path / "index.sqlite3"))
+    assert index.claim("1")
+    index.add("1", "/media/a.jpg", 10, "abc")
+    index.release("1")
+    assert not index.claim("1")
+    assert index.get("1")["size"] == 10
+    assert index.get("2") is None
+    index.close()
+
+
+def test_index_survives_reopening(tmp_path):
+    path = str(tmp_path / "index.sqlite3")
+    index = DownloadIndex(path)
+    index.add("1", "/media/a.jpg", 10)
+    index.close()
+
+    index = DownloadIndex(path)
+    assert "1" in index
+    assert len(index) == 1
+    index.close()
+
+
+def test_media_post_id():
+    planner = PathPlanner("/media")
+    directory = "/media/1/2021/2021-01-01_00-00-00 "
+    assert media_post_id(directory + "123_4.jpg", planner) == "123_4"
+    assert media_post_id(directory + "123_4.mp4", planner) == "123_4"
+    assert media_post_id(directory + "123_4_2.mp4", planner) == "123_4_2"
+    assert media_post_id(directory + "123_4_2.m4a", planner) == "123_4_2_audio"
+    assert media_post_id(directory + "123_4.json", planner) is None
+    assert media_post_id("/media/1/2021/123_4.jpg", planner) is None
+
+
+def test_media_post_id_custom_template():
+    planner = PathPlanner("/media", "{username}/{post_id}/{date}")
+    path = "/media/user_1/123_4/2021-01-01"
+    assert media_post_id(path + ".jpg", planner) == "123_4"
+    assert media_post_id(path + "_2.mp4", planner) == "123_4_2"
+    assert media_post_id("/media/user_1/2021-01-01.jpg", planner) is None
+
+
+def test_rebuild_index(tmp_path):
+    directory = tmp_path / "media" / "1" / "2021"
+    os.makedirs(str(directory))
+    (directory / "2021-01-01_00-00-00 123_4.jpg").write_bytes(b"jpeg")
+    (directory / "2021-01-01_00-00-01 124_4.mp4").write_bytes(b"")
+    (directory / "2021-01-01_00-00-01 124_4.json").write_text("{}")
+    index = DownloadIndex(str(tmp_path / "index.sqlite3"))
+
+    assert rebuild_index(index, str(tmp_path / "media"), workers=2) == 1
+    assert index.get("123_4")["size"] == 4
+    assert "124_4" not in index
+    index.close()
+
+
+def test_rebuild_index_queues_a_window(tmp_path, monkeypatch):
+    directory = tmp_path / "media" / "1" / "2021"
+    os.makedirs(str(directory))
+    for n in range(50):
+        (directory / "2021-01-01_00-00-00 {}_4.jpg".format(n)).write_bytes(b"jpeg")
+    index = DownloadIndex(str(tmp_path / "index.sqlite3"))
+    scanned = []
+    queued = []
+    media_post_id = module.media_post_id
+    add = index.add
+
+    def scan(path, planner):
+        scanned.append(path)
+        return media_post_id(path, planner)
+
+    def record(*args):
+        queued.append(len(scanned) - len(index))
+        add(*args)
+
+    monkeypatch.setattr(module, "media_post_id", scan)
+    monkeypatch.setattr(index, "add", record)
+
+    assert rebuild_index(index, str(tmp_path / "media"), workers=2) == 50
+    assert max(queued) <= 2 * INDEX_REBUILD_WINDOW + 1
+    index.close()
+
+
+def test_rebuild_index_custom_template(tmp_path):
+    directory = tmp_path / "media" / "user1"
+    os.makedirs(str(directory))
+    (directory / "123_4.jpg").write_bytes(b"jpeg")
+    (directory / "123_4.json").write_text("{}")
+    index = DownloadIndex(str(tmp_path / "index.sqlite3"))
+
+    media = str(tmp_path / "media")
+    assert rebuild_index(index, media, 1, "{username}/{post_id}") == 1
+    assert index.get("123_4")["path"] == str(directory / "123_4.jpg")
+    index.close()
+
+
+def test_remove(tmp_path):
+    index = DownloadIndex(str(tmp_path / "index.sqlite3"))
+    index.add("1", "/media/a.jpg", 10)
+    index.remove("1")
+    assert "1" not in index
+    assert index.claim("1")
+    index.close()
+
+
+def test_known_in_bulk(tmp_path):
+    index = DownloadIndex(str(tmp_path / "index.sqlite3"))
+    for n in range(0, 1200, 2):
+        index.add(str(n), "/media/{}.jpg".format(n), 1)
+    found = index.known(str(a) for a in range(1200))
+    assert found == {str(a) for a in range(0, 1200, 2)}
+    assert index.known([]) == set()
+    assert MemoryIndex().known(["0"]) == set()
+    index.close()
+
+
+def test_carousel_files_are_known(instagram, mock_server, tmp_path):
+    instagram.index = DownloadIndex(str(tmp_path / "index.sqlite3"))
+    reel = mock_server.reel(1000)
+    carousel = dict(reel["items"][0], media_type=8, carousel_media=reel["items"])
+    reel["items"] = [carousel]
+
+    jobs = instagram._reel_jobs(reel)
+    assert [a.key for a in jobs] == [carousel["id"] + "_1", carousel["id"] + "_2"]
+    for job in jobs:
+        instagram.index.add(job.key, job.path, 1)
+
+    assert instagram._reel_jobs(reel) == []
+    assert instagram.stats["skipped"] == 1
+    instagram.index.close()
+
+
+def test_failed_audio_track_is_retried(instagram, mock_server, tmp_path):
+    instagram.index = DownloadIndex(str(tmp_path / "index.sqlite3"))
+    reel = mock_server.reel(1000)
+    item = reel["items"][1]
+    cdn = item.pop("video_versions")[0]["url"]
+    item["video_dash_manifest"] = (
+        '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011"><Period>'
+        '<AdaptationSet contentType="video"><Representation width="720" '
+        'height="1280"><BaseURL>{0}</BaseURL></Representation></AdaptationSet>'
+        '<AdaptationSet contentType="audio"><Representation bandwidth="1">'
+        "<BaseURL>{0}?audio</BaseURL></Representation></AdaptationSet>"
+        "</Period></MPD>"
+    ).format(cdn)
+    reel["items"] = [item]
+
+    video, audio = instagram._reel_jobs(reel)
+    assert audio.key == item["id"] + "_audio"
+    instagram.index.add(video.key, video.path, 1)
+    instagram.index.release(audio.key)
+
+    assert instagram._reel_jobs(reel) == [audio]
+    instagram.index.close()
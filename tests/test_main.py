@@ -0,0 +1,12 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFERRED = ["sqlite3", "gzip", "xml.etree.ElementTree", "signal", "email.utils"]
+
+
+def test_subcommand_imports_are_deferred():
+    code = "import sys, instagram.main; print(' '.join(sys.modules))"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT)
+    assert set(DEFERRED).isdisjoint(output.decode().split())
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from instagram.paths import open_file
+from instagram.paths import PathPlanner
+
+USER = {"pk": 1000, "username": "user1000"}
+ITEM = {"id": "5_1000", "taken_at": 1700000000}
+
+
+def test_default_template(tmp_path):
+    planner = PathPlanner(str(tmp_path))
+    path = os.path.join(str(tmp_path), "1000", "2023", "2023-11-14_22-13-20 5_1000")
+    assert planner.path(USER, ITEM) == path
+
+
+def test_custom_template(tmp_path):
+    planner = PathPlanner(str(tmp_path), "{username}/{date}/{post_id}")
+    path = planner.plan(USER, [ITEM])[0]
+    assert path == os.path.join(str(tmp_path), "user1000", "2023-11-14", "5_1000")
+    assert os.path.isdir(os.path.dirname(path))
+
+
+def test_invalid_template(tmp_path):
+    with pytest.raises(ValueError):
+        PathPlanner(str(tmp_path), "{user_id}/{datetime}")
+    with pytest.raises(ValueError):
+        PathPlanner(str(tmp_path), "{post_id}/{caption}")
+
+
+@pytest.mark.parametrize(
+    "template", ["{user_id}/{year}/{datetime} {post_id}", "{post_id}/{username}"]
+)
+def test_post_key_of_planned_paths(tmp_path, template):
+    planner = PathPlanner(str(tmp_path), template)
+    path = planner.path(USER, ITEM)
+    assert planner.post_key(path) == "5_1000"
+    assert planner.post_key(path + "_2") == "5_1000_2"
+    assert planner.post_key(os.path.join(str(tmp_path), "other", "5_1000")) is None
+
+
+def test_open_file_recreates_removed_directories(tmp_path):
+    directory = tmp_path / "a" / "b"
+    with open_file(str(directory / "1.json"), "w") as f:
+        f.write("{}")
+    os.remove(str(directory / "1.json"))
+    os.rmdir(str(directory))
+
+    with open_file(str(directory / "2.json"), "w") as f:
+        f.write("{}")
+    assert os.listdir(str(directory)) == ["2.json"]
+
+
+def test_format_filepath_takes_username_from_tray(instagram):
+    instagram.planner = PathPlanner(instagram.directory, "{username}/{post_id}")
+    instagram.tray_index = {"1000": {"user": USER}}
+
+    path = instagram.format_filepath(1000, ITEM["taken_at"], ITEM["id"])
+
+    assert path == os.path.join(instagram.directory, "user1000", "5_1000")
@@ -0,0 +1,104 @@
+import io
+import time
+import types
+
+import pytest
+import requests
+
+from instagram import instagram as module
+from instagram.ratelimit import backoff
+from instagram.ratelimit import retry_after
+from instagram.ratelimit import TokenBucket
+
+
+def response(status: int, **headers) -> requests.Response:
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update(headers)
+    result.url = "https://i.instagram.com/api/v1/feed/reels_tray/"
+    result.raw = io.BytesIO(b"")
+    return result
+
+
+def test_rate_is_halved_on_throttling_and_grows_back():
+    bucket = TokenBucket(8.0)
+    bucket.throttled()
+    assert bucket.rate == 4.0
+    bucket.succeeded()
+    assert bucket.rate == 4.4
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 8.0
+
+
+def test_rate_stays_above_minimum():
+    bucket = TokenBucket(8.0, min_rate=3.0)
+    for _ in range(10):
+        bucket.throttled()
+    assert bucket.rate == 3.0
+
+
+def test_retry_after_pauses_the_bucket():
+    bucket = TokenBucket(1000.0)
+    bucket.throttled(0.2)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.15
+
+
+def test_retry_after():
+    assert retry_after(response(429)) is None
+    assert retry_after(response(429, **{"Retry-After": "3"})) == 3.0
+    assert retry_after(response(429, **{"Retry-After": "-3"})) == 0.0
+    assert retry_after(response(429, **{"Retry-After": "soon"})) is None
+    date = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert retry_after(response(503, **{"Retry-After": date})) == 0.0
+
+
+def test_backoff_is_capped():
+    for attempt in range(3):
+        assert 0 <= backoff(attempt, base=1.0, cap=60.0) <= 2**attempt
+    assert backoff(50, base=1.0, cap=2.0) <= 2.0
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    """Instagram session whose requests are answered from `session.replies`."""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(module.time, "sleep", lambda delay: None)
+    config = {
+        "id": "1",
+        "media_directory": str(tmp_path / "media"),
+        "json_backup": str(tmp_path / "json"),
+        "headers": {"cookie": "sessionid=test"},
+    }
+    options = types.SimpleNamespace(retries=2, api_rate=1000.0, cdn_rate=1000.0)
+    instagram = module.Instagram(config, options)
+    instagram.replies = []
+    instagram.session.get = lambda url, **kwargs: instagram.replies.pop(0)
+    return instagram
+
+
+def test_transient_errors_are_retried(session):
+    session.replies = [response(503), response(429, **{"Retry-After": "0"})]
+    session.replies.append(response(200))
+
+    assert session._get("api", "https://i.instagram.com/").status_code == 200
+    assert session.stats["retries"] == 2
+    assert session.limiter["api"].rate < 1000.0
+
+
+def test_retries_are_capped(session):
+    session.replies = [response(503) for _ in range(4)]
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        session._get("api", "https://i.instagram.com/")
+    assert len(session.replies) == 1
+
+
+def test_client_errors_are_not_retried(session):
+    session.replies = [response(404), response(200)]
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        session._get("api", "https://i.instagram.com/")
+    assert len(session.replies) == 1
@@ -0,0 +1,77 @@
+import os
+import time
+
+from instagram.constants import CONTENT_TYPE_REEL
+from instagram.constants import CONTENT_TYPE_TRAY
+from instagram.index import DownloadIndex
+from instagram.reconcile import reconcile_account
+from instagram.utils import dump_response
+
+
+def save(instagram, content_type: str, content: dict):
+    dump_response(int(time.time()), content_type, content, instagram.json_backup)
+
+
+def test_missing_files_are_downloaded(instagram, mock_server):
+    reel = mock_server.reel(1000)
+    save(instagram, CONTENT_TYPE_REEL.format(1000), reel)
+
+    stats = reconcile_account(instagram, processes=1, dry_run=True)
+    assert (stats["reels"], stats["files"], stats["missing"]) == (1, 2, 2)
+    assert stats["requeued"] == 0
+
+    stats = reconcile_account(instagram, processes=1)
+    assert stats["requeued"] == 2
+    instagram.downloader.close()
+
+    stats = reconcile_account(instagram, processes=1, dry_run=True)
+    assert (stats["present"], stats["missing"]) == (2, 0)
+    path = instagram.format_filepath(1000, reel["items"][0]["taken_at"], "x")
+    assert len(os.listdir(os.path.dirname(path))) == 2
+
+
+def test_indexed_and_expired_files_are_not_requeued(instagram, mock_server, tmp_path):
+    instagram.index = DownloadIndex(str(tmp_path / "index.sqlite3"))
+    live = mock_server.reel(1000)
+    elsewhere = tmp_path / "other" / "a.jpg"
+    elsewhere.parent.mkdir()
+    elsewhere.write_bytes(b"jpeg")
+    instagram.index.add(live["items"][0]["id"], str(elsewhere), 4)
+    expired = mock_server.reel(1001)
+    for item in expired["items"]:
+        item["expiring_at"] = 1
+    save(instagram, CONTENT_TYPE_REEL.format(1000), live)
+    save(instagram, CONTENT_TYPE_REEL.format(1001), expired)
+
+    stats = reconcile_account(instagram, processes=1, dry_run=True)
+
+    assert (stats["files"], stats["indexed"], stats["expired"]) == (4, 1, 2)
+    assert stats["missing"] == 1
+    instagram.index.close()
+
+
+def test_stale_index_rows_are_requeued(instagram, mock_server, tmp_path):
+    instagram.index = DownloadIndex(str(tmp_path / "index.sqlite3"))
+    reel = mock_server.reel(1000)
+    key = reel["items"][0]["id"]
+    instagram.index.add(key, str(tmp_path / "media" / "gone.jpg"), 4)
+    save(instagram, CONTENT_TYPE_REEL.format(1000), reel)
+
+    stats = reconcile_account(instagram, processes=1, dry_run=True)
+    assert (stats["indexed"], stats["stale"], stats["missing"]) == (0, 1, 2)
+    assert key in instagram.index
+
+    stats = reconcile_account(instagram, processes=1)
+    assert stats["requeued"] == 2
+    instagram.downloader.close()
+    assert instagram.index.get(key)["path"] != str(tmp_path / "media" / "gone.jpg")
+    instagram.index.close()
+
+
+def test_reels_saved_in_the_tray(instagram, mock_server):
+    tray = {"tray": [mock_server.reel(1000), mock_server.reel(1001, items=False)]}
+    save(instagram, CONTENT_TYPE_TRAY.format(instagram.id), tray)
+
+    stats = reconcile_account(instagram, processes=1, dry_run=True)
+
+    assert (stats["reels"], stats["missing"]) == (1, 2)
@@ -0,0 +1,29 @@
+from instagram.rendition import pick
+
+CANDIDATES = [
+    {"width": 720, "height": 1280, "url": "720", "type": 101},
+    {"width": 480, "height": 854, "url": "480", "type": 102},
+    {"width": 1080, "height": 1920, "url": "1080", "type": 101},
+    {"width": 1080, "height": 1920, "url": "1080-hq", "type": 103},
+    {"width": 2160, "height": 3840, "url": None},
+]
+
+
+def test_best_and_smallest():
+    assert pick(CANDIDATES)["url"] == "1080-hq"
+    assert pick(CANDIDATES, "smallest")["url"] == "480"
+    assert pick(CANDIDATES, "thumbnail")["url"] == "480"
+
+
+def test_max_height():
+    assert pick(CANDIDATES, max_height=1280)["url"] == "720"
+    assert pick(CANDIDATES, "smallest", max_height=1280)["url"] == "480"
+
+
+def test_smallest_is_used_if_none_fits():
+    assert pick(CANDIDATES, max_height=100)["url"] == "480"
+
+
+def test_no_candidates():
+    assert pick(None) is None
+    assert pick([{"width": 1080, "height": 1920}]) is None
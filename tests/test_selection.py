@@ -0,0 +1,46 @@
+import os
+
+from instagram.selection import Rules
+from instagram.selection import Selection
+from instagram.selection import UserList
+
+TRAY = {
+    "1": {"user": {"pk": 1, "username": "one"}},
+    "2": {"user": {"pk": 2, "username": "two"}},
+    "3": {"user": {"pk": 3, "username": "three"}},
+}
+
+
+def test_select():
+    rules = Rules(frozenset(), (frozenset({"2"}), frozenset()))
+    assert rules.select(TRAY) == (["1", "3"], ["two (2)"])
+
+    rules = Rules(frozenset({"1", "2"}), (frozenset(), frozenset({"2"})))
+    assert rules.select(TRAY) == (["1"], ["two (2)", "three (3)"])
+
+
+def test_user_list_is_reloaded_when_changed(tmp_path):
+    path = tmp_path / "include.txt"
+    users = UserList(str(path))
+    assert users.get() == frozenset()
+
+    path.write_text("1 # one\n2\nnot an id\n")
+    assert users.get() == {"1", "2"}
+
+    path.write_text("3\n")
+    os.utime(str(path), ns=(0, 1))
+    assert users.get() == {"3"}
+
+    path.unlink()
+    assert users.get() == frozenset()
+
+
+def test_account_lists(tmp_path):
+    path = tmp_path / "exclude.txt"
+    path.write_text("3\n")
+    selection = Selection(exclude=str(path))
+
+    rules = selection.rules({"id": "a", "exclude": [1]})
+    assert rules.select(TRAY)[0] == ["2"]
+    rules = selection.rules({"id": "b", "include": [1, 3]})
+    assert rules.select(TRAY)[0] == ["1"]
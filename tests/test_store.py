@@ -0,0 +1,69 @@
+import hashlib
+import os
+import time
+
+from instagram.index import DownloadIndex
+from instagram.media import Job
+from instagram.store import ContentStore
+
+
+def commit(store, tmp_path, name: str, body: bytes) -> str:
+    part = tmp_path / (name + ".part")
+    part.write_bytes(body)
+    dest = str(tmp_path / "media" / name)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    store.commit(str(part), dest, hashlib.sha256(body).hexdigest())
+    return dest
+
+
+def test_duplicates_share_a_blob(tmp_path):
+    store = ContentStore(str(tmp_path / "store"))
+    a = commit(store, tmp_path, "a.jpg", b"x" * 100)
+    b = commit(store, tmp_path, "b.jpg", b"x" * 100)
+    commit(store, tmp_path, "c.jpg", b"y" * 10)
+
+    assert os.path.samefile(a, b)
+    assert store.usage() == {"blobs": 2, "size": 110, "saved": 100}
+
+
+def test_copies_save_nothing(tmp_path, monkeypatch):
+    store = ContentStore(str(tmp_path / "store"))
+
+    def refuse(src, dst):
+        raise OSError("cross-device link")
+
+    monkeypatch.setattr(os, "link", refuse)
+    commit(store, tmp_path, "a.jpg", b"x" * 100)
+    commit(store, tmp_path, "b.jpg", b"x" * 100)
+
+    assert store.usage() == {"blobs": 1, "size": 100, "saved": 0}
+
+
+def test_potential_savings(tmp_path):
+    index = DownloadIndex(str(tmp_path / "index.sqlite3"))
+    index.add("1", "/media/a.jpg", 100, "abc")
+    index.add("2", "/media/b.jpg", 100, "abc")
+    index.add("3", "/media/c.jpg", 10, "def")
+
+    assert index.dedup_stats() == {
+        "files": 3,
+        "blobs": 2,
+        "logical": 210,
+        "unique": 110,
+        "potential": 100,
+    }
+    index.close()
+
+
+def test_rejected_download_removes_its_blob(instagram, mock_server, tmp_path):
+    instagram.store = ContentStore(str(tmp_path / "store"))
+    url = "http://127.0.0.1:{}/cdn/1000_1_l.jpg".format(mock_server.server_address[1])
+    dest = str(tmp_path / "media" / "a.jpg")
+    entry = instagram.download_file(url, dest)
+    job = Job("1_1", "1_1", url, dest, time.time() + 60, None, None)
+
+    assert instagram._rejected(job, entry, "truncated", 0)
+    assert not os.path.exists(dest)
+    assert not os.path.exists(instagram.store.blob_path(entry["checksum"]))
+    assert instagram.download_file(url, dest) is not None
+    assert instagram.stats["deduplicated"] == 0
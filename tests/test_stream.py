@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+
+from instagram.stream import JsonStream
+from instagram.stream import ResponseFile
+from instagram.stream import TrayEntry
+
+
+DOCUMENT = {
+    "status": "ok",
+    "tray": [{"id": 0, "note": "not the reels"}],
+    "reels": {
+        "1": {"id": 1, "items": [{"caption": 'a "quoted" {brace} [x]'}]},
+        "2": {"id": 2, "items": [], "path": "C:\\temp\\", "name": "caf\u00e9"},
+        "3": {"id": 3, "nested": {"reels": {"4": {}}}},
+    },
+    "more_available": False,
+}
+
+
+def parse(data: bytes, key: str, size: int) -> list:
+    stream = JsonStream(key)
+    found = []
+    for i in range(0, len(data), size):
+        found += stream.feed(data[i : i + size])
+    return [(a, json.loads(b)) for a, b in found]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16, 64, 100000])
+def test_object_members_at_every_chunk_size(size):
+    data = json.dumps(DOCUMENT).encode()
+    assert parse(data, "reels", size) == list(DOCUMENT["reels"].items())
+
+
+@pytest.mark.parametrize("size", [1, 5, 100000])
+def test_array_elements(size):
+    data = json.dumps(DOCUMENT, ensure_ascii=False).encode()
+    assert parse(data, "tray", size) == [(None, a) for a in DOCUMENT["tray"]]
+
+
+def test_missing_key():
+    assert parse(json.dumps(DOCUMENT).encode(), "absent", 10) == []
+
+
+def test_tray_entry_keeps_complete_prefetched_reels():
+    user = {"pk": 1, "username": "a", "full_name": "dropped"}
+    entry = {"user": user, "media_count": 2, "prefetch_count": 2, "items": [1, 2]}
+    tray = TrayEntry(dict(entry, expiring_at=5))
+    assert tray["user"] == {"pk": 1, "username": "a"}
+    assert tray["expiring_at"] == 5
+    assert tray.get("items") == [1, 2]
+    assert "items" not in TrayEntry(dict(entry, items=[1]))
+    assert "items" not in TrayEntry(dict(entry, prefetch_count=0))
+
+
+def test_tray_entry_behaves_like_a_dict():
+    entry = TrayEntry({"user": {"pk": 1, "username": "a"}, "media_count": None})
+    assert entry["media_count"] is None
+    assert entry.get("media_count", 5) is None
+    assert "media_count" in entry
+    assert "expiring_at" not in entry
+    assert entry.get("expiring_at", 7) == 7
+    with pytest.raises(KeyError):
+        entry["expiring_at"]
+
+
+def test_response_file(tmp_path):
+    path = str(tmp_path / "json" / "tray.json")
+    response = ResponseFile(path)
+    response.write(b"{}")
+    response.close()
+    assert open(path).read() == "{}"
+
+    aborted = ResponseFile(str(tmp_path / "json" / "reel.json"))
+    aborted.write(b"{")
+    aborted.abort()
+    assert os.listdir(str(tmp_path / "json")) == ["tray.json"]
@@ -0,0 +1,97 @@
+import json
+import os
+
+import pytest
+from mock_server import synthetic_media
+
+from instagram.verify import check_media
+from instagram.verify import Verifier
+
+
+@pytest.fixture(params=[(".jpg", 1080, 1920), (".mp4", 720, 1280)])
+def sample(request, tmp_path):
+    ext, width, height = request.param
+    path = tmp_path / ("media" + ext)
+    path.write_bytes(synthetic_media(ext, 30000, width, height))
+    return str(path), width, height
+
+
+def test_complete_file(sample):
+    assert check_media(*sample) is None
+
+
+def test_size_within_tolerance_and_rotated(sample):
+    path, width, height = sample
+    assert check_media(path, width + 1, height - 2) is None
+    assert check_media(path, height, width) is None
+
+
+def test_wrong_size(sample):
+    path, width, height = sample
+    assert "instead of" in check_media(path, width * 2, height)
+
+
+def test_truncated(sample):
+    path, width, height = sample
+    with open(path, "r+b") as f:
+        f.truncate(20000)
+    assert check_media(path, width, height) is not None
+
+
+def test_mdat_missing(tmp_path):
+    path = tmp_path / "media.mp4"
+    data = synthetic_media(".mp4", 30000, 720, 1280)
+    path.write_bytes(data[: data.index(b"mdat") - 4])
+    assert check_media(str(path)) == "MP4 mdat atom missing"
+
+
+def test_not_media(tmp_path):
+    for ext in (".jpg", ".mp4"):
+        path = tmp_path / ("page" + ext)
+        path.write_bytes(b"<html>expired</html>" * 100)
+        assert check_media(str(path)) is not None
+
+
+def test_empty_and_missing(tmp_path):
+    path = tmp_path / "empty.jpg"
+    path.write_bytes(b"")
+    assert check_media(str(path)) == "empty file"
+    assert check_media(str(tmp_path / "missing.mp4")) is not None
+
+
+def test_other_files_are_not_checked(tmp_path):
+    path = tmp_path / "story.json"
+    path.write_text("{}")
+    assert check_media(str(path)) is None
+
+
+def test_check_tree(tmp_path):
+    directory = tmp_path / "1" / "2023"
+    os.makedirs(str(directory))
+    good = directory / "2023-11-14_22-13-20 5_1.jpg"
+    good.write_bytes(synthetic_media(".jpg", 3000, 1080, 1920))
+    (directory / "2023-11-14_22-13-20 5_1.json").write_text(
+        json.dumps({"rendition": {"width": 1080, "height": 1920}})
+    )
+    bad = directory / "2023-11-14_22-13-21 6_1.jpg"
+    bad.write_bytes(synthetic_media(".jpg", 3000, 640, 480))
+    (directory / "2023-11-14_22-13-21 6_1.json").write_text(
+        json.dumps({"rendition": {"width": 1080, "height": 1920}})
+    )
+
+    verifier = Verifier(workers=1)
+    try:
+        found = dict(verifier.check_tree(str(tmp_path), chunksize=1))
+        assert verifier.submit(str(good), 1080, 1920).result() is None
+    finally:
+        verifier.close()
+
+    assert found == {str(good): None, str(bad): "640x480 instead of 1080x1920"}
+
+
+def test_mock_server_media(mock_server, tmp_path):
+    sizes = {"_s.jpg": (320, 568), "_l.jpg": (1080, 1920), "_l.mp4": (720, 1280)}
+    for name, body in mock_server.media.items():
+        path = tmp_path / ("media" + name)
+        path.write_bytes(body)
+        assert check_media(str(path), *sizes[name]) is None